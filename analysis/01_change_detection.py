@@ -14,31 +14,46 @@ Outputs:
 - outputs/change_maps/nbr_change.tif
 - outputs/change_maps/ndmi_change.tif
 - outputs/change_maps/stress_score.tif
+- outputs/change_maps/ndvi_z.tif, nbr_z.tif, ndmi_z.tif (standardized anomalies, with a climatology)
 - outputs/change_maps/change_summary.png
 """
 
 import numpy as np
 import rasterio
-from rasterio.enums import Resampling
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from pathlib import Path
 import json
+import os
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'application'))
+from analysis.climatology import Climatology, INDEX_FILE as CLIMATOLOGY_INDEX
+from analysis.fuel_stages import stress_components, anomaly_stress_components
+from datetime import date
+from utils.scaled import write_layer
+from utils.warp import WarpPlan
 
 print("="*70)
 print("STEP 1: CHANGE DETECTION ANALYSIS")
 print("="*70)
 
-# Paths
+# Paths (FUELMAP_* overrides are set per fire by the batch runner)
 DATA_DIR = Path("data/satellite")
-OUTPUT_DIR = Path("outputs/change_maps")
+OUTPUT_ROOT = Path(os.environ.get("FUELMAP_OUTPUT_DIR", "outputs"))
+OUTPUT_DIR = OUTPUT_ROOT / "change_maps"
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
 
 # Input files
-SENTINEL_PREFIRE = DATA_DIR / "hermits_peak_prefire_2020_2022.tif"
-MODIS_PREFIRE = DATA_DIR / "hermits_peak_modis_prefire.tif"
-MODIS_POSTFIRE = DATA_DIR / "hermits_peak_modis_postfire.tif"
+SENTINEL_PREFIRE = Path(os.environ.get("FUELMAP_SENTINEL_PREFIRE", DATA_DIR / "hermits_peak_prefire_2020_2022.tif"))
+MODIS_PREFIRE = Path(os.environ.get("FUELMAP_MODIS_PREFIRE", DATA_DIR / "hermits_peak_modis_prefire.tif"))
+MODIS_POSTFIRE = Path(os.environ.get("FUELMAP_MODIS_POSTFIRE", DATA_DIR / "hermits_peak_modis_postfire.tif"))
+# Optional: per-pixel day-of-year climatology from application/analysis/climatology.py
+CLIMATOLOGY_DIR = Path(os.environ.get("FUELMAP_CLIMATOLOGY", OUTPUT_ROOT / "climatology"))
+STRESS_DATE = date.fromisoformat(os.environ.get("FUELMAP_FIRE_START", "2022-04-06"))
+# float32, or scaled: layers stored as int16 x 10000 (see application/utils/scaled.py)
+STORAGE = os.environ.get("FUELMAP_STORAGE", "float32")
 
 # Check files exist
 print("\n1. Checking input files...")
@@ -64,6 +79,7 @@ with rasterio.open(SENTINEL_PREFIRE) as src:
     # Store metadata for writing outputs
     profile = src.profile.copy()
     profile.update(count=1, dtype='float32', compress='lzw')
+    s2_transform, s2_crs = src.transform, src.crs
 
     print(f"  Dimensions: {src.width} x {src.height} pixels")
     print(f"  NDVI range: {np.nanmin(ndvi):.3f} to {np.nanmax(ndvi):.3f}")
@@ -71,18 +87,19 @@ with rasterio.open(SENTINEL_PREFIRE) as src:
     print(f"  NDMI range: {np.nanmin(ndmi):.3f} to {np.nanmax(ndmi):.3f}")
 
 print("\n3. Loading MODIS data for temporal analysis...")
+# MODIS is resampled onto the Sentinel-2 grid through its georeferencing
+# (bilinear, tile by tile, reading only the MODIS pixels under each tile);
+# the warp plan is reused when both composites share a grid
 with rasterio.open(MODIS_PREFIRE) as src_modis_pre:
+    modis_plan = WarpPlan.between(src_modis_pre, profile)
+    modis_grid = (src_modis_pre.crs, src_modis_pre.transform, src_modis_pre.shape)
     # MODIS NDVI needs scaling
-    modis_ndvi_pre = src_modis_pre.read(1,
-        out_shape=(profile['height'], profile['width']),
-        resampling=Resampling.bilinear
-    ) * 0.0001
+    modis_ndvi_pre = modis_plan.read(src_modis_pre, 1, scale=0.0001)
 
 with rasterio.open(MODIS_POSTFIRE) as src_modis_post:
-    modis_ndvi_post = src_modis_post.read(1,
-        out_shape=(profile['height'], profile['width']),
-        resampling=Resampling.bilinear
-    ) * 0.0001
+    if (src_modis_post.crs, src_modis_post.transform, src_modis_post.shape) != modis_grid:
+        modis_plan = WarpPlan.between(src_modis_post, profile)
+    modis_ndvi_post = modis_plan.read(src_modis_post, 1, scale=0.0001)
 
 print(f"  MODIS pre-fire NDVI mean: {np.nanmean(modis_ndvi_pre):.3f}")
 print(f"  MODIS post-fire NDVI mean: {np.nanmean(modis_ndvi_post):.3f}")
@@ -114,31 +131,32 @@ print("\n5. Identifying stressed areas...")
 # - NDMI > 0.2
 # - NBR > 0.3
 
-# Calculate stress scores (0-1, where 1 = highly stressed)
-ndvi_stress = np.where(ndvi > 0, (0.7 - ndvi) / 0.7, 0)
-ndvi_stress = np.clip(ndvi_stress, 0, 1)
-
-ndmi_stress = np.where(ndmi > 0, (0.5 - ndmi) / 0.5, 0)
-ndmi_stress = np.clip(ndmi_stress, 0, 1)
-
-nbr_stress = np.where(nbr > 0, (0.6 - nbr) / 0.6, 0)
-nbr_stress = np.clip(nbr_stress, 0, 1)
-
-# Combined stress score (weighted average)
+# Calculate stress scores (0-1, where 1 = highly stressed) and combine them
+# as a weighted average (see application/analysis/fuel_stages.py):
 # NDVI is most important for vegetation health
 # NDMI important for fire risk (dry vegetation)
 # NBR sensitive to fuel conditions
-stress_score = (
-    0.4 * ndvi_stress +
-    0.35 * ndmi_stress +
-    0.25 * nbr_stress
-)
-
-# For change maps, we'll compare against typical healthy values
+#
+# For change maps, we compare against typical healthy values
 # This shows deviation from expected healthy conditions
-ndvi_change = 0.7 - ndvi  # How much below healthy threshold
-nbr_change = 0.6 - nbr
-ndmi_change = 0.5 - ndmi
+#
+# With a climatology, each pixel is instead compared with its own normal for
+# the date: stress is the standardized anomaly (z-score) below the normal,
+# and pixels with too short a record keep the fixed healthy values
+if (CLIMATOLOGY_DIR / CLIMATOLOGY_INDEX).exists():
+    climatology = Climatology(CLIMATOLOGY_DIR)
+    normals = {name: climatology.normals_on(name, STRESS_DATE, s2_transform, ndvi.shape, s2_crs)
+               for name in ('NDVI', 'NBR', 'NDMI')}
+    stress = anomaly_stress_components(ndvi, nbr, ndmi, normals)
+    covered = np.isfinite(stress['ndvi_z'])
+    print(f"  ✓ Climatology: {CLIMATOLOGY_DIR} ({len(climatology.dates)} dates), "
+          f"anomalies for {STRESS_DATE}, {covered.mean() * 100:.1f}% of pixels covered")
+else:
+    stress = stress_components(ndvi, nbr, ndmi)
+stress_score = stress['stress_score']
+ndvi_change = stress['ndvi_change']  # How much below healthy threshold
+nbr_change = stress['nbr_change']
+ndmi_change = stress['ndmi_change']
 
 print(f"  Areas with high stress (>0.5): {np.sum(stress_score > 0.5) / stress_score.size * 100:.1f}%")
 print(f"  Areas with moderate stress (0.3-0.5): {np.sum((stress_score > 0.3) & (stress_score <= 0.5)) / stress_score.size * 100:.1f}%")
@@ -147,25 +165,27 @@ print(f"  Areas with low stress (<0.3): {np.sum(stress_score <= 0.3) / stress_sc
 print("\n6. Saving change maps...")
 
 # Save NDVI change
-with rasterio.open(OUTPUT_DIR / "ndvi_change.tif", 'w', **profile) as dst:
-    dst.write(ndvi_change.astype('float32'), 1)
+write_layer(OUTPUT_DIR / "ndvi_change.tif", ndvi_change, profile, STORAGE)
 print(f"  ✓ Saved ndvi_change.tif")
 
 # Save NBR change
-with rasterio.open(OUTPUT_DIR / "nbr_change.tif", 'w', **profile) as dst:
-    dst.write(nbr_change.astype('float32'), 1)
+write_layer(OUTPUT_DIR / "nbr_change.tif", nbr_change, profile, STORAGE)
 print(f"  ✓ Saved nbr_change.tif")
 
 # Save NDMI change
-with rasterio.open(OUTPUT_DIR / "ndmi_change.tif", 'w', **profile) as dst:
-    dst.write(ndmi_change.astype('float32'), 1)
+write_layer(OUTPUT_DIR / "ndmi_change.tif", ndmi_change, profile, STORAGE)
 print(f"  ✓ Saved ndmi_change.tif")
 
 # Save stress score
-with rasterio.open(OUTPUT_DIR / "stress_score.tif", 'w', **profile) as dst:
-    dst.write(stress_score.astype('float32'), 1)
+write_layer(OUTPUT_DIR / "stress_score.tif", stress_score, profile, STORAGE)
 print(f"  ✓ Saved stress_score.tif")
 
+# Save standardized anomalies (climatology runs only)
+for name in ('ndvi_z', 'nbr_z', 'ndmi_z'):
+    if name in stress:
+        write_layer(OUTPUT_DIR / f"{name}.tif", stress[name], profile, STORAGE)
+        print(f"  ✓ Saved {name}.tif")
+
 print("\n7. Creating visualizations...")
 
 # Downsample for faster visualization
@@ -30,19 +30,25 @@ import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap, BoundaryNorm
 from pathlib import Path
 import json
+import os
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'application'))
+from analysis.fuel_stages import burn_severity as classify_burn_severity
 
 print("="*70)
 print("STEP 2: BURN SEVERITY ANALYSIS")
 print("="*70)
 
-# Paths
+# Paths (FUELMAP_* overrides are set per fire by the batch runner)
 DATA_DIR = Path("data/satellite")
-OUTPUT_DIR = Path("outputs/burn_severity")
+OUTPUT_DIR = Path(os.environ.get("FUELMAP_OUTPUT_DIR", "outputs")) / "burn_severity"
+FIRE_NAME = os.environ.get("FUELMAP_FIRE_NAME", "Hermits Peak Fire")
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
 
 # Input files
-SENTINEL_PREFIRE = DATA_DIR / "hermits_peak_prefire_2020_2022.tif"
-SENTINEL_POSTFIRE = DATA_DIR / "hermits_peak_postfire_2022.tif"
+SENTINEL_PREFIRE = Path(os.environ.get("FUELMAP_SENTINEL_PREFIRE", DATA_DIR / "hermits_peak_prefire_2020_2022.tif"))
+SENTINEL_POSTFIRE = Path(os.environ.get("FUELMAP_SENTINEL_POSTFIRE", DATA_DIR / "hermits_peak_postfire_2022.tif"))
 
 # Check files exist
 print("\n1. Checking input files...")
@@ -52,7 +58,7 @@ for filepath in [SENTINEL_PREFIRE, SENTINEL_POSTFIRE]:
     else:
         print(f"  ✗ MISSING: {filepath.name}")
         print(f"\nERROR: Post-fire data is required!")
-        print(f"Please ensure hermits_peak_postfire_2022.tif is in {DATA_DIR}/")
+        print(f"Please ensure {SENTINEL_POSTFIRE.name} is in {SENTINEL_POSTFIRE.parent}/")
         exit(1)
 
 print("\n2. Loading pre-fire data...")
@@ -79,32 +85,19 @@ with rasterio.open(SENTINEL_POSTFIRE) as src:
 print("\n4. Calculating dNBR (differenced NBR)...")
 # dNBR = NBR_prefire - NBR_postfire
 # Higher values indicate more severe burns
-dnbr = nbr_prefire - nbr_postfire
+# Invalid values are masked to NaN
+dnbr, burn_severity = classify_burn_severity(nbr_prefire, nbr_postfire)
 
 print(f"  dNBR range: {np.nanmin(dnbr):.3f} to {np.nanmax(dnbr):.3f}")
 print(f"  dNBR mean: {np.nanmean(dnbr):.3f}")
 
-# Mask invalid values
-dnbr = np.where(np.isfinite(dnbr), dnbr, np.nan)
-
 print("\n5. Classifying burn severity...")
-# USGS burn severity classification
-burn_severity = np.zeros_like(dnbr)
-
+# USGS burn severity classification (computed above):
 # 0 = Unburned (dNBR < 0.1)
-burn_severity[dnbr < 0.1] = 0
-
 # 1 = Low severity (0.1 <= dNBR < 0.27)
-burn_severity[(dnbr >= 0.1) & (dnbr < 0.27)] = 1
-
 # 2 = Moderate-low severity (0.27 <= dNBR < 0.44)
-burn_severity[(dnbr >= 0.27) & (dnbr < 0.44)] = 2
-
 # 3 = Moderate-high severity (0.44 <= dNBR < 0.66)
-burn_severity[(dnbr >= 0.44) & (dnbr < 0.66)] = 3
-
 # 4 = High severity (dNBR >= 0.66)
-burn_severity[dnbr >= 0.66] = 4
 
 # Calculate percentages
 total_pixels = np.sum(np.isfinite(dnbr))
@@ -144,7 +137,7 @@ def downsample(arr, factor=5):
     return arr[::factor, ::factor]
 
 fig, axes = plt.subplots(2, 2, figsize=(16, 14))
-fig.suptitle('Hermits Peak Fire - Burn Severity Analysis', fontsize=16, fontweight='bold')
+fig.suptitle(f'{FIRE_NAME} - Burn Severity Analysis', fontsize=16, fontweight='bold')
 
 # NBR Pre-fire
 ax1 = axes[0, 0]
@@ -19,6 +19,10 @@ Outputs:
 - outputs/enhanced_fuel/fuel_risk_score.tif
 - outputs/enhanced_fuel/comparison_map.png
 - outputs/enhanced_fuel/enhancement_statistics.json
+- outputs/enhanced_fuel/native_10m/*.tif (same products on the Sentinel-2 grid,
+  with FUELMAP_OUTPUT_GRID=sentinel2)
+- outputs/enhanced_fuel/stress_heterogeneity.tif (10 m stress mean/std/min/max/fraction high
+  per 30 m cell, when the grids nest)
 """
 
 import numpy as np
@@ -29,22 +33,45 @@ matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from pathlib import Path
 import json
+import os
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'application'))
+from analysis.fuel_stages import fuel_risk, enhanced_fuel, disturbance_stress, risk_weighting
+from utils.scaled import RISK, read_layer, reproject_layer, write_layer
+from utils.tiling import iter_tiles
+from utils.warp import AGGREGATE_STATS, WarpPlan, nesting_factor, aggregate_windows
+from contextlib import ExitStack
 
 print("="*70)
 print("STEP 3: ENHANCED FUEL MAP CREATION")
 print("="*70)
 
-# Paths
+# Paths (FUELMAP_* overrides are set per fire by the batch runner)
 LANDFIRE_DIR = Path("data/landfire")
-CHANGE_DIR = Path("outputs/change_maps")
-OUTPUT_DIR = Path("outputs/enhanced_fuel")
+OUTPUT_ROOT = Path(os.environ.get("FUELMAP_OUTPUT_DIR", "outputs"))
+CHANGE_DIR = OUTPUT_ROOT / "change_maps"
+OUTPUT_DIR = OUTPUT_ROOT / "enhanced_fuel"
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
 
 # Input files
-LANDFIRE_FILE = LANDFIRE_DIR / "LF2020_HermitsPeak_multiband.tif"
+LANDFIRE_FILE = Path(os.environ.get("FUELMAP_LANDFIRE", LANDFIRE_DIR / "LF2020_HermitsPeak_multiband.tif"))
 STRESS_SCORE = CHANGE_DIR / "stress_score.tif"
 NDVI_CHANGE = CHANGE_DIR / "ndvi_change.tif"
 NDMI_CHANGE = CHANGE_DIR / "ndmi_change.tif"
+# Optional: per-pixel vegetation breaks from application/analysis/changepoints.py
+VEGETATION_BREAKS = Path(os.environ.get("FUELMAP_VEGETATION_BREAKS",
+                                        OUTPUT_ROOT / "trends" / "vegetation_breaks.tif"))
+
+# Optional: also write the products at 10 m on the Sentinel-2 grid
+OUTPUT_GRID = os.environ.get("FUELMAP_OUTPUT_GRID", "landfire")
+NATIVE_DIR = OUTPUT_DIR / "native_10m"
+
+# float32, or scaled: fuel risk stored as uint8 half points (see application/utils/scaled.py)
+STORAGE = os.environ.get("FUELMAP_STORAGE", "float32")
+
+# Stress above this counts as high stress (same cut as the 01 summary)
+HIGH_STRESS = 0.5
 
 # Check files exist
 print("\n1. Checking input files...")
@@ -84,70 +111,96 @@ print(f"  LANDFIRE CRS: {landfire_crs}")
 
 print("\n4. Reprojecting stress data to match LANDFIRE...")
 # Need to reproject satellite data to LANDFIRE coordinate system
-
-# Read stress score
-with rasterio.open(STRESS_SCORE) as src:
-    stress_score_orig = src.read(1)
-
-# Reproject stress to LANDFIRE grid
-stress_score_reproj = np.empty((landfire_profile['height'], landfire_profile['width']), dtype=np.float32)
-
-with rasterio.open(STRESS_SCORE) as src:
-    reproject(
-        source=rasterio.band(src, 1),
-        destination=stress_score_reproj,
-        src_transform=stress_transform,
-        src_crs=stress_crs,
-        dst_transform=landfire_transform,
-        dst_crs=landfire_crs,
-        resampling=Resampling.bilinear
-    )
-
-print(f"  ✓ Stress data reprojected to LANDFIRE grid")
-print(f"  Stress score range after reprojection: {np.nanmin(stress_score_reproj):.3f} to {np.nanmax(stress_score_reproj):.3f}")
-
-# Reproject NDVI change
-ndvi_change_reproj = np.empty_like(stress_score_reproj)
-with rasterio.open(NDVI_CHANGE) as src:
-    reproject(
-        source=rasterio.band(src, 1),
-        destination=ndvi_change_reproj,
-        src_transform=stress_transform,
-        src_crs=stress_crs,
-        dst_transform=landfire_transform,
-        dst_crs=landfire_crs,
-        resampling=Resampling.bilinear
-    )
-
-# Reproject NDMI change
-ndmi_change_reproj = np.empty_like(stress_score_reproj)
-with rasterio.open(NDMI_CHANGE) as src:
-    reproject(
-        source=rasterio.band(src, 1),
-        destination=ndmi_change_reproj,
-        src_transform=stress_transform,
-        src_crs=stress_crs,
-        dst_transform=landfire_transform,
-        dst_crs=landfire_crs,
-        resampling=Resampling.bilinear
-    )
+#
+# When the 10 m grid nests in the 30 m LANDFIRE grid (same CRS, 3 x 3 pixels
+# per cell), each cell is the mean of its own 10 m pixels and the spread of
+# stress inside it is kept as heterogeneity features; otherwise bilinear warp
+nesting = nesting_factor(stress_crs, stress_transform, landfire_crs, landfire_transform)
+landfire_shape = (landfire_profile['height'], landfire_profile['width'])
+stress_heterogeneity = None
+
+
+def aggregate_layer(path, threshold=None):
+    """Aggregate a 10 m layer onto the LANDFIRE grid, decoding one strip at a time"""
+    with rasterio.open(path) as src:
+        return aggregate_windows(lambda window: read_layer(src, 1, window), (src.height, src.width),
+                                 nesting, landfire_shape, threshold=threshold)
+
+
+if nesting is not None:
+    stress_heterogeneity = aggregate_layer(STRESS_SCORE, threshold=HIGH_STRESS)
+    stress_score_reproj = stress_heterogeneity['mean']
+    ndvi_change_reproj = aggregate_layer(NDVI_CHANGE)['mean']
+    ndmi_change_reproj = aggregate_layer(NDMI_CHANGE)['mean']
+    print(f"  ✓ Stress data aggregated {nesting[0]}x{nesting[0]} onto the LANDFIRE grid")
+    print(f"  Stress score range after aggregation: {np.nanmin(stress_score_reproj):.3f} to {np.nanmax(stress_score_reproj):.3f}")
+    print(f"  Mean within-cell stress std: {np.nanmean(stress_heterogeneity['std']):.3f}")
+else:
+    # Reproject stress to LANDFIRE grid (the stored band is warped and the
+    # result decoded, so scaled-integer inputs are never decoded at 10 m)
+    stress_score_reproj = np.empty((landfire_profile['height'], landfire_profile['width']), dtype=np.float32)
+    with rasterio.open(STRESS_SCORE) as src:
+        reproject_layer(
+            src, stress_score_reproj,
+            dst_transform=landfire_transform,
+            dst_crs=landfire_crs,
+            resampling=Resampling.bilinear
+        )
+
+    print(f"  ✓ Stress data reprojected to LANDFIRE grid")
+    print(f"  Stress score range after reprojection: {np.nanmin(stress_score_reproj):.3f} to {np.nanmax(stress_score_reproj):.3f}")
+
+    # Reproject NDVI change
+    ndvi_change_reproj = np.empty_like(stress_score_reproj)
+    with rasterio.open(NDVI_CHANGE) as src:
+        reproject_layer(
+            src, ndvi_change_reproj,
+            dst_transform=landfire_transform,
+            dst_crs=landfire_crs,
+            resampling=Resampling.bilinear
+        )
+
+    # Reproject NDMI change
+    ndmi_change_reproj = np.empty_like(stress_score_reproj)
+    with rasterio.open(NDMI_CHANGE) as src:
+        reproject_layer(
+            src, ndmi_change_reproj,
+            dst_transform=landfire_transform,
+            dst_crs=landfire_crs,
+            resampling=Resampling.bilinear
+        )
+
+# Vegetation breaks (die-off / beetle kill dates and magnitudes), if computed
+disturbance = None
+if VEGETATION_BREAKS.exists():
+    break_layers = {}
+    with rasterio.open(VEGETATION_BREAKS) as src:
+        for name in ('break_magnitude', 'break_confidence'):
+            layer = np.full_like(stress_score_reproj, np.nan)
+            reproject(
+                source=rasterio.band(src, src.descriptions.index(name) + 1),
+                destination=layer,
+                src_transform=src.transform,
+                src_crs=src.crs,
+                dst_transform=landfire_transform,
+                dst_crs=landfire_crs,
+                dst_nodata=np.nan,
+                resampling=Resampling.bilinear
+            )
+            break_layers[name] = layer
+    disturbance = disturbance_stress(break_layers['break_magnitude'], break_layers['break_confidence'])
+    print(f"  ✓ Vegetation breaks: {VEGETATION_BREAKS.name} "
+          f"({np.mean(disturbance > 0) * 100:.1f}% of pixels disturbed)")
 
 print("\n5. Creating fuel risk adjustment factors...")
 
 # Create fuel risk score (0-100 scale for easier interpretation)
 # Combines stress, vegetation decline, and moisture deficit
 
-# Normalize components to 0-1
-stress_norm = np.clip(stress_score_reproj, 0, 1)
-ndvi_stress_norm = np.clip(ndvi_change_reproj / 0.5, 0, 1)  # NDVI change > 0.5 = max stress
-ndmi_stress_norm = np.clip(ndmi_change_reproj / 0.5, 0, 1)  # NDMI change > 0.5 = max stress
-
-# Combined risk score (0-100)
-fuel_risk_score = (
-    40 * stress_norm +           # 40% weight: overall stress
-    35 * ndvi_stress_norm +      # 35% weight: vegetation decline
-    25 * ndmi_stress_norm        # 25% weight: moisture deficit
-)
+# Components are normalized to 0-1 and weighted (see application/analysis/fuel_stages.py):
+# 40% overall stress, 35% vegetation decline, 25% moisture deficit
+# (plus up to 15 points, capped at 100, for disturbance when vegetation breaks are available)
+fuel_risk_score = fuel_risk(stress_score_reproj, ndvi_change_reproj, ndmi_change_reproj, disturbance)
 
 print(f"  Fuel risk score range: {np.nanmin(fuel_risk_score):.1f} to {np.nanmax(fuel_risk_score):.1f}")
 print(f"  Mean fuel risk: {np.nanmean(fuel_risk_score):.1f}")
@@ -176,15 +229,12 @@ enhanced_fbfm40 = fbfm40.copy()
 # This preserves more information for validation
 
 # Create a fuel load adjustment factor (1.0 = no change, 2.0 = double)
-fuel_load_factor = 1.0 + (fuel_risk_score / 100)  # Range: 1.0 to 2.0
+# and the enhanced canopy bulk density (adjusted by stress, capped at a reasonable max)
+fuel_load_factor, enhanced_cbd = enhanced_fuel(cbd, fuel_risk_score)
 
 print(f"  Fuel load adjustment factor range: {np.nanmin(fuel_load_factor):.2f}x to {np.nanmax(fuel_load_factor):.2f}x")
 print(f"  Mean adjustment: {np.nanmean(fuel_load_factor):.2f}x")
 
-# Enhanced canopy bulk density (adjusted by stress)
-enhanced_cbd = cbd * fuel_load_factor
-enhanced_cbd = np.clip(enhanced_cbd, 0, 1000)  # Cap at reasonable max
-
 print(f"  Enhanced CBD range: {np.nanmin(enhanced_cbd):.1f} to {np.nanmax(enhanced_cbd):.1f} kg/m³")
 print(f"  Original CBD mean: {np.nanmean(cbd):.1f}, Enhanced CBD mean: {np.nanmean(enhanced_cbd):.1f}")
 
@@ -194,8 +244,7 @@ print("\n7. Saving outputs...")
 profile_out = landfire_profile.copy()
 profile_out.update(count=1, dtype='float32', compress='lzw')
 
-with rasterio.open(OUTPUT_DIR / "fuel_risk_score.tif", 'w', **profile_out) as dst:
-    dst.write(fuel_risk_score.astype('float32'), 1)
+write_layer(OUTPUT_DIR / "fuel_risk_score.tif", fuel_risk_score, profile_out, STORAGE)
 print(f"  ✓ Saved fuel_risk_score.tif")
 
 # Save enhanced FBFM40
@@ -216,6 +265,88 @@ with rasterio.open(OUTPUT_DIR / "fuel_load_factor.tif", 'w', **profile_out) as d
     dst.write(fuel_load_factor.astype('float32'), 1)
 print(f"  ✓ Saved fuel_load_factor.tif")
 
+# Save within-cell stress heterogeneity (nested grids only)
+if stress_heterogeneity is not None:
+    profile_het = profile_out.copy()
+    profile_het.update(count=len(AGGREGATE_STATS), nodata=np.nan)
+    with rasterio.open(OUTPUT_DIR / "stress_heterogeneity.tif", 'w', **profile_het) as dst:
+        for band, name in enumerate(AGGREGATE_STATS, start=1):
+            dst.write(stress_heterogeneity[name], band)
+            dst.set_band_description(band, f"stress_{name}")
+    print(f"  ✓ Saved stress_heterogeneity.tif")
+
+native_stats = None
+if OUTPUT_GRID == "sentinel2":
+    print("\n7b. Computing native 10 m products on the Sentinel-2 grid...")
+    # Stress layers are read at 10 m one tile at a time; LANDFIRE CBD and
+    # FBFM40 are upsampled per tile by integer index mapping (nearest) and
+    # the breaks raster bilinearly, so nothing is held at 10 m for the full
+    # grid and memory stays close to the 30 m path
+    NATIVE_DIR.mkdir(exist_ok=True, parents=True)
+    native_profile = stress_profile.copy()
+    native_profile.update(count=1, dtype='float32', compress='lzw', nodata=np.nan,
+                          tiled=True, blockxsize=256, blockysize=256)
+    native_int_profile = dict(native_profile, dtype='int16', nodata=-9999)
+    # Scaled storage writes the tiled risk layer directly in its encoding
+    native_risk_profile = (dict(native_profile, dtype=RISK.dtype, nodata=RISK.nodata)
+                           if STORAGE == "scaled" else native_profile)
+    native_sums = {'n': 0, 'risk': 0.0, 'high': 0, 'cbd': 0.0, 'enhanced_cbd': 0.0}
+
+    with ExitStack() as stack:
+        src_stress, src_ndvi, src_ndmi, src_landfire = (
+            stack.enter_context(rasterio.open(path))
+            for path in (STRESS_SCORE, NDVI_CHANGE, NDMI_CHANGE, LANDFIRE_FILE))
+        dst_profiles = {'fuel_risk_score': native_risk_profile, 'enhanced_cbd': native_profile,
+                        'fuel_load_factor': native_profile, 'enhanced_fbfm40': native_int_profile}
+        dst = {name: stack.enter_context(rasterio.open(NATIVE_DIR / f"{name}.tif", 'w', **profile))
+               for name, profile in dst_profiles.items()}
+        if STORAGE == "scaled":
+            dst['fuel_risk_score'].scales = (RISK.scale,)
+            dst['fuel_risk_score'].offsets = (RISK.offset,)
+        landfire_map = WarpPlan.between(src_landfire, native_profile)
+        src_breaks = stack.enter_context(rasterio.open(VEGETATION_BREAKS)) if disturbance is not None else None
+        breaks_plan = WarpPlan.between(src_breaks, native_profile) if src_breaks is not None else None
+
+        for tile in iter_tiles(native_profile['height'], native_profile['width']):
+            tile_stress = read_layer(src_stress, 1, tile.window)
+            tile_ndvi = read_layer(src_ndvi, 1, tile.window)
+            tile_ndmi = read_layer(src_ndmi, 1, tile.window)
+            tile_fbfm40 = landfire_map.read_tile_nearest(src_landfire, 1, tile)
+            tile_cbd = landfire_map.read_tile_nearest(src_landfire, 2, tile)
+            tile_disturbance = None
+            if breaks_plan is not None:
+                tile_disturbance = disturbance_stress(*(
+                    breaks_plan.read_tile(src_breaks, src_breaks.descriptions.index(name) + 1, tile)
+                    for name in ('break_magnitude', 'break_confidence')))
+
+            tile_risk = fuel_risk(tile_stress, tile_ndvi, tile_ndmi, tile_disturbance)
+            tile_factor, tile_enhanced_cbd = enhanced_fuel(tile_cbd, tile_risk)
+            dst['fuel_risk_score'].write(RISK.encode(tile_risk) if STORAGE == "scaled"
+                                         else tile_risk.astype('float32'), 1, window=tile.window)
+            dst['enhanced_cbd'].write(tile_enhanced_cbd.astype('float32'), 1, window=tile.window)
+            dst['fuel_load_factor'].write(tile_factor.astype('float32'), 1, window=tile.window)
+            dst['enhanced_fbfm40'].write(np.where(np.isnan(tile_fbfm40), -9999, tile_fbfm40).astype('int16'),
+                                         1, window=tile.window)
+
+            valid = np.isfinite(tile_risk) & np.isfinite(tile_enhanced_cbd)
+            native_sums['n'] += int(valid.sum())
+            native_sums['risk'] += float(tile_risk[valid].sum(dtype=np.float64))
+            native_sums['high'] += int((tile_risk[valid] > 60).sum())
+            native_sums['cbd'] += float(tile_cbd[valid].sum(dtype=np.float64))
+            native_sums['enhanced_cbd'] += float(tile_enhanced_cbd[valid].sum(dtype=np.float64))
+
+    n_native = max(native_sums['n'], 1)
+    native_stats = {
+        "grid": f"{native_profile['width']} x {native_profile['height']}",
+        "mean_fuel_risk": native_sums['risk'] / n_native,
+        "high_risk_percent": native_sums['high'] / n_native * 100,
+        "original_cbd_mean": native_sums['cbd'] / n_native,
+        "enhanced_cbd_mean": native_sums['enhanced_cbd'] / n_native
+    }
+    print(f"  Native grid: {native_stats['grid']}, mean fuel risk {native_stats['mean_fuel_risk']:.1f}, "
+          f"high risk {native_stats['high_risk_percent']:.1f}%")
+    print(f"  ✓ Saved {NATIVE_DIR}/ (fuel_risk_score, enhanced_cbd, fuel_load_factor, enhanced_fbfm40)")
+
 print("\n8. Creating comparison visualizations...")
 
 fig, axes = plt.subplots(2, 3, figsize=(18, 12))
@@ -285,6 +416,17 @@ stats = {
         "max_factor": float(np.nanmax(fuel_load_factor)),
         "areas_increased_20pct": float(np.sum(fuel_load_factor > 1.2) / fuel_load_factor.size * 100)
     },
+    "stress_heterogeneity": {
+        "aggregation_factor": nesting[0] if nesting is not None else None,
+        "mean_within_cell_std": float(np.nanmean(stress_heterogeneity['std'])) if stress_heterogeneity else None,
+        "mean_fraction_high_stress": float(np.nanmean(stress_heterogeneity['frac_above'])) if stress_heterogeneity else None
+    },
+    "native_10m": native_stats,
+    "disturbance": {
+        "vegetation_breaks": str(VEGETATION_BREAKS) if disturbance is not None else None,
+        "disturbed_percent": float(np.mean(disturbance > 0) * 100) if disturbance is not None else 0.0
+    },
+    "risk_weighting": risk_weighting(disturbance is not None),
     "cbd_enhancement": {
         "original_mean": float(np.nanmean(cbd)),
         "enhanced_mean": float(np.nanmean(enhanced_cbd)),
@@ -21,7 +21,9 @@ Outputs:
 - outputs/validation/correlation_enhanced.png
 - outputs/validation/spatial_comparison.png
 - outputs/validation/improvement_summary.png
-- outputs/validation/validation_metrics.json
+- outputs/validation/validation_metrics.json (incl. risk/FBFM40 vs severity contingency tables)
+- outputs/validation/response_curves.json (dNBR mean/quantiles per predictor decile)
+- outputs/validation/local_r2.tif (moving-window R²: LANDFIRE, enhanced, enhanced - LANDFIRE)
 """
 
 import numpy as np
@@ -30,31 +32,54 @@ from rasterio.warp import reproject, Resampling
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from scipy import stats
+from matplotlib.colors import LogNorm
 from pathlib import Path
 import json
+import os
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'application'))
+from analysis.validation_stats import (
+    ConfusionMatrix, DensityHistogram, PearsonAccumulator, QuantileSketch, ResponseCurve,
+    risk_class, fbfm40_family,
+    SEVERITY_CLASS_NAMES, RISK_CLASS_NAMES, FBFM40_FAMILY_NAMES, FBFM40_FAMILY_HAZARD,
+    RISK_SEVERITY_GROUPS, FBFM40_SEVERITY_GROUPS
+)
+from analysis.spatial_stats import iter_local_correlation, spatial_significance
+from utils.scaled import StoredLayer
+from utils.tiling import iter_tiles
 
 print("="*70)
 print("STEP 4: VALIDATION ANALYSIS")
 print("="*70)
 
-# Paths
+# Paths (FUELMAP_* overrides are set per fire by the batch runner)
 LANDFIRE_DIR = Path("data/landfire")
-ENHANCED_DIR = Path("outputs/enhanced_fuel")
-BURN_DIR = Path("outputs/burn_severity")
-OUTPUT_DIR = Path("outputs/validation")
+OUTPUT_ROOT = Path(os.environ.get("FUELMAP_OUTPUT_DIR", "outputs"))
+ENHANCED_DIR = OUTPUT_ROOT / "enhanced_fuel"
+BURN_DIR = OUTPUT_ROOT / "burn_severity"
+OUTPUT_DIR = OUTPUT_ROOT / "validation"
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
 
 # Input files
-LANDFIRE_FILE = LANDFIRE_DIR / "LF2020_HermitsPeak_multiband.tif"
+LANDFIRE_FILE = Path(os.environ.get("FUELMAP_LANDFIRE", LANDFIRE_DIR / "LF2020_HermitsPeak_multiband.tif"))
 ENHANCED_RISK = ENHANCED_DIR / "fuel_risk_score.tif"
 ENHANCED_CBD = ENHANCED_DIR / "enhanced_cbd.tif"
+# Optional: within-cell 10 m stress heterogeneity written by 03 on nested grids
+STRESS_HETEROGENEITY = ENHANCED_DIR / "stress_heterogeneity.tif"
 BURN_SEVERITY = BURN_DIR / "burn_severity_classified.tif"
 DNBR_FILE = BURN_DIR / "dnbr.tif"
 
+# Moving-window size for the local R² map (pixels on the LANDFIRE grid)
+LOCAL_WINDOW = 15
+
+# Rasters are held as float32; sums and moments are accumulated in float64
+# per tile by the streaming accumulators in application/analysis/validation_stats.py
+
 print("\n1. Loading LANDFIRE baseline (what fire managers had)...")
 with rasterio.open(LANDFIRE_FILE) as src:
-    landfire_cbd = src.read(2).astype(float)  # Canopy Bulk Density
+    landfire_fbfm40 = src.read(1)  # Fire Behavior Fuel Model
+    landfire_cbd = src.read(2).astype(np.float32)  # Canopy Bulk Density
     landfire_profile = src.profile
     landfire_transform = src.transform
     landfire_crs = src.crs
@@ -63,18 +88,27 @@ print(f"  LANDFIRE CBD range: {np.min(landfire_cbd):.1f} to {np.max(landfire_cbd
 print(f"  LANDFIRE CBD mean: {np.mean(landfire_cbd):.1f} kg/m³")
 
 print("\n2. Loading enhanced predictions (your improved map)...")
+# Kept as stored (uint8 in scaled storage) and decoded one tile at a time
 with rasterio.open(ENHANCED_RISK) as src:
-    enhanced_risk = src.read(1).astype(float)
+    enhanced_risk = StoredLayer(src)
 
 with rasterio.open(ENHANCED_CBD) as src:
-    enhanced_cbd = src.read(1).astype(float)
+    enhanced_cbd = src.read(1).astype(np.float32, copy=False)
 
-print(f"  Enhanced fuel risk range: {np.nanmin(enhanced_risk):.1f} to {np.nanmax(enhanced_risk):.1f}")
+risk_min, risk_max = enhanced_risk.value_range()
+print(f"  Enhanced fuel risk range: {risk_min:.1f} to {risk_max:.1f}")
 print(f"  Enhanced CBD range: {np.nanmin(enhanced_cbd):.1f} to {np.nanmax(enhanced_cbd):.1f} kg/m³")
 
+heterogeneity = {}
+if STRESS_HETEROGENEITY.exists():
+    with rasterio.open(STRESS_HETEROGENEITY) as src:
+        for band, name in enumerate(src.descriptions, start=1):
+            if name in ('stress_std', 'stress_frac_above'):
+                heterogeneity[name] = src.read(band).astype(np.float32, copy=False)
+    print(f"  Stress heterogeneity features: {', '.join(heterogeneity)}")
+
 print("\n3. Loading actual burn severity (ground truth)...")
 with rasterio.open(BURN_SEVERITY) as src:
-    burn_severity_file = src.read(1).astype(float)
     burn_profile = src.profile
     burn_transform = src.transform
     burn_crs = src.crs
@@ -83,7 +117,7 @@ print(f"  Burn severity grid: {burn_profile['width']} x {burn_profile['height']}
 
 # Also load continuous dNBR for better correlation
 with rasterio.open(DNBR_FILE) as src:
-    dnbr_orig = src.read(1).astype(float)
+    dnbr_orig = src.read(1).astype(np.float32, copy=False)
 
 print(f"  dNBR range: {np.nanmin(dnbr_orig):.3f} to {np.nanmax(dnbr_orig):.3f}")
 
@@ -119,36 +153,38 @@ print(f"  ✓ Data reprojected to common {landfire_profile['width']} x {landfire
 
 print("\n5. Preparing data for correlation analysis...")
 
-# Flatten arrays
-landfire_cbd_flat = landfire_cbd.flatten()
-enhanced_risk_flat = enhanced_risk.flatten()
-enhanced_cbd_flat = enhanced_cbd.flatten()
-dnbr_flat = dnbr_reproj.flatten()
-burn_sev_flat = burn_sev_reproj.flatten()
-
-# Remove invalid values
-valid_mask = (
-    np.isfinite(landfire_cbd_flat) &
-    np.isfinite(enhanced_risk_flat) &
-    np.isfinite(dnbr_flat) &
-    (dnbr_flat > -0.5) &  # Exclude extreme outliers
-    (dnbr_flat < 2.0)
+# Remove invalid values (the grids are masked in place, never flattened or copied)
+valid_grid = (
+    np.isfinite(landfire_cbd) &
+    enhanced_risk.finite() &
+    np.isfinite(dnbr_reproj) &
+    (dnbr_reproj > -0.5) &  # Exclude extreme outliers
+    (dnbr_reproj < 2.0)
 )
 
-n_valid = np.sum(valid_mask)
-print(f"  Valid pixels for analysis: {n_valid:,} ({n_valid / len(valid_mask) * 100:.1f}%)")
+n_valid = int(np.count_nonzero(valid_grid))
+print(f"  Valid pixels for analysis: {n_valid:,} ({n_valid / valid_grid.size * 100:.1f}%)")
 
-# Extract valid pixels
-landfire_valid = landfire_cbd_flat[valid_mask]
-enhanced_risk_valid = enhanced_risk_flat[valid_mask]
-enhanced_cbd_valid = enhanced_cbd_flat[valid_mask]
-dnbr_valid = dnbr_flat[valid_mask]
-burn_sev_valid = burn_sev_flat[valid_mask]
+# Predictors of dNBR: correlations, response curves
+response_predictors = {
+    'landfire_cbd': landfire_cbd,
+    'enhanced_risk': enhanced_risk,
+    'enhanced_cbd': enhanced_cbd,
+    **heterogeneity
+}
 
 print("\n6. Calculating correlations...")
 
+# Pearson r of every predictor with dNBR, one pass over the tiles
+correlations = {name: PearsonAccumulator() for name in response_predictors}
+for tile in iter_tiles(*landfire_cbd.shape):
+    tile_valid = valid_grid[tile.slices]
+    tile_dnbr = dnbr_reproj[tile.slices][tile_valid]
+    for name, grid in response_predictors.items():
+        correlations[name].update(grid[tile.slices][tile_valid], tile_dnbr)
+
 # LANDFIRE CBD vs dNBR
-r_landfire, p_landfire = stats.pearsonr(landfire_valid, dnbr_valid)
+r_landfire, p_landfire = correlations['landfire_cbd'].pearson()
 r2_landfire = r_landfire ** 2
 
 print(f"\n  LANDFIRE Baseline Performance:")
@@ -157,7 +193,7 @@ print(f"    R²: {r2_landfire:.4f}")
 print(f"    p-value: {p_landfire:.2e}")
 
 # Enhanced fuel risk vs dNBR
-r_enhanced, p_enhanced = stats.pearsonr(enhanced_risk_valid, dnbr_valid)
+r_enhanced, p_enhanced = correlations['enhanced_risk'].pearson()
 r2_enhanced = r_enhanced ** 2
 
 print(f"\n  Enhanced Map Performance:")
@@ -174,72 +210,191 @@ print(f"    R² increase: {improvement_r2:+.1f}%")
 print(f"    Absolute R² increase: {absolute_improvement:+.4f}")
 
 # Also try enhanced CBD vs dNBR
-r_enhanced_cbd, p_enhanced_cbd = stats.pearsonr(enhanced_cbd_valid, dnbr_valid)
+r_enhanced_cbd, p_enhanced_cbd = correlations['enhanced_cbd'].pearson()
 r2_enhanced_cbd = r_enhanced_cbd ** 2
 
 print(f"\n  Enhanced CBD Performance:")
 print(f"    R²: {r2_enhanced_cbd:.4f}")
 
+# Sub-pixel stress heterogeneity as candidate extra risk features
+heterogeneity_metrics = {}
+for name in heterogeneity:
+    r_feature, p_feature = correlations[name].pearson()
+    if np.isfinite(r_feature):
+        heterogeneity_metrics[name] = {'r2': float(r_feature ** 2), 'pearson_r': float(r_feature),
+                                       'p_value': float(p_feature), 'n': int(correlations[name].n)}
+        print(f"\n  Heterogeneity feature {name}: R² = {r_feature ** 2:.4f} (r = {r_feature:+.4f})")
+
+print("\n  Spatial autocorrelation-aware significance...")
+# Neighbouring pixels are not independent, so the naive p-values above are
+# meaningless; Dutilleul's effective sample size corrects the t-test and
+# Moran's I of the regression residuals shows how much structure is left
+spatial_landfire = spatial_significance(landfire_cbd, dnbr_reproj, valid_grid)
+spatial_enhanced = spatial_significance(enhanced_risk, dnbr_reproj, valid_grid)
+for label, result in [('LANDFIRE', spatial_landfire), ('Enhanced', spatial_enhanced)]:
+    moran = result['residual_morans_i']
+    print(f"\n  {label}:")
+    if result['pearson_r'] is None:
+        print(f"    ⚠ Not testable: {result['n']:,} valid pixels or a constant variable")
+        continue
+    print(f"    Effective sample size: {result['n_effective']:,.0f} of {result['n']:,} pixels")
+    if result['p_value_dutilleul'] is not None:
+        print(f"    Corrected p-value (Dutilleul): {result['p_value_dutilleul']:.2e}")
+    if moran['morans_i'] is not None:
+        print(f"    Residual Moran's I: {moran['morans_i']:.4f} (z = {moran['z_score']:.1f})")
+
+p_landfire_eff = spatial_landfire['p_value_dutilleul']
+p_enhanced_eff = spatial_enhanced['p_value_dutilleul']
+
 print("\n7. Analyzing by burn severity class...")
 
-burn_severity_means = {}
-for sev_class in range(5):
-    class_name = ['Unburned', 'Low', 'Mod-Low', 'Mod-High', 'High'][sev_class]
-    mask = burn_sev_valid == sev_class
+# Contingency tables of predicted fuel class vs observed severity class,
+# accumulated one tile at a time with a single bincount per table
+n_classes = len(SEVERITY_CLASS_NAMES)
+risk_table = ConfusionMatrix(len(RISK_CLASS_NAMES), n_classes)
+fbfm40_table = ConfusionMatrix(len(FBFM40_FAMILY_NAMES), n_classes)
+class_counts = np.zeros(n_classes, dtype=np.int64)
+class_landfire_sum = np.zeros(n_classes)
+class_enhanced_sum = np.zeros(n_classes)
+
+for tile in iter_tiles(*landfire_cbd.shape):
+    tile_valid = valid_grid[tile.slices]
+    if not tile_valid.any():
+        continue
+    obs = burn_sev_reproj[tile.slices][tile_valid]
+    obs = np.where(np.isfinite(obs), obs, -1).astype(np.int64)
+    in_class = (obs >= 0) & (obs < n_classes)
+    risk = enhanced_risk[tile.slices][tile_valid]
+    landfire = landfire_cbd[tile.slices][tile_valid]
+
+    risk_table.update(risk_class(risk), obs)
+    # Non-burnable / unmapped fuel models (family -1) are excluded, not scored
+    fbfm40_table.update(fbfm40_family(landfire_fbfm40[tile.slices][tile_valid]), obs)
+
+    class_counts += np.bincount(obs[in_class], minlength=n_classes)
+    class_landfire_sum += np.bincount(obs[in_class], weights=landfire[in_class], minlength=n_classes)
+    class_enhanced_sum += np.bincount(obs[in_class], weights=risk[in_class], minlength=n_classes)
 
-    if np.sum(mask) > 0:
-        landfire_mean = np.mean(landfire_valid[mask])
-        enhanced_mean = np.mean(enhanced_risk_valid[mask])
+burn_severity_means = {}
+for sev_class, class_name in enumerate(SEVERITY_CLASS_NAMES):
+    count = class_counts[sev_class]
+    if count > 0:
+        landfire_mean = class_landfire_sum[sev_class] / count
+        enhanced_mean = class_enhanced_sum[sev_class] / count
         burn_severity_means[class_name] = {
-            'landfire_cbd': landfire_mean,
-            'enhanced_risk': enhanced_mean,
-            'count': int(np.sum(mask))
+            'landfire_cbd': float(landfire_mean),
+            'enhanced_risk': float(enhanced_mean),
+            'count': int(count)
         }
         print(f"\n  {class_name} severity areas:")
-        print(f"    Count: {np.sum(mask):,} pixels")
+        print(f"    Count: {count:,} pixels")
         print(f"    LANDFIRE CBD: {landfire_mean:.1f}")
         print(f"    Enhanced risk: {enhanced_mean:.1f}")
 
+contingency_tables = {
+    'enhanced_risk_vs_severity': risk_table.to_dict(
+        RISK_CLASS_NAMES, SEVERITY_CLASS_NAMES, RISK_SEVERITY_GROUPS),
+    'landfire_fbfm40_vs_severity': fbfm40_table.to_dict(
+        FBFM40_FAMILY_NAMES, SEVERITY_CLASS_NAMES, FBFM40_SEVERITY_GROUPS,
+        pred_groups=FBFM40_FAMILY_HAZARD, group_names=RISK_CLASS_NAMES)
+}
+
+for table_name, table in contingency_tables.items():
+    print(f"\n  Contingency table: {table_name}")
+    print("    " + " " * 18 + "".join(f"{name:>10}" for name in table['observed_classes']))
+    for row_name, row in zip(table['predicted_classes'], table['counts']):
+        print(f"    {row_name:<18}" + "".join(f"{count:>10,}" for count in row))
+    if table['excluded']:
+        print(f"    Excluded (unclassified / non-burnable): {table['excluded']:,} pixels")
+    agreement = table['agreement']
+    if agreement['cohens_kappa'] is not None:
+        print(f"    Cohen's kappa: {agreement['cohens_kappa']:.4f}  "
+              f"Overall accuracy: {agreement['overall_accuracy']:.4f}")
+
+print("\n  Building dNBR response curves (per predictor decile)...")
+
+# Pass 1: mergeable quantile sketches give the decile edges without a global sort
+# Pass 2: per-bin counts, sums and dNBR histograms give mean and quantiles
+sketches = {name: QuantileSketch() for name in response_predictors}
+for tile in iter_tiles(*landfire_cbd.shape):
+    tile_valid = valid_grid[tile.slices]
+    for name, grid in response_predictors.items():
+        sketches[name].update(grid[tile.slices][tile_valid])
+
+response_curves = {name: ResponseCurve.from_sketch(sketch, n_bins=10)
+                   for name, sketch in sketches.items()}
+for tile in iter_tiles(*landfire_cbd.shape):
+    tile_valid = valid_grid[tile.slices]
+    tile_dnbr = dnbr_reproj[tile.slices][tile_valid]
+    for name, grid in response_predictors.items():
+        response_curves[name].update(grid[tile.slices][tile_valid], tile_dnbr)
+
+response_curves_out = {name: curve.to_dict() for name, curve in response_curves.items()}
+with open(OUTPUT_DIR / "response_curves.json", 'w') as f:
+    json.dump(response_curves_out, f, indent=2)
+print(f"  ✓ Saved response_curves.json")
+
+print(f"\n  Computing local R² map ({LOCAL_WINDOW}x{LOCAL_WINDOW} pixel window)...")
+
+local_profile = landfire_profile.copy()
+local_profile.update(count=3, dtype='float32', compress='lzw', nodata=np.nan,
+                     tiled=True, blockxsize=256, blockysize=256)
+with rasterio.open(OUTPUT_DIR / "local_r2.tif", 'w', **local_profile) as dst:
+    dst.set_band_description(1, 'local_r2_landfire')
+    dst.set_band_description(2, 'local_r2_enhanced')
+    dst.set_band_description(3, 'local_r2_difference')
+    for tile, local_r in iter_local_correlation(
+            {'landfire': landfire_cbd, 'enhanced': enhanced_risk},
+            dnbr_reproj, valid_grid, LOCAL_WINDOW):
+        r2_landfire_tile = local_r['landfire'] ** 2
+        r2_enhanced_tile = local_r['enhanced'] ** 2
+        dst.write(r2_landfire_tile, 1, window=tile.window)
+        dst.write(r2_enhanced_tile, 2, window=tile.window)
+        dst.write(r2_enhanced_tile - r2_landfire_tile, 3, window=tile.window)
+print(f"  ✓ Saved local_r2.tif")
+
 print("\n8. Creating validation visualizations...")
 
-# Figure 1: Scatter plots (LANDFIRE vs Enhanced)
+# Figure 1: Density scatter plots (LANDFIRE vs Enhanced)
+# Every valid pixel is binned into a 2D histogram tile by tile; the fit line
+# comes from the same accumulated moments, so the figure is deterministic
+DNBR_PLOT_RANGE = (-0.5, 2.0)
+density = {
+    'landfire': DensityHistogram((sketches['landfire_cbd'].min, sketches['landfire_cbd'].max),
+                                 DNBR_PLOT_RANGE),
+    'enhanced': DensityHistogram((sketches['enhanced_risk'].min, sketches['enhanced_risk'].max),
+                                 DNBR_PLOT_RANGE)
+}
+for tile in iter_tiles(*landfire_cbd.shape):
+    tile_valid = valid_grid[tile.slices]
+    tile_dnbr = dnbr_reproj[tile.slices][tile_valid]
+    density['landfire'].update(landfire_cbd[tile.slices][tile_valid], tile_dnbr)
+    density['enhanced'].update(enhanced_risk[tile.slices][tile_valid], tile_dnbr)
+
 fig, axes = plt.subplots(1, 2, figsize=(16, 6))
 fig.suptitle('Validation: Fuel Predictions vs Actual Burn Severity', fontsize=16, fontweight='bold')
 
-# LANDFIRE scatter
-ax1 = axes[0]
-# Downsample for plotting (too many points)
-sample_indices = np.random.choice(len(landfire_valid), size=min(10000, len(landfire_valid)), replace=False)
-ax1.scatter(landfire_valid[sample_indices], dnbr_valid[sample_indices],
-           alpha=0.3, s=1, c='blue')
-ax1.set_xlabel('LANDFIRE CBD (kg/m³)', fontsize=12)
-ax1.set_ylabel('Actual Burn Severity (dNBR)', fontsize=12)
-ax1.set_title(f'LANDFIRE Baseline\nR² = {r2_landfire:.4f}', fontsize=14, fontweight='bold')
-ax1.grid(True, alpha=0.3)
-
-# Add regression line
-z = np.polyfit(landfire_valid, dnbr_valid, 1)
-p = np.poly1d(z)
-x_line = np.linspace(landfire_valid.min(), landfire_valid.max(), 100)
-ax1.plot(x_line, p(x_line), "r-", linewidth=2, label=f'Best fit (R²={r2_landfire:.3f})')
-ax1.legend()
-
-# Enhanced scatter
-ax2 = axes[1]
-ax2.scatter(enhanced_risk_valid[sample_indices], dnbr_valid[sample_indices],
-           alpha=0.3, s=1, c='darkgreen')
-ax2.set_xlabel('Enhanced Fuel Risk Score (0-100)', fontsize=12)
-ax2.set_ylabel('Actual Burn Severity (dNBR)', fontsize=12)
-ax2.set_title(f'Enhanced Map (Ours)\nR² = {r2_enhanced:.4f} ({improvement_r2:+.1f}%)',
-             fontsize=14, fontweight='bold', color='darkgreen')
-ax2.grid(True, alpha=0.3)
-
-# Add regression line
-z = np.polyfit(enhanced_risk_valid, dnbr_valid, 1)
-p = np.poly1d(z)
-x_line = np.linspace(enhanced_risk_valid.min(), enhanced_risk_valid.max(), 100)
-ax2.plot(x_line, p(x_line), "r-", linewidth=2, label=f'Best fit (R²={r2_enhanced:.3f})')
-ax2.legend()
+panels = [
+    (axes[0], density['landfire'], 'LANDFIRE CBD (kg/m³)', 'Blues',
+     f'LANDFIRE Baseline\nR² = {r2_landfire:.4f}', 'black', r2_landfire),
+    (axes[1], density['enhanced'], 'Enhanced Fuel Risk Score (0-100)', 'Greens',
+     f'Enhanced Map (Ours)\nR² = {r2_enhanced:.4f} ({improvement_r2:+.1f}%)', 'darkgreen', r2_enhanced)
+]
+for ax, hist, xlabel, cmap, title, title_color, r2 in panels:
+    counts = np.ma.masked_equal(hist.counts.T, 0)
+    mesh = ax.pcolormesh(hist.x_edges, hist.y_edges, counts, cmap=cmap,
+                         norm=LogNorm(vmin=1, vmax=max(int(hist.counts.max()), 1)))
+    plt.colorbar(mesh, ax=ax, fraction=0.046, label='Pixels per bin')
+    ax.set_xlabel(xlabel, fontsize=12)
+    ax.set_ylabel('Actual Burn Severity (dNBR)', fontsize=12)
+    ax.set_title(title, fontsize=14, fontweight='bold', color=title_color)
+    ax.grid(True, alpha=0.3)
+
+    # Regression line from the accumulated centred moments
+    slope, intercept = hist.linear_fit()
+    x_line = np.linspace(hist.x_edges[0], hist.x_edges[-1], 100)
+    ax.plot(x_line, slope * x_line + intercept, "r-", linewidth=2, label=f'Best fit (R²={r2:.3f})')
+    ax.legend()
 
 plt.tight_layout()
 plt.savefig(OUTPUT_DIR / "correlation_scatter_plots.png", dpi=150, bbox_inches='tight')
@@ -251,43 +406,42 @@ fig, axes = plt.subplots(2, 2, figsize=(14, 12))
 fig.suptitle('Spatial Validation: Where Did Our Enhanced Map Predict Better?',
              fontsize=16, fontweight='bold')
 
+# Maps are drawn from a strided view (at most ~1000 px a side): imshow would
+# otherwise make float64 copies of the full-resolution grids
+factor = max(1, int(np.ceil(max(landfire_cbd.shape) / 1000)))
+
 # LANDFIRE fuel
 ax1 = axes[0, 0]
-im1 = ax1.imshow(landfire_cbd, cmap='YlOrRd', vmin=0, vmax=30)
+im1 = ax1.imshow(landfire_cbd[::factor, ::factor], cmap='YlOrRd', vmin=0, vmax=30)
 ax1.set_title('LANDFIRE 2020 CBD\n(Static baseline)', fontsize=12)
 ax1.axis('off')
 plt.colorbar(im1, ax=ax1, fraction=0.046)
 
 # Enhanced fuel risk
 ax2 = axes[0, 1]
-im2 = ax2.imshow(enhanced_risk, cmap='YlOrRd', vmin=0, vmax=100)
+im2 = ax2.imshow(enhanced_risk[::factor, ::factor], cmap='YlOrRd', vmin=0, vmax=100)
 ax2.set_title('Enhanced Fuel Risk\n(Satellite-updated)', fontsize=12)
 ax2.axis('off')
 plt.colorbar(im2, ax=ax2, fraction=0.046)
 
 # Actual burn severity
 ax3 = axes[1, 0]
-im3 = ax3.imshow(dnbr_reproj, cmap='hot', vmin=-0.1, vmax=1.0)
+im3 = ax3.imshow(dnbr_reproj[::factor, ::factor], cmap='hot', vmin=-0.1, vmax=1.0)
 ax3.set_title('Actual Burn Severity (dNBR)\n(Ground truth)', fontsize=12)
 ax3.axis('off')
 plt.colorbar(im3, ax=ax3, fraction=0.046)
 
-# Prediction difference (where enhanced was more accurate)
-# Normalize both to 0-1 for comparison
-landfire_norm = (landfire_cbd - landfire_cbd.min()) / (landfire_cbd.max() - landfire_cbd.min() + 1e-10)
-enhanced_norm = (enhanced_risk - enhanced_risk.min()) / (enhanced_risk.max() - enhanced_risk.min() + 1e-10)
-dnbr_norm = (dnbr_reproj - np.nanmin(dnbr_reproj)) / (np.nanmax(dnbr_reproj) - np.nanmin(dnbr_reproj) + 1e-10)
-
-# Calculate which prediction was closer to reality
-landfire_error = np.abs(landfire_norm - dnbr_norm)
-enhanced_error = np.abs(enhanced_norm - dnbr_norm)
-improvement_map = landfire_error - enhanced_error  # Positive = enhanced was better
+# Local R² difference (where enhanced explained more of the burn severity)
+with rasterio.open(OUTPUT_DIR / "local_r2.tif") as src:
+    local_r2_diff = src.read(3, out_shape=(src.height // factor or 1, src.width // factor or 1),
+                             resampling=Resampling.average)
 
 ax4 = axes[1, 1]
-im4 = ax4.imshow(improvement_map, cmap='RdYlGn', vmin=-0.2, vmax=0.2)
-ax4.set_title('Where Enhanced Map Was Better\n(Green = Enhanced closer to reality)', fontsize=12)
+im4 = ax4.imshow(local_r2_diff, cmap='RdYlGn', vmin=-0.3, vmax=0.3)
+ax4.set_title(f'Where Enhanced Map Was Better\n(Local R² difference, {LOCAL_WINDOW}x{LOCAL_WINDOW} window; '
+              f'green = enhanced)', fontsize=12)
 ax4.axis('off')
-plt.colorbar(im4, ax=ax4, fraction=0.046, label='Improvement')
+plt.colorbar(im4, ax=ax4, fraction=0.046, label='Local R² (enhanced - LANDFIRE)')
 
 plt.tight_layout()
 plt.savefig(OUTPUT_DIR / "spatial_comparison.png", dpi=150, bbox_inches='tight')
@@ -323,29 +477,32 @@ ax1.annotate(f'+{improvement_r2:.1f}%\nimprovement',
             arrowprops=dict(arrowstyle='->', color='green', lw=2),
             fontsize=12, color='green', fontweight='bold')
 
-# Mean fuel by burn severity
+# Mean dNBR by predictor decile (response curves, each predictor on its own deciles)
 ax2 = axes[1]
-severity_labels = ['Unburned', 'Low', 'Mod-Low', 'Mod-High', 'High']
-landfire_means = [burn_severity_means.get(label, {}).get('landfire_cbd', 0) for label in severity_labels]
-enhanced_means = [burn_severity_means.get(label, {}).get('enhanced_risk', 0) for label in severity_labels]
-
-x = np.arange(len(severity_labels))
-width = 0.35
-ax2.bar(x - width/2, landfire_means, width, label='LANDFIRE CBD', color='#1976D2', alpha=0.8)
-
-# Scale enhanced risk to match CBD range for visualization
-scale_factor = np.nanmax(landfire_means) / np.nanmax(enhanced_means) if np.nanmax(enhanced_means) > 0 else 1
-ax2.bar(x + width/2, np.array(enhanced_means) * scale_factor, width,
-       label='Enhanced Risk (scaled)', color='#388E3C', alpha=0.8)
-
-ax2.set_xlabel('Burn Severity Class', fontsize=12)
-ax2.set_ylabel('Mean Fuel Estimate', fontsize=12)
-ax2.set_title('Fuel Estimates by Actual Burn Severity\n(Higher bars for high severity = better prediction)',
+curve_styles = {
+    'landfire_cbd': ('LANDFIRE CBD', '#1976D2'),
+    'enhanced_risk': ('Enhanced Risk', '#388E3C'),
+    'enhanced_cbd': ('Enhanced CBD', '#F57C00')
+}
+# Tied deciles are merged into one bin, so a curve can have fewer than 10 ranks
+n_ranks = 1
+for name, (label, color) in curve_styles.items():
+    bins = [b for b in response_curves_out[name]['bins'] if b['count'] > 0]
+    rank = np.arange(1, len(bins) + 1)
+    n_ranks = max(n_ranks, len(bins))
+    means = [b['dnbr_mean'] for b in bins]
+    q25 = [b['dnbr_quantiles']['q25'] for b in bins]
+    q75 = [b['dnbr_quantiles']['q75'] for b in bins]
+    ax2.plot(rank, means, 'o-', color=color, linewidth=2, label=label)
+    ax2.fill_between(rank, q25, q75, color=color, alpha=0.15)
+
+ax2.set_xlabel('Predictor Decile (1 = lowest fuel estimate; tied deciles merged)', fontsize=12)
+ax2.set_ylabel('Actual Burn Severity (dNBR)', fontsize=12)
+ax2.set_title('dNBR Response by Predictor Decile\n(Line = mean, band = interquartile range)',
              fontsize=12)
-ax2.set_xticks(x)
-ax2.set_xticklabels(severity_labels, rotation=45, ha='right')
+ax2.set_xticks(np.arange(1, n_ranks + 1))
 ax2.legend()
-ax2.grid(axis='y', alpha=0.3)
+ax2.grid(alpha=0.3)
 
 plt.tight_layout()
 plt.savefig(OUTPUT_DIR / "improvement_summary.png", dpi=150, bbox_inches='tight')
@@ -366,9 +523,20 @@ metrics = {
     "statistical_significance": {
         "landfire_p_value": float(p_landfire),
         "enhanced_p_value": float(p_enhanced),
-        "both_significant": bool(p_landfire < 0.05 and p_enhanced < 0.05)
+        "landfire_p_value_dutilleul": p_landfire_eff,
+        "enhanced_p_value_dutilleul": p_enhanced_eff,
+        "landfire_effective_sample_size": spatial_landfire['n_effective'],
+        "enhanced_effective_sample_size": spatial_enhanced['n_effective'],
+        "both_significant": bool(p_landfire_eff is not None and p_enhanced_eff is not None
+                                 and p_landfire_eff < 0.05 and p_enhanced_eff < 0.05)
+    },
+    "spatial_autocorrelation": {
+        "landfire": spatial_landfire,
+        "enhanced": spatial_enhanced
     },
+    "heterogeneity_features": heterogeneity_metrics or None,
     "by_severity_class": burn_severity_means,
+    "contingency_tables": contingency_tables,
     "sample_size": int(n_valid)
 }
 
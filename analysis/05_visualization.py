@@ -25,6 +25,10 @@ import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle, FancyBboxPatch
 from pathlib import Path
 import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'application'))
+from utils.scaled import read_layer
 
 print("="*70)
 print("STEP 5: FINAL PRESENTATION VISUALIZATIONS")
@@ -56,10 +60,10 @@ with rasterio.open(DATA_DIR / "landfire/LF2020_HermitsPeak_multiband.tif") as sr
     landfire_cbd = src.read(2)
 
 with rasterio.open(OUTPUTS / "change_maps/stress_score.tif") as src:
-    stress_score = src.read(1)
+    stress_score = read_layer(src)
 
 with rasterio.open(OUTPUTS / "enhanced_fuel/fuel_risk_score.tif") as src:
-    fuel_risk = src.read(1)
+    fuel_risk = read_layer(src)
 
 with rasterio.open(OUTPUTS / "burn_severity/dnbr.tif") as src:
     dnbr = src.read(1)
@@ -188,10 +192,10 @@ fig.suptitle('Change Detection: What Satellites Revealed About Pre-Fire Conditio
              fontsize=18, fontweight='bold')
 
 with rasterio.open(OUTPUTS / "change_maps/ndvi_change.tif") as src:
-    ndvi_change = src.read(1)
+    ndvi_change = read_layer(src)
 
 with rasterio.open(OUTPUTS / "change_maps/ndmi_change.tif") as src:
-    ndmi_change = src.read(1)
+    ndmi_change = read_layer(src)
 
 # NDVI
 ax1 = axes[0, 0]
@@ -0,0 +1,260 @@
+"""
+Per-pixel Vegetation Break Detection
+Dates the most pronounced shift in each pixel's vegetation index series
+(drought die-off, beetle kill, thinning) with a piecewise-linear model on
+top of an annual harmonic:
+
+    y = a + b t + c cos 2πt + d sin 2πt + δ·[t ≥ τ] + γ·(t - τ)·[t ≥ τ]
+
+Every candidate break τ is fitted for all pixels of a tile at once: the
+6x6 normal equations of each candidate are assembled from suffix sums of
+the base-model terms (one pass over the series), then solved as a batch.
+The break with the lowest residual sum of squares wins; its level shift δ
+is the break magnitude. Confidence that the series has a structural
+change at all comes from the OLS-CUSUM test of the no-break model
+(Kolmogorov distribution of the scaled residual cumsum).
+
+Tiles are processed in parallel worker processes.
+
+Usage:
+    python application/analysis/changepoints.py --stack data/satellite/hermits_peak_modis_ndvi_stack.tif \\
+        --select NDVI --scale 0.0001 --output outputs/trends/vegetation_breaks.tif --workers 4
+"""
+
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from scipy.special import kolmogorov
+
+sys.path.append(str(Path(__file__).parent.parent))
+from analysis.trends import CubeTimeStack, RasterTimeStack, decimal_years
+from utils.logger import setup_logger
+from utils.tiling import iter_tiles
+
+logger = setup_logger(__name__)
+
+BREAK_BANDS = ['break_date', 'break_magnitude', 'break_confidence', 'n_obs']
+
+# Valid observations required on each side of a candidate break
+MIN_SEGMENT_OBS = 8
+
+DEFAULT_MEMORY_MB = 256
+DEFAULT_TILE_SIZE = 512
+
+# Base model columns: intercept, trend, annual cosine, annual sine
+N_BASE = 4
+
+
+def _base_design(t: np.ndarray) -> np.ndarray:
+    """(T, 4) harmonic + trend design on centred time"""
+    return np.stack([np.ones_like(t), t, np.cos(2 * np.pi * t), np.sin(2 * np.pi * t)], axis=1)
+
+
+def detect_breaks(y: np.ndarray, t: np.ndarray, min_segment: int = MIN_SEGMENT_OBS) -> dict:
+    """
+    Single most significant break per pixel
+
+    Args:
+        y: (T, pixels) values, NaN = missing
+        t: (T,) sorted observation times (fractional years)
+        min_segment: Valid observations required before and after a break
+
+    Returns:
+        dict of BREAK_BANDS -> (pixels,) float32 arrays (NaN where no break
+        could be fitted)
+    """
+    n_times, n_pixels = y.shape
+    valid = ~np.isnan(y)
+    w = valid.astype(np.float64)
+    yz = np.where(valid, y, 0.0).astype(np.float64)
+    t0 = t.mean()
+    tc = t - t0
+    # The harmonic uses absolute time so the season is anchored to the calendar
+    x = _base_design(tc)
+    x[:, 2:] = _base_design(t)[:, 2:]
+
+    # No-break model
+    a = np.einsum('tp,ti,tj->pij', w, x, x)
+    b = np.einsum('tp,ti,tp->pi', w, x, yz)
+    yy = np.einsum('tp,tp->p', w, yz * yz)
+    ridge = 1e-9 * np.eye(N_BASE)
+    beta0 = np.linalg.solve(a + ridge, b[..., None])[..., 0]
+    rss0 = yy - np.einsum('pi,pi->p', beta0, b)
+    n = w.sum(axis=0)
+
+    # Suffix sums: entry k sums over observations k..T-1
+    def suffix(values):
+        return np.flip(np.cumsum(np.flip(values, axis=0), axis=0), axis=0)
+
+    s_w = suffix(w)
+    s_wt = suffix(w * tc[:, None])
+    s_wtt = suffix(w * (tc ** 2)[:, None])
+    s_wx = suffix(w[..., None] * x[:, None, :])
+    s_wxt = suffix(w[..., None] * (x * tc[:, None])[:, None, :])
+    s_wy = suffix(yz * w)
+    s_wyt = suffix(yz * w * tc[:, None])
+
+    best_rss = np.full(n_pixels, np.inf)
+    best_k = np.full(n_pixels, -1)
+    best_shift = np.full(n_pixels, np.nan)
+
+    m = np.zeros((n_pixels, N_BASE + 2, N_BASE + 2))
+    m[:, :N_BASE, :N_BASE] = a + ridge
+    r = np.zeros((n_pixels, N_BASE + 2))
+    r[:, :N_BASE] = b
+    for k in range(1, n_times):
+        after = s_w[k]
+        # Breaks are dated to the first valid observation of the new segment
+        usable = valid[k] & (after >= min_segment) & (n - after >= min_segment)
+        if not usable.any():
+            continue
+        tau = tc[k]
+        # Cross terms of the step s = [t >= tau] and hinge h = (t - tau) s
+        sx = s_wx[k]
+        hx = s_wxt[k] - tau * sx
+        m[:, :N_BASE, N_BASE] = m[:, N_BASE, :N_BASE] = sx
+        m[:, :N_BASE, N_BASE + 1] = m[:, N_BASE + 1, :N_BASE] = hx
+        m[:, N_BASE, N_BASE] = after
+        m[:, N_BASE, N_BASE + 1] = m[:, N_BASE + 1, N_BASE] = s_wt[k] - tau * after
+        m[:, N_BASE + 1, N_BASE + 1] = s_wtt[k] - 2 * tau * s_wt[k] + tau ** 2 * after + 1e-9
+        m[:, N_BASE, N_BASE] += 1e-9
+        r[:, N_BASE] = s_wy[k]
+        r[:, N_BASE + 1] = s_wyt[k] - tau * s_wy[k]
+
+        beta = np.linalg.solve(m, r[..., None])[..., 0]
+        rss = yy - np.einsum('pi,pi->p', beta, r)
+        better = usable & (rss < best_rss)
+        best_rss = np.where(better, rss, best_rss)
+        best_k = np.where(better, k, best_k)
+        best_shift = np.where(better, beta[:, N_BASE], best_shift)
+
+    # OLS-CUSUM of the no-break residuals in time order
+    residuals = np.where(valid, yz - x @ beta0.T, 0.0)
+    dof = np.maximum(n - N_BASE, 1)
+    sigma = np.sqrt(np.maximum(rss0, 0) / dof)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        statistic = np.abs(np.cumsum(residuals, axis=0)).max(axis=0) / (sigma * np.sqrt(n))
+    confidence = np.where(np.isfinite(statistic), 1 - kolmogorov(np.nan_to_num(statistic)), np.nan)
+
+    found = best_k >= 0
+    return {
+        'break_date': np.where(found, t[np.maximum(best_k, 0)], np.nan).astype(np.float32),
+        'break_magnitude': np.where(found, best_shift, np.nan).astype(np.float32),
+        'break_confidence': np.where(found, confidence, np.nan).astype(np.float32),
+        'n_obs': n.astype(np.float32)
+    }
+
+
+def pixel_chunk_size(n_times: int, memory_mb: float) -> int:
+    """Pixels per batch: suffix sums (15 float64 per date) dominate"""
+    return max(int(memory_mb * 1024 ** 2 / (15 * 8 * max(n_times, 1))), 1)
+
+
+def detect_breaks_stack(stack: np.ndarray, dates, memory_mb: float = DEFAULT_MEMORY_MB,
+                        min_segment: int = MIN_SEGMENT_OBS) -> dict:
+    """
+    Break rasters of a (T, height, width) time stack
+
+    Returns:
+        dict of BREAK_BANDS -> float32 (height, width); break_date is a
+        fractional year
+    """
+    order = np.argsort([d.toordinal() for d in dates], kind='stable')
+    t = decimal_years([dates[i] for i in order])
+    n_times, height, width = stack.shape
+    y = stack[order].reshape(n_times, -1)
+
+    out = {name: np.full(height * width, np.nan, dtype=np.float32) for name in BREAK_BANDS}
+    chunk = pixel_chunk_size(n_times, memory_mb)
+    for start in range(0, y.shape[1], chunk):
+        result = detect_breaks(y[:, start:start + chunk], t, min_segment)
+        for name in BREAK_BANDS:
+            out[name][start:start + chunk] = result[name]
+    return {name: values.reshape(height, width) for name, values in out.items()}
+
+
+# Per-process time stack, opened once by the pool initializer
+_worker = {}
+
+
+def _init_worker(source: tuple, memory_mb: float, min_segment: int):
+    kind, path, select, scale = source
+    _worker['stack'] = (RasterTimeStack(path, select, scale) if kind == 'stack'
+                        else CubeTimeStack(path, select, scale))
+    _worker['memory_mb'] = memory_mb
+    _worker['min_segment'] = min_segment
+
+
+def _detect_tile(tile):
+    stack = _worker['stack']
+    result = detect_breaks_stack(stack.read(tile), stack.dates, _worker['memory_mb'],
+                                 _worker['min_segment'])
+    return tile, np.stack([result[name] for name in BREAK_BANDS])
+
+
+def write_breaks(source: tuple, output_path: Path, workers: int = None,
+                 tile_size: int = DEFAULT_TILE_SIZE, memory_mb: float = DEFAULT_MEMORY_MB,
+                 min_segment: int = MIN_SEGMENT_OBS) -> Path:
+    """
+    Detect breaks tile by tile in a process pool and save them as one GeoTIFF
+
+    Args:
+        source: ('stack' | 'cube', path, band selector, scale)
+        output_path: Output GeoTIFF (bands BREAK_BANDS)
+        workers: Worker processes (default: CPU count)
+        tile_size: Tile edge in pixels
+        memory_mb: Working-memory budget per worker
+        min_segment: Valid observations required on each side of a break
+    """
+    _init_worker(source, memory_mb, min_segment)
+    stack = _worker['stack']
+    profile = dict(stack.profile)
+    profile.update(driver='GTiff', count=len(BREAK_BANDS), dtype='float32', nodata=np.nan,
+                   compress='deflate', predictor=3, tiled=True, blockxsize=256, blockysize=256)
+    tiles = list(iter_tiles(stack.height, stack.width, tile_size))
+    logger.info(f"Break detection: {len(stack.dates)} dates, {stack.width} x {stack.height} px, "
+                f"{len(tiles)} tiles")
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with rasterio.open(output_path, 'w', **profile) as dst, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(source, memory_mb, min_segment)) as pool:
+        for band, name in enumerate(BREAK_BANDS, start=1):
+            dst.set_band_description(band, name)
+        for done, (tile, data) in enumerate(pool.map(_detect_tile, tiles), start=1):
+            dst.write(data, window=tile.window)
+            if done % max(len(tiles) // 10, 1) == 0:
+                logger.info(f"  {done}/{len(tiles)} tiles")
+    stack.close()
+    return Path(output_path)
+
+
+def main(argv=None):
+    """Break rasters from a dated GeoTIFF stack or a data cube"""
+    parser = argparse.ArgumentParser(description='Per-pixel vegetation break detection')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--stack', type=Path, help='GeoTIFF with one dated band per observation')
+    source.add_argument('--cube', type=Path, help='Time-series data cube directory')
+    parser.add_argument('--select', default='NDVI',
+                        help='Band name: substring of the stack band descriptions / cube band')
+    parser.add_argument('--scale', type=float, default=1.0, help='Value scale (MOD13Q1: 0.0001)')
+    parser.add_argument('--output', required=True, type=Path)
+    parser.add_argument('--workers', type=int, help='Worker processes (default: all CPUs)')
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument('--memory-mb', type=float, default=DEFAULT_MEMORY_MB)
+    parser.add_argument('--min-segment', type=int, default=MIN_SEGMENT_OBS,
+                        help='Valid observations required on each side of a break')
+    args = parser.parse_args(argv)
+
+    source = ('stack', args.stack, args.select, args.scale) if args.stack else \
+        ('cube', args.cube, args.select, args.scale)
+    write_breaks(source, args.output, args.workers, args.tile_size, args.memory_mb, args.min_segment)
+    logger.info(f"✓ Breaks saved: {args.output} ({', '.join(BREAK_BANDS)})")
+
+
+if __name__ == '__main__':
+    main()
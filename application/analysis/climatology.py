@@ -0,0 +1,417 @@
+"""
+Per-pixel Vegetation Index Climatology
+Per-pixel, per-day-of-year mean and standard deviation of NDVI / NBR / NDMI
+from a multi-year stack, so stress can be expressed as a standardized
+anomaly (z-score) against each pixel's own normal for the date instead of
+fixed healthy-vegetation constants.
+
+Layout (directory):
+    climatology.json      Grid, indices, bin width, scale, dates already added per index
+    <INDEX>_count.npy     (bins, y, x) uint16 observation counts
+    <INDEX>_m1.npy        (bins, y, x) float32 running mean (merge state)
+    <INDEX>_m2.npy        (bins, y, x) float32 running M2 = sum of squared deviations
+    <INDEX>_mean.npy      (bins, y, x) int16 published mean / SCALE
+    <INDEX>_std.npy       (bins, y, x) int16 published sample std / SCALE
+
+Statistics are kept per day-of-year bin and updated in a streaming fashion
+(Welford / Chan merge of each new batch into the stored count, mean and
+M2), so new years are added without revisiting old ones. Merges always
+start from the float32 state; only the published normals read at lookup
+are quantised, so adding years does not accumulate rounding error. The
+arrays are .npy memmaps: looking up a date reads one contiguous (y, x)
+slab per statistic.
+
+Usage:
+    python application/analysis/climatology.py build --cube data/cube --output outputs/climatology
+    python application/analysis/climatology.py anomaly --climatology outputs/climatology \\
+        --image data/satellite/hermits_peak_prefire_2020_2022.tif --date 2022-04-01 \\
+        --output outputs/climatology/anomaly_2022-04-01.tif
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.warp import reproject, transform_bounds, Resampling
+from rasterio.windows import Window, from_bounds
+
+sys.path.append(str(Path(__file__).parent.parent))
+from analysis.trends import CubeTimeStack, RasterTimeStack
+from utils.logger import setup_logger
+from utils.tiling import Tile, iter_tiles, DEFAULT_TILE_SIZE
+
+logger = setup_logger(__name__)
+
+INDEX_FILE = 'climatology.json'
+INDICES = ['NDVI', 'NBR', 'NDMI']
+
+# Day-of-year bin width (16 days matches the MOD13Q1 / composite cadence)
+DEFAULT_BIN_DAYS = 16
+
+# Stored value = round(value / SCALE) as int16; NODATA where count == 0
+SCALE = 1e-4
+NODATA = np.iinfo(np.int16).min
+
+# Normals are pooled over this many neighbouring bins on each side at lookup
+DEFAULT_POOL_BINS = 1
+
+# Normalized-difference indices lie in [-1, 1]; the margin allows smoothing
+# overshoot. Larger values are unscaled input (e.g. MOD13Q1 without --scale)
+VALUE_LIMIT = 1.5
+
+STATE_STATS = ('m1', 'm2')
+
+
+def _chan_merge(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """Combine two (count, mean, M2) summaries (Chan et al. parallel Welford)"""
+    n = n_a + n_b
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = mean_b - mean_a
+        mean = np.where(n > 0, mean_a + delta * np.where(n > 0, n_b / n, 0), np.nan)
+        m2 = m2_a + m2_b + delta ** 2 * np.where(n > 0, n_a * n_b / n, 0)
+    mean = np.where(n_a == 0, mean_b, np.where(n_b == 0, mean_a, mean))
+    m2 = np.where(n_a == 0, m2_b, np.where(n_b == 0, m2_a, m2))
+    return n, mean, m2
+
+
+class Climatology:
+    """Memory-mapped per-pixel day-of-year climatology"""
+
+    def __init__(self, path: Path, mode: str = 'r'):
+        """Open an existing climatology directory (mode 'r' or 'r+')"""
+        self.path = Path(path)
+        with open(self.path / INDEX_FILE) as f:
+            self.index = json.load(f)
+        self.indices = self.index['indices']
+        self.bin_days = self.index['bin_days']
+        self.n_bins = math.ceil(366 / self.bin_days)
+        self.height = self.index['height']
+        self.width = self.index['width']
+        self.crs = self.index['crs']
+        self.transform = Affine.from_gdal(*self.index['transform'])
+        self.mode = mode
+        # Dates are tracked per index; older climatologies kept one list for all
+        if isinstance(self.index['dates'], list):
+            self.index['dates'] = {name: list(self.index['dates']) for name in self.indices}
+        self.arrays = {
+            (name, stat): np.load(self.path / f"{name}_{stat}.npy", mmap_mode=mode)
+            for name in self.indices for stat in ('count', 'mean', 'std')
+        }
+        # Merge state (absent in climatologies built before it was kept)
+        for name in self.indices:
+            for stat in STATE_STATS:
+                state_path = self.path / f"{name}_{stat}.npy"
+                if state_path.exists():
+                    self.arrays[name, stat] = np.load(state_path, mmap_mode=mode)
+
+    @classmethod
+    def create(cls, path: Path, height: int, width: int, crs, transform: Affine,
+               indices=INDICES, bin_days: int = DEFAULT_BIN_DAYS) -> 'Climatology':
+        """Create an empty climatology on a grid"""
+        path = Path(path)
+        if (path / INDEX_FILE).exists():
+            raise FileExistsError(f"A climatology already exists at {path}")
+        path.mkdir(parents=True, exist_ok=True)
+        n_bins = math.ceil(366 / bin_days)
+        for name in indices:
+            for stat, dtype, fill in (('count', np.uint16, 0), ('mean', np.int16, NODATA),
+                                      ('std', np.int16, NODATA), ('m1', np.float32, 0),
+                                      ('m2', np.float32, 0)):
+                array = np.lib.format.open_memmap(path / f"{name}_{stat}.npy", mode='w+',
+                                                  dtype=dtype, shape=(n_bins, height, width))
+                array[:] = fill
+                array.flush()
+                del array
+        index = {
+            'indices': list(indices),
+            'bin_days': bin_days,
+            'scale': SCALE,
+            'height': height,
+            'width': width,
+            'crs': str(crs),
+            'transform': list(transform.to_gdal()),
+            'dates': {name: [] for name in indices}
+        }
+        cls._write_index(path, index)
+        return cls(path, mode='r+')
+
+    @staticmethod
+    def _write_index(path: Path, index: dict):
+        tmp_path = Path(path) / (INDEX_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, Path(path) / INDEX_FILE)
+
+    @property
+    def dates(self) -> list:
+        """ISO dates added to any of the indices, sorted"""
+        return sorted(set().union(*self.index['dates'].values()))
+
+    def day_bin(self, when: date) -> int:
+        return (when.timetuple().tm_yday - 1) // self.bin_days
+
+    # --- updating ------------------------------------------------------
+
+    def _decode(self, name: str, bin_index: int, tile: Tile):
+        """(count, mean, M2) from the published int16 normals (lookup only)"""
+        count = self.arrays[name, 'count'][(bin_index,) + tile.slices].astype(np.float64)
+        mean = self.arrays[name, 'mean'][(bin_index,) + tile.slices].astype(np.float64) * SCALE
+        std = self.arrays[name, 'std'][(bin_index,) + tile.slices].astype(np.float64) * SCALE
+        m2 = np.where(count > 1, std ** 2 * (count - 1), 0.0)
+        return count, np.where(count > 0, mean, 0.0), m2
+
+    def _read_state(self, name: str, bin_index: int, tile: Tile):
+        """(count, mean, M2) merge state in float64"""
+        count = self.arrays[name, 'count'][(bin_index,) + tile.slices].astype(np.float64)
+        mean = self.arrays[name, 'm1'][(bin_index,) + tile.slices].astype(np.float64)
+        m2 = self.arrays[name, 'm2'][(bin_index,) + tile.slices].astype(np.float64)
+        return count, np.where(count > 0, mean, 0.0), np.where(count > 1, m2, 0.0)
+
+    def _write_state(self, name: str, bin_index: int, tile: Tile, count, mean, m2):
+        """Store the merge state and publish the quantised normals"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.where(count > 1, np.sqrt(np.maximum(m2, 0) / (count - 1)), 0.0)
+        limit = np.iinfo(np.int16).max
+        index = (bin_index,) + tile.slices
+        self.arrays[name, 'count'][index] = np.minimum(count, np.iinfo(np.uint16).max)
+        self.arrays[name, 'm1'][index] = np.where(count > 0, mean, 0.0)
+        self.arrays[name, 'm2'][index] = np.where(count > 1, np.maximum(m2, 0), 0.0)
+        # Inputs are range-checked in add(), so the clip only guards rounding
+        self.arrays[name, 'mean'][index] = np.where(
+            count > 0, np.clip(np.round(mean / SCALE), -limit, limit), NODATA)
+        self.arrays[name, 'std'][index] = np.where(
+            count > 0, np.clip(np.round(std / SCALE), 0, limit), NODATA)
+
+    def _ensure_state(self, name: str):
+        """
+        Create the float32 merge state of an index if missing
+
+        Climatologies written before the state was kept are seeded once from
+        their published normals.
+        """
+        if all((name, stat) in self.arrays for stat in STATE_STATS):
+            return
+        shape = self.arrays[name, 'count'].shape
+        for stat in STATE_STATS:
+            array = np.lib.format.open_memmap(self.path / f"{name}_{stat}.npy", mode='w+',
+                                              dtype=np.float32, shape=shape)
+            self.arrays[name, stat] = array
+        full = Tile(0, 0, self.height, self.width)
+        for bin_index in range(self.n_bins):
+            _, mean, m2 = self._decode(name, bin_index, full)
+            self.arrays[name, 'm1'][bin_index] = mean
+            self.arrays[name, 'm2'][bin_index] = m2
+        logger.info(f"  {name}: merge state seeded from the published normals")
+
+    @staticmethod
+    def check_range(name: str, stack, new, tile_size: int = DEFAULT_TILE_SIZE):
+        """Raise ValueError if any new observation is outside ±VALUE_LIMIT"""
+        for tile in iter_tiles(stack.height, stack.width, tile_size):
+            values = stack.read(tile)[new]
+            with np.errstate(invalid='ignore'):
+                bad = np.abs(values) > VALUE_LIMIT
+            if bad.any():
+                raise ValueError(
+                    f"{name}: {int(bad.sum())} values outside ±{VALUE_LIMIT} (max |value| "
+                    f"{float(np.nanmax(np.abs(values))):g}); is the stack unscaled? "
+                    f"(MOD13Q1 needs --scale 0.0001)")
+
+    def add(self, stacks: dict, tile_size: int = DEFAULT_TILE_SIZE) -> int:
+        """
+        Fold new observations into the climatology
+
+        Dates already added to an index are skipped, so re-running on a
+        growing stack only adds what is new. Dates are tracked per index, so
+        an index can be back-filled on its own. All new observations are
+        range-checked (one read pass) before anything is written.
+
+        Args:
+            stacks: {index name: time stack (trends.RasterTimeStack / CubeTimeStack)}
+                on the climatology grid
+            tile_size: Spatial tile processed at a time
+
+        Returns:
+            Number of dates new to at least one index
+
+        Raises:
+            ValueError: Index not in the climatology, grid mismatch, or values
+                outside ±VALUE_LIMIT
+        """
+        new_dates = set()
+        pending = {}
+        for name, stack in stacks.items():
+            if name not in self.indices:
+                raise ValueError(f"{name}: not an index of this climatology "
+                                 f"({', '.join(self.indices)})")
+            if (stack.height, stack.width) != (self.height, self.width):
+                raise ValueError(f"{name} stack is {stack.height} x {stack.width}, "
+                                 f"climatology grid is {self.height} x {self.width}")
+            seen = set(self.index['dates'][name])
+            new = [i for i, when in enumerate(stack.dates) if when.isoformat() not in seen]
+            if new:
+                self.check_range(name, stack, new, tile_size)
+                pending[name] = new
+
+        for name, new in pending.items():
+            stack = stacks[name]
+            self._ensure_state(name)
+            added = {stack.dates[i].isoformat() for i in new}
+            new_dates.update(added)
+            bins = np.array([self.day_bin(stack.dates[i]) for i in new])
+
+            for tile in iter_tiles(self.height, self.width, tile_size):
+                values = stack.read(tile)[new].astype(np.float64)
+                for bin_index in np.unique(bins):
+                    batch = values[bins == bin_index]
+                    n_b = (~np.isnan(batch)).sum(axis=0).astype(np.float64)
+                    if not n_b.any():
+                        continue
+                    with np.errstate(invalid='ignore'):
+                        mean_b = np.where(n_b > 0, np.nansum(batch, axis=0) / np.maximum(n_b, 1), 0.0)
+                        m2_b = np.nansum((batch - mean_b) ** 2, axis=0)
+                    merged = _chan_merge(*self._read_state(name, bin_index, tile), n_b, mean_b, m2_b)
+                    self._write_state(name, bin_index, tile, *merged)
+            self.index['dates'][name] = sorted(set(self.index['dates'][name]) | added)
+            logger.info(f"  ✓ {name}: {len(new)} new dates")
+
+        for array in self.arrays.values():
+            array.flush()
+        self._write_index(self.path, self.index)
+        return len(new_dates)
+
+    # --- lookup --------------------------------------------------------
+
+    def _window_for(self, dst_transform: Affine, dst_shape, dst_crs) -> Window:
+        bounds = rasterio.transform.array_bounds(*dst_shape, dst_transform)
+        if str(dst_crs) != self.crs:
+            bounds = transform_bounds(dst_crs, self.crs, *bounds)
+        window = from_bounds(*bounds, transform=self.transform).round_offsets().round_lengths()
+        window = Window(window.col_off - 1, window.row_off - 1, window.width + 2, window.height + 2)
+        return window.intersection(Window(0, 0, self.width, self.height))
+
+    def normals(self, name: str, when: date, window: Window = None,
+                pool_bins: int = DEFAULT_POOL_BINS):
+        """
+        Mean, std and count of one index around a date on the climatology grid
+
+        Neighbouring bins (pool_bins on each side, wrapping over the year
+        end) are merged in, so sparse years still give a usable spread.
+
+        Returns:
+            (mean, std, count) float32 arrays for the window (NaN where count < 2)
+        """
+        window = window or Window(0, 0, self.width, self.height)
+        tile = Tile(int(window.row_off), int(window.col_off), int(window.height), int(window.width))
+        center = self.day_bin(when)
+        n = mean = m2 = 0
+        for offset in range(-pool_bins, pool_bins + 1):
+            summary = self._decode(name, (center + offset) % self.n_bins, tile)
+            n, mean, m2 = summary if offset == -pool_bins else _chan_merge(n, mean, m2, *summary)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(m2 / (n - 1))
+        usable = n >= 2
+        return (np.where(usable, mean, np.nan).astype(np.float32),
+                np.where(usable, std, np.nan).astype(np.float32),
+                n.astype(np.float32))
+
+    def normals_on(self, name: str, when: date, dst_transform: Affine, dst_shape, dst_crs,
+                   pool_bins: int = DEFAULT_POOL_BINS):
+        """normals() resampled (bilinear) onto another grid or window of it"""
+        window = self._window_for(dst_transform, dst_shape, dst_crs)
+        src_transform = rasterio.windows.transform(window, self.transform)
+        result = []
+        for array in self.normals(name, when, window, pool_bins):
+            out = np.full(dst_shape, np.nan, dtype=np.float32)
+            reproject(array, out, src_transform=src_transform, src_crs=self.crs, src_nodata=np.nan,
+                      dst_transform=dst_transform, dst_crs=dst_crs, dst_nodata=np.nan,
+                      resampling=Resampling.bilinear)
+            result.append(out)
+        return tuple(result)
+
+
+def standardized_anomaly(value: np.ndarray, mean: np.ndarray, std: np.ndarray,
+                         min_std: float = 0.01) -> np.ndarray:
+    """z = (value - mean) / std, NaN where the normal is missing"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ((value - mean) / np.maximum(std, min_std)).astype(np.float32)
+
+
+def main(argv=None):
+    """Build / update a climatology, or write anomalies of an image"""
+    parser = argparse.ArgumentParser(description='Per-pixel day-of-year vegetation index climatology')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Create or extend a climatology')
+    source = build.add_mutually_exclusive_group(required=True)
+    source.add_argument('--cube', type=Path, help='Time-series cube with NDVI / NBR / NDMI bands')
+    source.add_argument('--stack', action='append', metavar='INDEX=PATH',
+                        help='Dated GeoTIFF stack per index (repeatable), e.g. NDVI=ndvi_stack.tif')
+    build.add_argument('--scale', type=float, default=1.0, help='Value scale of the stacks')
+    build.add_argument('--output', required=True, type=Path, help='Climatology directory')
+    build.add_argument('--bin-days', type=int, default=DEFAULT_BIN_DAYS)
+
+    anomaly = subparsers.add_parser('anomaly', help='z-scores of a composite for a date')
+    anomaly.add_argument('--climatology', required=True, type=Path)
+    anomaly.add_argument('--image', required=True, type=Path,
+                         help='Composite with bands named NDVI / NBR / NDMI')
+    anomaly.add_argument('--date', required=True, type=date.fromisoformat)
+    anomaly.add_argument('--output', required=True, type=Path)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        if args.cube:
+            stacks = {name: CubeTimeStack(args.cube, name, args.scale) for name in INDICES}
+        else:
+            stacks = {}
+            for item in args.stack:
+                name, path = item.split('=', 1)
+                stacks[name.upper()] = RasterTimeStack(Path(path), None, args.scale)
+        first = next(iter(stacks.values()))
+        if (args.output / INDEX_FILE).exists():
+            climatology = Climatology(args.output, mode='r+')
+        else:
+            climatology = Climatology.create(args.output, first.height, first.width,
+                                             first.profile['crs'], first.profile['transform'],
+                                             indices=list(stacks), bin_days=args.bin_days)
+        try:
+            added = climatology.add(stacks)
+        except ValueError as e:
+            parser.error(str(e))
+        finally:
+            for stack in stacks.values():
+                stack.close()
+        logger.info(f"✓ {args.output}: {added} dates added, {len(climatology.dates)} total")
+        return
+
+    climatology = Climatology(args.climatology)
+    with rasterio.open(args.image) as src:
+        profile = src.profile.copy()
+        descriptions = [d.upper() if d else '' for d in src.descriptions]
+        missing = [name for name in climatology.indices if name not in descriptions]
+        if missing:
+            parser.error(f"{args.image} has no {', '.join(missing)} band "
+                         f"(band descriptions: {', '.join(d or '-' for d in descriptions)})")
+        layers = []
+        for name in climatology.indices:
+            value = src.read(descriptions.index(name) + 1).astype(np.float32)
+            mean, std, _ = climatology.normals_on(name, args.date, src.transform,
+                                                  (src.height, src.width), src.crs)
+            layers.append(standardized_anomaly(value, mean, std))
+    profile.update(count=len(layers), dtype='float32', nodata=np.nan, compress='deflate', predictor=3)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with rasterio.open(args.output, 'w', **profile) as dst:
+        dst.write(np.stack(layers))
+        for band, name in enumerate(climatology.indices, start=1):
+            dst.set_band_description(band, f"{name}_z")
+    logger.info(f"✓ Anomalies saved: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
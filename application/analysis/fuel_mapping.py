@@ -5,10 +5,10 @@ Fuel Change Detection and Enhanced Mapping
 import numpy as np
 import rasterio
 from pathlib import Path
-from scipy.stats import pearsonr
 import sys
 
 sys.path.append(str(Path(__file__).parent.parent))
+from analysis.spatial_stats import spatial_significance
 from utils.config import Config
 from utils.logger import setup_logger
 
@@ -40,6 +40,7 @@ class FuelMapper:
         ).astype('uint8')
 
         # Save mask
+        self.config.ensure_dir(self.config.RESULTS_DIR)
         with rasterio.open(self.config.RESULTS_DIR / 'fuel_increase_areas.tif', 'w', **profile) as dst:
             dst.write(fuel_increase_mask, 1)
 
@@ -88,6 +89,7 @@ class FuelMapper:
 
         # Save
         profile.update(dtype='float32')
+        self.config.ensure_dir(self.config.RESULTS_DIR)
         with rasterio.open(self.config.RESULTS_DIR / 'fuel_hazard_enhanced.tif', 'w', **profile) as dst:
             dst.write(fuel_hazard, 1)
 
@@ -99,59 +101,73 @@ class FuelMapper:
 
         # Load actual burn severity
         with rasterio.open(self.config.PROCESSED_DIR / 'dnbr.tif') as src:
-            actual_severity = src.read(1).flatten()
+            actual_severity = src.read(1)
 
         # Load LANDFIRE baseline (convert to continuous hazard)
         with rasterio.open(self.config.PROCESSED_DIR / 'fbfm40_processed.tif') as src:
-            fbfm40 = src.read(1).flatten()
+            fbfm40 = src.read(1)
 
         baseline_hazard = self._fbfm_to_hazard(fbfm40)
 
         # Load enhanced
         with rasterio.open(self.config.RESULTS_DIR / 'fuel_hazard_enhanced.tif') as src:
-            enhanced_hazard = src.read(1).flatten()
+            enhanced_hazard = src.read(1)
 
-        # Filter to burned areas
+        # Filter to burned areas (kept 2-D so spatial autocorrelation can be measured)
         burned_mask = (actual_severity > 0.1) & ~np.isnan(actual_severity) & ~np.isnan(enhanced_hazard)
 
-        actual_valid = actual_severity[burned_mask]
-        baseline_valid = baseline_hazard[burned_mask]
-        enhanced_valid = enhanced_hazard[burned_mask]
-
-        # Calculate correlations
-        corr_baseline, p_baseline = pearsonr(baseline_valid, actual_valid)
-        corr_enhanced, p_enhanced = pearsonr(enhanced_valid, actual_valid)
-
-        # Calculate improvement
-        improvement = corr_enhanced - corr_baseline
-        improvement_pct = (improvement / corr_baseline) * 100
+        # Correlations with significance corrected for spatial autocorrelation
+        baseline_stats = spatial_significance(baseline_hazard, actual_severity, burned_mask)
+        enhanced_stats = spatial_significance(enhanced_hazard, actual_severity, burned_mask)
+        corr_baseline = baseline_stats['pearson_r']
+        corr_enhanced = enhanced_stats['pearson_r']
+
+        # Calculate improvement (None when either correlation is undefined:
+        # too few burned pixels or a constant hazard / severity field)
+        if corr_baseline is None or corr_enhanced is None:
+            logger.warning("  ⚠ Correlation undefined (too few pixels or constant field)")
+            improvement = improvement_pct = None
+        else:
+            improvement = corr_enhanced - corr_baseline
+            improvement_pct = (improvement / corr_baseline) * 100 if corr_baseline else None
 
         # Save results
         results = {
-            'sample_size': len(actual_valid),
+            'sample_size': int(burned_mask.sum()),
             'baseline_correlation': corr_baseline,
             'enhanced_correlation': corr_enhanced,
             'improvement': improvement,
             'improvement_pct': improvement_pct,
-            'p_value_baseline': p_baseline,
-            'p_value_enhanced': p_enhanced
+            'p_value_baseline': baseline_stats['p_value_dutilleul'],
+            'p_value_enhanced': enhanced_stats['p_value_dutilleul'],
+            'effective_sample_size_baseline': baseline_stats['n_effective'],
+            'effective_sample_size_enhanced': enhanced_stats['n_effective'],
+            'residual_morans_i_baseline': baseline_stats['residual_morans_i']['morans_i'],
+            'residual_morans_i_enhanced': enhanced_stats['residual_morans_i']['morans_i']
         }
 
+        def _fmt(value, spec):
+            return format(value, spec) if value is not None else 'n/a'
+
         # Write to file
+        self.config.ensure_dir(self.config.REPORTS_DIR)
         with open(self.config.REPORTS_DIR / 'validation_results.txt', 'w') as f:
             f.write("VALIDATION RESULTS\n")
             f.write("=" * 60 + "\n\n")
             f.write(f"Sample Size (burned pixels): {results['sample_size']:,}\n")
-            f.write(f"Baseline Correlation (Pearson): {results['baseline_correlation']:.4f}\n")
-            f.write(f"Enhanced Correlation (Pearson): {results['enhanced_correlation']:.4f}\n")
-            f.write(f"Absolute Improvement: {results['improvement']:.4f}\n")
-            f.write(f"Relative Improvement: {results['improvement_pct']:.2f}%\n")
-            f.write(f"P-value (baseline): {results['p_value_baseline']:.6f}\n")
-            f.write(f"P-value (enhanced): {results['p_value_enhanced']:.6f}\n")
-
-        logger.info(f"  Baseline correlation: {corr_baseline:.3f}")
-        logger.info(f"  Enhanced correlation: {corr_enhanced:.3f}")
-        logger.info(f"  Improvement: +{improvement:.3f} ({improvement_pct:+.1f}%)")
+            f.write(f"Baseline Correlation (Pearson): {_fmt(results['baseline_correlation'], '.4f')}\n")
+            f.write(f"Enhanced Correlation (Pearson): {_fmt(results['enhanced_correlation'], '.4f')}\n")
+            f.write(f"Absolute Improvement: {_fmt(results['improvement'], '.4f')}\n")
+            f.write(f"Relative Improvement: {_fmt(results['improvement_pct'], '.2f')}%\n")
+            f.write(f"P-value (baseline): {_fmt(results['p_value_baseline'], '.6f')}\n")
+            f.write(f"P-value (enhanced): {_fmt(results['p_value_enhanced'], '.6f')}\n")
+            f.write(f"Effective Sample Size (baseline): {_fmt(results['effective_sample_size_baseline'], ',.0f')}\n")
+            f.write(f"Effective Sample Size (enhanced): {_fmt(results['effective_sample_size_enhanced'], ',.0f')}\n")
+            f.write("(P-values use Dutilleul's effective sample size to account for spatial autocorrelation)\n")
+
+        logger.info(f"  Baseline correlation: {_fmt(corr_baseline, '.3f')}")
+        logger.info(f"  Enhanced correlation: {_fmt(corr_enhanced, '.3f')}")
+        logger.info(f"  Improvement: {_fmt(improvement, '+.3f')} ({_fmt(improvement_pct, '+.1f')}%)")
         logger.info(f"  ✓ Results saved to {self.config.REPORTS_DIR / 'validation_results.txt'}")
 
         return results
@@ -169,9 +185,9 @@ class FuelMapper:
         return hazard
 
 
-def main():
+def main(config: Config = None):
     """Run fuel mapping pipeline"""
-    config = Config()
+    config = config or Config.from_env()
     mapper = FuelMapper(config)
 
     mapper.detect_fuel_changes()
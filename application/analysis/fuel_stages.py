@@ -0,0 +1,180 @@
+"""
+Fuel Mapping Stage Math
+Per-pixel computations shared by the analysis scripts (01-03) and the
+chunked / sharded engine. Every function works on arrays of any shape, so
+the same code runs on a full raster or on one tile.
+"""
+
+import numpy as np
+
+# Healthy-vegetation reference values used by the stress indicators
+NDVI_HEALTHY = 0.7
+NDMI_HEALTHY = 0.5
+NBR_HEALTHY = 0.6
+
+# Standardized anomaly (z-score below the pixel's own day-of-year normal)
+# that counts as full stress when a climatology is available, and the
+# climatology observations required before a pixel's normal is trusted
+ANOMALY_Z_FULL = 2.0
+MIN_CLIMATOLOGY_OBS = 3
+
+# Stress score weights (NDVI health, NDMI moisture, NBR fuel condition)
+STRESS_WEIGHTS = (0.4, 0.35, 0.25)
+
+# Fuel risk score weights on a 0-100 scale (stress, NDVI decline, NDMI deficit)
+RISK_WEIGHTS = (40, 35, 25)
+
+# Points added at full disturbance when a vegetation break raster is
+# available (capped at 100); undisturbed or unevaluated pixels keep the
+# plain RISK_WEIGHTS score, so the risk classes do not shift
+DISTURBANCE_UPLIFT = 15
+RISK_MAX = 100
+
+# Vegetation index drop at a break that counts as full disturbance stress,
+# and the break confidence below which a break is ignored
+DISTURBANCE_FULL_DROP = 0.3
+BREAK_MIN_CONFIDENCE = 0.95
+
+# USGS dNBR burn severity class breaks
+DNBR_CLASS_BREAKS = (0.1, 0.27, 0.44, 0.66)
+
+# Maximum enhanced CBD (kg/m³)
+ENHANCED_CBD_MAX = 1000
+
+
+def _index_stress(index: np.ndarray, healthy: float) -> np.ndarray:
+    """0-1 stress from how far an index falls below its healthy value"""
+    stress = np.where(index > 0, (healthy - index) / healthy, 0)
+    return np.clip(stress, 0, 1)
+
+
+def stress_components(ndvi: np.ndarray, nbr: np.ndarray, ndmi: np.ndarray) -> dict:
+    """
+    Step 1: vegetation stress from Sentinel-2 indices
+
+    Returns:
+        Dict with stress_score (0-1) and ndvi/nbr/ndmi_change (deviation
+        below the healthy reference values)
+    """
+    ndvi_stress = _index_stress(ndvi, NDVI_HEALTHY)
+    ndmi_stress = _index_stress(ndmi, NDMI_HEALTHY)
+    nbr_stress = _index_stress(nbr, NBR_HEALTHY)
+
+    w_ndvi, w_ndmi, w_nbr = STRESS_WEIGHTS
+    stress_score = w_ndvi * ndvi_stress + w_ndmi * ndmi_stress + w_nbr * nbr_stress
+
+    return {
+        'stress_score': stress_score,
+        'ndvi_change': NDVI_HEALTHY - ndvi,
+        'nbr_change': NBR_HEALTHY - nbr,
+        'ndmi_change': NDMI_HEALTHY - ndmi
+    }
+
+
+def anomaly_stress_components(ndvi: np.ndarray, nbr: np.ndarray, ndmi: np.ndarray,
+                              normals: dict) -> dict:
+    """
+    Step 1 against a per-pixel climatology
+
+    Each index's stress is its standardized anomaly below the day-of-year
+    normal, clip(-z / ANOMALY_Z_FULL, 0, 1). Pixels whose normal rests on
+    fewer than MIN_CLIMATOLOGY_OBS observations fall back to the fixed
+    healthy reference values of stress_components().
+
+    Args:
+        ndvi, nbr, ndmi: Index arrays for the date
+        normals: {'NDVI' | 'NBR' | 'NDMI': (mean, std, count)} on the same grid
+
+    Returns:
+        Same keys as stress_components(); the *_change layers are the
+        deviation below the pixel's normal, plus ndvi/nbr/ndmi_z anomalies
+    """
+    result = {}
+    stresses = []
+    for name, index, healthy in (('ndvi', ndvi, NDVI_HEALTHY), ('ndmi', ndmi, NDMI_HEALTHY),
+                                 ('nbr', nbr, NBR_HEALTHY)):
+        mean, std, count = normals[name.upper()]
+        trusted = (count >= MIN_CLIMATOLOGY_OBS) & np.isfinite(mean) & np.isfinite(std)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = (index - mean) / np.maximum(std, 0.01)
+        stresses.append(np.where(trusted, np.clip(-z / ANOMALY_Z_FULL, 0, 1),
+                                 _index_stress(index, healthy)))
+        result[f'{name}_change'] = np.where(trusted, mean - index, healthy - index)
+        result[f'{name}_z'] = np.where(trusted, z, np.nan).astype(np.float32)
+
+    w_ndvi, w_ndmi, w_nbr = STRESS_WEIGHTS
+    result['stress_score'] = w_ndvi * stresses[0] + w_ndmi * stresses[1] + w_nbr * stresses[2]
+    return result
+
+
+def severity_class(dnbr: np.ndarray) -> np.ndarray:
+    """USGS burn severity classes (0 = unburned ... 4 = high); NaN dNBR maps to 0"""
+    severity = np.zeros_like(dnbr)
+    for sev_class, lower in enumerate(DNBR_CLASS_BREAKS, start=1):
+        severity[dnbr >= lower] = sev_class
+    return severity
+
+
+def burn_severity(nbr_prefire: np.ndarray, nbr_postfire: np.ndarray):
+    """
+    Step 2: dNBR and USGS burn severity classes
+
+    Returns:
+        (dnbr with non-finite values as NaN, severity class array)
+    """
+    dnbr = nbr_prefire - nbr_postfire
+    dnbr = np.where(np.isfinite(dnbr), dnbr, np.nan)
+    return dnbr, severity_class(dnbr)
+
+
+def disturbance_stress(break_magnitude: np.ndarray, break_confidence: np.ndarray) -> np.ndarray:
+    """
+    0-1 disturbance stress from a vegetation break (see analysis/changepoints.py)
+
+    Only confident downward breaks count (die-off, beetle kill leave dead
+    fuel); missing breaks give 0.
+    """
+    loss = np.clip(-np.nan_to_num(break_magnitude) / DISTURBANCE_FULL_DROP, 0, 1)
+    return np.where(np.nan_to_num(break_confidence) >= BREAK_MIN_CONFIDENCE, loss, 0)
+
+
+def fuel_risk(stress_score: np.ndarray, ndvi_change: np.ndarray,
+              ndmi_change: np.ndarray, disturbance: np.ndarray = None) -> np.ndarray:
+    """
+    Step 3: 0-100 fuel risk score from stress, NDVI decline and NDMI deficit
+
+    With a disturbance stress array (disturbance_stress) up to
+    DISTURBANCE_UPLIFT points are added on top, capped at RISK_MAX; NaN
+    disturbance (no break fitted) adds nothing.
+    """
+    stress_norm = np.clip(stress_score, 0, 1)
+    ndvi_stress_norm = np.clip(ndvi_change / 0.5, 0, 1)  # NDVI change > 0.5 = max stress
+    ndmi_stress_norm = np.clip(ndmi_change / 0.5, 0, 1)  # NDMI change > 0.5 = max stress
+
+    w_stress, w_ndvi, w_ndmi = RISK_WEIGHTS
+    risk = w_stress * stress_norm + w_ndvi * ndvi_stress_norm + w_ndmi * ndmi_stress_norm
+    if disturbance is None:
+        return risk
+    return np.minimum(risk + DISTURBANCE_UPLIFT * np.clip(np.nan_to_num(disturbance), 0, 1), RISK_MAX)
+
+
+def risk_weighting(with_disturbance: bool) -> dict:
+    """Description of the fuel_risk weighting in use, for the statistics JSON"""
+    w_stress, w_ndvi, w_ndmi = RISK_WEIGHTS
+    return {
+        'weights': {'stress': w_stress, 'ndvi_decline': w_ndvi, 'ndmi_deficit': w_ndmi},
+        'disturbance_uplift': DISTURBANCE_UPLIFT if with_disturbance else None,
+        'max': RISK_MAX
+    }
+
+
+def enhanced_fuel(cbd: np.ndarray, fuel_risk_score: np.ndarray):
+    """
+    Step 3: fuel load factor (1.0-2.0) and stress-adjusted canopy bulk density
+
+    Returns:
+        (fuel_load_factor, enhanced_cbd)
+    """
+    fuel_load_factor = 1.0 + (fuel_risk_score / 100)
+    enhanced_cbd = np.clip(cbd * fuel_load_factor, 0, ENHANCED_CBD_MAX)
+    return fuel_load_factor, enhanced_cbd
@@ -0,0 +1,354 @@
+"""
+Temporal Gap-Filling and Smoothing
+Fills cloud / snow gaps in per-pixel index time series (e.g. MOD13Q1 16-day
+NDVI) and smooths them, writing a cleaned data cube on the same grid and
+dates that the trend, break and climatology stages read with --cube.
+
+Methods (all vectorised over the pixels of a tile):
+    linear      Linear interpolation in time between valid observations
+    savgol      Savitzky-Golay filter over the linearly gap-filled series
+    whittaker   Weighted Whittaker smoother: minimises
+                Σ w (y - z)² + λ Σ (Δ^d z)², i.e. solves the banded system
+                (W + λ DᵀD) z = W y with a banded Cholesky factorisation
+                whose loop runs over time, with every pixel of the chunk in
+                each step. Gaps simply get zero weight.
+
+Cloud and snow bias vegetation indices low; --envelope N refits N times
+with observations below the fitted curve raised onto it (upper envelope).
+savgol and whittaker assume a regular cadence (gaps are missing dates, not
+uneven spacing). Tiles run in parallel worker processes, each writing its
+own cube tile file.
+
+Usage:
+    python application/analysis/smoothing.py --stack NDVI=data/satellite/hermits_peak_modis_ndvi_stack.tif \\
+        --scale 0.0001 --method whittaker --lambda 10 --output data/cube_modis_clean --workers 4
+"""
+
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from rasterio.crs import CRS
+from scipy.signal import savgol_filter
+
+sys.path.append(str(Path(__file__).parent.parent))
+from analysis.trends import CubeTimeStack, RasterTimeStack
+from utils.datacube import DataCube
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+METHODS = ['linear', 'savgol', 'whittaker']
+
+# Savitzky-Golay window (dates, odd) and polynomial order
+DEFAULT_SAVGOL_WINDOW = 7
+DEFAULT_SAVGOL_ORDER = 2
+
+# Whittaker smoothing parameter and difference order
+DEFAULT_WHITTAKER_LAMBDA = 10.0
+DEFAULT_WHITTAKER_ORDER = 2
+
+# Pixels with fewer valid observations than this are written as NaN
+MIN_VALID_OBS = 4
+
+DEFAULT_MEMORY_MB = 256
+DEFAULT_TILE_SIZE = 256
+
+
+def linear_fill(y: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """
+    Linear interpolation across gaps
+
+    Args:
+        y: (T, pixels) values, NaN = missing
+        t: (T,) observation times (any monotonic unit, e.g. day ordinals)
+
+    Returns:
+        (T, pixels) series; leading / trailing gaps hold the nearest
+        observation, pixels without any observation stay NaN
+    """
+    n_times, n_pixels = y.shape
+    valid = ~np.isnan(y)
+    steps = np.arange(n_times)[:, None]
+    prev = np.maximum.accumulate(np.where(valid, steps, -1), axis=0)
+    nxt = np.flip(np.minimum.accumulate(np.flip(np.where(valid, steps, n_times), axis=0), axis=0), axis=0)
+    has_prev, has_next = prev >= 0, nxt < n_times
+    prev, nxt = np.clip(prev, 0, n_times - 1), np.clip(nxt, 0, n_times - 1)
+
+    pixels = np.arange(n_pixels)[None, :]
+    y_prev, y_next = y[prev, pixels], y[nxt, pixels]
+    t = np.asarray(t, dtype=np.float64)
+    t_prev, t_next = t[prev], t[nxt]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.where(t_next > t_prev, (t[:, None] - t_prev) / (t_next - t_prev), 0.0)
+    filled = np.where(has_prev & has_next, y_prev + frac * (y_next - y_prev),
+                      np.where(has_prev, y_prev, y_next))
+    return np.where(valid.any(axis=0), filled, np.nan)
+
+
+def savgol_smooth(y: np.ndarray, t: np.ndarray, window: int = DEFAULT_SAVGOL_WINDOW,
+                  order: int = DEFAULT_SAVGOL_ORDER) -> np.ndarray:
+    """Savitzky-Golay filter along time of the linearly gap-filled series"""
+    filled = linear_fill(y, t)
+    window = min(window, len(t) if len(t) % 2 else len(t) - 1)
+    if window <= order:
+        return filled
+    empty = np.isnan(filled[0])
+    smoothed = savgol_filter(np.where(empty, 0.0, filled), window, order, axis=0, mode='interp')
+    return np.where(empty, np.nan, smoothed)
+
+
+def _difference_penalty_bands(n_times: int, lam: float, order: int) -> list:
+    """Lower diagonals k = 0..order of λ DᵀD (the same for every pixel)"""
+    d = np.diff(np.eye(n_times), order, axis=0)
+    penalty = lam * (d.T @ d)
+    return [np.diagonal(penalty, -k).copy() for k in range(order + 1)]
+
+
+def whittaker_smooth(y: np.ndarray, lam: float = DEFAULT_WHITTAKER_LAMBDA,
+                     order: int = DEFAULT_WHITTAKER_ORDER, weights: np.ndarray = None) -> np.ndarray:
+    """
+    Weighted Whittaker smoother for all pixels at once
+
+    Solves (W + λ DᵀD) z = W y per pixel. The matrix is symmetric positive
+    definite with bandwidth `order`; its Cholesky factor L is kept as
+    diagonals L[k][i] = L[i, i - k], so factorisation and both triangular
+    solves are loops over time and the number of bands, vectorised over
+    pixels.
+
+    Args:
+        y: (T, pixels) values, NaN = missing (zero weight)
+        lam: Smoothing parameter λ (larger = smoother)
+        order: Difference order d of the roughness penalty
+        weights: Optional (T, pixels) observation weights (e.g. QA-based)
+
+    Returns:
+        (T, pixels) float64 smoothed and gap-filled series; NaN for pixels
+        with no more than `order` valid observations
+    """
+    n_times, n_pixels = y.shape
+    valid = ~np.isnan(y)
+    w = valid.astype(np.float64) if weights is None else np.where(valid, weights, 0.0)
+    solvable = (w > 0).sum(axis=0) > order
+    # Unsolvable pixels get unit weights so the factorisation stays defined
+    w[:, ~solvable] = 1.0
+    wy = w * np.where(valid, y, 0.0)
+
+    bands = _difference_penalty_bands(n_times, lam, order)
+    chol = np.zeros((order + 1, n_times, n_pixels))
+    for i in range(n_times):
+        for k in range(min(i, order), 0, -1):
+            j = i - k
+            value = np.full(n_pixels, bands[k][j])
+            for m in range(max(0, i - order), j):
+                value -= chol[i - m, i] * chol[j - m, j]
+            chol[k, i] = value / chol[0, j]
+        value = bands[0][i] + w[i]
+        for m in range(max(0, i - order), i):
+            value -= chol[i - m, i] ** 2
+        chol[0, i] = np.sqrt(value)
+
+    # L u = W y, then Lᵀ z = u
+    u = np.empty((n_times, n_pixels))
+    for i in range(n_times):
+        value = wy[i].copy()
+        for k in range(1, min(i, order) + 1):
+            value -= chol[k, i] * u[i - k]
+        u[i] = value / chol[0, i]
+    z = np.empty((n_times, n_pixels))
+    for i in range(n_times - 1, -1, -1):
+        value = u[i].copy()
+        for k in range(1, min(n_times - 1 - i, order) + 1):
+            value -= chol[k, i + k] * z[i + k]
+        z[i] = value / chol[0, i]
+
+    z[:, ~solvable] = np.nan
+    return z
+
+
+def smooth_series(y: np.ndarray, t: np.ndarray, method: str = 'whittaker', envelope: int = 0,
+                  window: int = DEFAULT_SAVGOL_WINDOW, order: int = DEFAULT_SAVGOL_ORDER,
+                  lam: float = DEFAULT_WHITTAKER_LAMBDA,
+                  whittaker_order: int = DEFAULT_WHITTAKER_ORDER) -> np.ndarray:
+    """
+    Gap-fill and smooth (T, pixels) series with one of METHODS
+
+    Args:
+        y: (T, pixels) values, NaN = missing
+        t: (T,) sorted observation times in days
+        method: 'linear', 'savgol' or 'whittaker'
+        envelope: Upper-envelope refits (observations below the fit are
+            raised onto it before refitting)
+        window, order: Savitzky-Golay window (dates) and polynomial order
+        lam, whittaker_order: Whittaker λ and difference order
+
+    Returns:
+        (T, pixels) float32; NaN for pixels with fewer than MIN_VALID_OBS
+        valid observations
+    """
+    def fit(values):
+        if method == 'linear':
+            return linear_fill(values, t)
+        if method == 'savgol':
+            return savgol_smooth(values, t, window, order)
+        if method == 'whittaker':
+            return whittaker_smooth(values, lam, whittaker_order)
+        raise ValueError(f"Unknown method {method!r} (expected one of {METHODS})")
+
+    y = y.astype(np.float64)
+    smoothed = fit(y)
+    for _ in range(envelope):
+        smoothed = fit(np.where(y < smoothed, smoothed, y))
+    enough = (~np.isnan(y)).sum(axis=0) >= MIN_VALID_OBS
+    return np.where(enough, smoothed, np.nan).astype(np.float32)
+
+
+def pixel_chunk_size(n_times: int, memory_mb: float, order: int = DEFAULT_WHITTAKER_ORDER) -> int:
+    """Pixels per batch: Cholesky diagonals plus ~5 float64 work series per date"""
+    return max(int(memory_mb * 1024 ** 2 / ((order + 6) * 8 * max(n_times, 1))), 1)
+
+
+def smooth_stack(stack: np.ndarray, days: np.ndarray, memory_mb: float = DEFAULT_MEMORY_MB,
+                 **options) -> np.ndarray:
+    """smooth_series() over a (T, height, width) stack in pixel chunks"""
+    n_times, height, width = stack.shape
+    y = stack.reshape(n_times, -1)
+    out = np.empty(y.shape, dtype=np.float32)
+    chunk = pixel_chunk_size(n_times, memory_mb, options.get('whittaker_order', DEFAULT_WHITTAKER_ORDER))
+    for start in range(0, y.shape[1], chunk):
+        out[:, start:start + chunk] = smooth_series(y[:, start:start + chunk], days, **options)
+    return out.reshape(n_times, height, width)
+
+
+def open_stack(source: tuple):
+    """Time stack of a ('stack' | 'cube', path, band selector, scale) source"""
+    kind, path, select, scale = source
+    return RasterTimeStack(path, select, scale) if kind == 'stack' else CubeTimeStack(path, select, scale)
+
+
+# Per-process stacks and output cube, opened once by the pool initializer
+_worker = {}
+
+
+def _init_worker(sources: dict, output_path: Path, valid_range, memory_mb: float, options: dict):
+    _worker['stacks'] = {name: open_stack(source) for name, source in sources.items()}
+    _worker['cube'] = DataCube(output_path)
+    _worker['valid_range'] = valid_range
+    _worker['memory_mb'] = memory_mb
+    _worker['options'] = options
+
+
+def _smooth_tile(tile):
+    cube = _worker['cube']
+    series = np.empty((len(cube.times), len(cube.bands), tile.height, tile.width), dtype=np.float32)
+    for band, name in enumerate(cube.bands):
+        stack = _worker['stacks'][name]
+        order = np.argsort([d.toordinal() for d in stack.dates], kind='stable')
+        values = stack.read(tile)[order]
+        if _worker['valid_range'] is not None:
+            low, high = _worker['valid_range']
+            values = np.where((values >= low) & (values <= high), values, np.nan)
+        days = np.array([stack.dates[i].toordinal() for i in order], dtype=np.float64)
+        series[:, band] = smooth_stack(values, days, _worker['memory_mb'], **_worker['options'])
+    cube.write_series(tile, series)
+    return tile
+
+
+def write_smoothed(sources: dict, output_path: Path, workers: int = None,
+                   tile_size: int = DEFAULT_TILE_SIZE, memory_mb: float = DEFAULT_MEMORY_MB,
+                   valid_range=None, dtype: str = 'float32', **options) -> DataCube:
+    """
+    Gap-fill and smooth time stacks tile by tile into a new data cube
+
+    Args:
+        sources: {cube band name: ('stack' | 'cube', path, band selector, scale)};
+            all sources must share the grid and dates
+        output_path: Directory of the cleaned cube (must not exist yet)
+        workers: Worker processes (default: CPU count)
+        tile_size: Processing tile edge, also the cube's tile size
+        memory_mb: Working-memory budget per worker
+        valid_range: Optional (min, max); values outside count as gaps
+        dtype: Cube storage dtype
+        **options: smooth_series() options (method, envelope, window, ...)
+
+    Returns:
+        The cleaned DataCube
+    """
+    stacks = {name: open_stack(source) for name, source in sources.items()}
+    first = next(iter(stacks.values()))
+    dates = sorted(first.dates)
+    for name, stack in stacks.items():
+        if (stack.height, stack.width) != (first.height, first.width) or sorted(stack.dates) != dates:
+            raise ValueError(f"{name} does not share the grid and dates of the other sources")
+    crs = first.profile['crs']
+    cube = DataCube.create(output_path, list(stacks), first.height, first.width,
+                           crs=CRS.from_user_input(crs).to_wkt() if crs else None,
+                           transform=first.profile['transform'].to_gdal()
+                           if first.profile['transform'] else None,
+                           dtype=dtype, tile_size=tile_size, times=dates)
+    for stack in stacks.values():
+        stack.close()
+    cube.index['smoothing'] = dict(options, valid_range=valid_range)
+    DataCube._write_index(cube.path, cube.index)
+
+    tiles = list(cube.tiles())
+    logger.info(f"Smoothing ({options.get('method', 'whittaker')}): {len(dates)} dates, "
+                f"{', '.join(stacks)}, {first.width} x {first.height} px, {len(tiles)} tiles")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(sources, output_path, valid_range, memory_mb, options)) as pool:
+        for done, _ in enumerate(pool.map(_smooth_tile, tiles), start=1):
+            if done % max(len(tiles) // 10, 1) == 0:
+                logger.info(f"  {done}/{len(tiles)} tiles")
+    return cube
+
+
+def main(argv=None):
+    """Cleaned data cube from dated GeoTIFF stacks or a data cube"""
+    parser = argparse.ArgumentParser(description='Temporal gap-filling and smoothing')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--stack', action='append', metavar='INDEX=PATH',
+                        help='Dated GeoTIFF stack per index (repeatable), e.g. NDVI=ndvi_stack.tif')
+    source.add_argument('--cube', type=Path, help='Time-series data cube directory')
+    parser.add_argument('--bands', nargs='+', help='Cube bands to smooth (default: all)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Value scale (MOD13Q1: 0.0001)')
+    parser.add_argument('--output', required=True, type=Path, help='Cleaned cube directory')
+    parser.add_argument('--method', choices=METHODS, default='whittaker')
+    parser.add_argument('--window', type=int, default=DEFAULT_SAVGOL_WINDOW,
+                        help='Savitzky-Golay window in dates (odd)')
+    parser.add_argument('--order', type=int, default=DEFAULT_SAVGOL_ORDER,
+                        help='Savitzky-Golay polynomial order')
+    parser.add_argument('--lambda', dest='lam', type=float, default=DEFAULT_WHITTAKER_LAMBDA,
+                        help='Whittaker smoothing parameter')
+    parser.add_argument('--envelope', type=int, default=0,
+                        help='Upper-envelope refits against cloud / snow drops')
+    parser.add_argument('--valid-range', nargs=2, type=float, metavar=('MIN', 'MAX'),
+                        help='Scaled values outside this range are gaps')
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: all CPUs)')
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument('--memory-mb', type=float, default=DEFAULT_MEMORY_MB)
+    args = parser.parse_args(argv)
+
+    if args.stack:
+        sources = {}
+        for item in args.stack:
+            name, path = item.split('=', 1)
+            sources[name.upper()] = ('stack', Path(path), None, args.scale)
+    else:
+        bands = args.bands or DataCube(args.cube).bands
+        sources = {name: ('cube', args.cube, name, args.scale) for name in bands}
+
+    options = {'method': args.method, 'envelope': args.envelope}
+    if args.method == 'savgol':
+        options.update(window=args.window, order=args.order)
+    elif args.method == 'whittaker':
+        options.update(lam=args.lam)
+    write_smoothed(sources, args.output, args.workers, args.tile_size, args.memory_mb,
+                   tuple(args.valid_range) if args.valid_range else None, args.dtype, **options)
+    logger.info(f"✓ Cleaned cube saved: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
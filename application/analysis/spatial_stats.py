@@ -0,0 +1,287 @@
+"""
+Spatial Validation Statistics
+Moving-window (geographically local) statistics between fuel predictors
+and burn severity, computed tile by tile with halos.
+"""
+
+import numpy as np
+from scipy import stats
+from scipy.ndimage import uniform_filter
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from analysis.validation_stats import PearsonAccumulator
+from utils.tiling import iter_tiles, DEFAULT_TILE_SIZE
+
+
+def local_correlation(x: np.ndarray, y: np.ndarray, valid: np.ndarray,
+                      window: int, min_fraction: float = 0.25) -> np.ndarray:
+    """
+    Windowed Pearson r from box-filtered sufficient statistics
+
+    Box means of x, y, x², y², xy and the valid count come from a separable
+    running-sum uniform filter, so cost per pixel does not depend on window.
+
+    Args:
+        x, y: Predictor and response arrays of the same shape
+        valid: Boolean mask of usable pixels
+        window: Window edge length in pixels
+        min_fraction: Minimum fraction of valid pixels in a window
+
+    Returns:
+        float32 array of local r (NaN where the window is too sparse or flat)
+    """
+    w = valid.astype(np.float64)
+    x = np.where(valid, x, 0.0).astype(np.float64)
+    y = np.where(valid, y, 0.0).astype(np.float64)
+
+    def box(a):
+        return uniform_filter(a, size=window, mode='constant', cval=0.0)
+
+    n = box(w)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = box(x) / n
+        mean_y = box(y) / n
+        cov = box(x * y) / n - mean_x * mean_y
+        var_x = box(x * x) / n - mean_x ** 2
+        var_y = box(y * y) / n - mean_y ** 2
+        r = cov / np.sqrt(var_x * var_y)
+
+    sparse = n < min_fraction
+    flat = (var_x <= 1e-12) | (var_y <= 1e-12)
+    r[sparse | flat | ~np.isfinite(r)] = np.nan
+    return np.clip(r, -1, 1).astype(np.float32)
+
+
+def iter_local_correlation(predictors: dict, response: np.ndarray, valid: np.ndarray,
+                           window: int, tile_size: int = DEFAULT_TILE_SIZE):
+    """
+    Run local_correlation over a grid tile by tile
+
+    Each tile is expanded by a half-window halo so results match a
+    full-grid filter. Predictors are centred on their valid mean first to
+    keep the E[x²] - E[x]² variance form numerically stable.
+
+    Yields:
+        (tile, {name: local r for the tile})
+    """
+    height, width = response.shape
+    halo = window // 2 + 1
+    offsets = {name: float(np.mean(grid[valid])) if valid.any() else 0.0
+               for name, grid in predictors.items()}
+    y_offset = float(np.mean(response[valid])) if valid.any() else 0.0
+
+    for tile in iter_tiles(height, width, tile_size):
+        outer, inner = tile.expand(halo, height, width)
+        tile_valid = valid[outer.slices]
+        if not tile_valid[inner].any():
+            yield tile, {name: np.full((tile.height, tile.width), np.nan, dtype=np.float32)
+                         for name in predictors}
+            continue
+        tile_y = response[outer.slices] - y_offset
+        yield tile, {
+            name: local_correlation(grid[outer.slices] - offsets[name], tile_y,
+                                    tile_valid, window)[inner]
+            for name, grid in predictors.items()
+        }
+
+
+class LagCovariance:
+    """
+    Spatial auto-covariance of centred fields for all lag vectors up to max_lag
+
+    Each tile is zero-padded by max_lag and cross-correlated with itself via
+    FFT, so lagged cross-product sums and pair counts for every
+    (dy, dx) in [-max_lag, max_lag]² are accumulated per tile and summed.
+    Pairs that straddle tile borders are dropped, which is negligible when
+    tiles are much larger than max_lag.
+    """
+
+    def __init__(self, names, max_lag: int):
+        self.max_lag = max_lag
+        size = 2 * max_lag + 1
+        self.pairs = np.zeros((size, size))
+        self.cross = {name: np.zeros((size, size)) for name in names}
+        self.n = 0
+        self.neighbor_sq_sum = 0.0  # sum over pixels of (queen neighbour count)²
+
+    def _lag_block(self, spectrum_product, shape):
+        corr = np.fft.irfft2(spectrum_product, s=shape)
+        idx_y = np.arange(-self.max_lag, self.max_lag + 1) % shape[0]
+        idx_x = np.arange(-self.max_lag, self.max_lag + 1) % shape[1]
+        return corr[np.ix_(idx_y, idx_x)]
+
+    def update(self, fields: dict, valid: np.ndarray):
+        """Add one tile of centred fields (invalid pixels are ignored)"""
+        if not valid.any():
+            return
+        shape = (valid.shape[0] + self.max_lag, valid.shape[1] + self.max_lag)
+        mask = valid.astype(np.float64)
+        mask_spec = np.fft.rfft2(mask, s=shape)
+        self.pairs += np.rint(self._lag_block(mask_spec * np.conj(mask_spec), shape))
+        for name, field in fields.items():
+            spec = np.fft.rfft2(np.where(valid, field, 0.0), s=shape)
+            self.cross[name] += self._lag_block(spec * np.conj(spec), shape)
+
+        self.n += int(valid.sum())
+        neighbors = np.rint(uniform_filter(mask, size=3, mode='constant') * 9) - mask
+        self.neighbor_sq_sum += float(np.sum((neighbors * mask) ** 2))
+
+    def _lag_distance(self):
+        lags = np.arange(-self.max_lag, self.max_lag + 1)
+        return np.hypot(*np.meshgrid(lags, lags, indexing='ij'))
+
+    def autocorrelation(self, name: str) -> np.ndarray:
+        """Lag-vector autocorrelation rho(dy, dx) (NaN where no pairs exist)"""
+        centre = self.max_lag
+        variance = self.cross[name][centre, centre] / self.pairs[centre, centre]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.cross[name] / self.pairs / variance
+
+    def correlogram(self, name: str) -> dict:
+        """Isotropic correlogram: pair-weighted autocorrelation in unit distance bins"""
+        distance = self._lag_distance()
+        dist_bin = np.rint(distance).astype(int)
+        centre = self.max_lag
+        variance = self.cross[name][centre, centre] / self.pairs[centre, centre]
+        keep = (dist_bin >= 1) & (dist_bin <= self.max_lag)
+        pair_sum = np.bincount(dist_bin[keep], weights=self.pairs[keep], minlength=self.max_lag + 1)
+        cross_sum = np.bincount(dist_bin[keep], weights=self.cross[name][keep], minlength=self.max_lag + 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rho = cross_sum / pair_sum / variance
+        return {
+            'lag': list(range(1, self.max_lag + 1)),
+            'autocorrelation': [float(v) if np.isfinite(v) else None for v in rho[1:]],
+            'pairs': [int(v) for v in pair_sum[1:]]
+        }
+
+    def morans_i(self, name: str) -> dict:
+        """
+        Moran's I with binary queen-contiguity weights
+
+        The neighbour cross-products are the lag (±1, ±1) entries of the
+        covariance block; the variance uses the normality assumption.
+        """
+        centre = self.max_lag
+        ring = (slice(centre - 1, centre + 2), slice(centre - 1, centre + 2))
+        s0 = self.pairs[ring].sum() - self.pairs[centre, centre]
+        neighbor_cross = self.cross[name][ring].sum() - self.cross[name][centre, centre]
+        n = self.n
+        if s0 <= 0 or n < 3:
+            return {'morans_i': None, 'expected': None, 'z_score': None, 'p_value': None}
+
+        moran = (n / s0) * neighbor_cross / self.cross[name][centre, centre]
+        expected = -1.0 / (n - 1)
+        s1 = 2.0 * s0
+        s2 = 4.0 * self.neighbor_sq_sum
+        variance = (n ** 2 * s1 - n * s2 + 3 * s0 ** 2) / ((n ** 2 - 1) * s0 ** 2) - expected ** 2
+        z_score = (moran - expected) / np.sqrt(variance) if variance > 0 else np.nan
+        return {
+            'morans_i': float(moran),
+            'expected': float(expected),
+            'z_score': float(z_score),
+            'p_value': float(2 * stats.norm.sf(abs(z_score)))
+        }
+
+    def effective_sample_size(self, name_x: str, name_y: str) -> float:
+        """
+        Dutilleul (1993) effective sample size for correlating two fields
+
+        n_eff = 1 + n² / tr(Rx Ry), with tr(Rx Ry) approximated by summing
+        pairs(h) * rho_x(h) * rho_y(h) over lag vectors up to max_lag
+        (correlation beyond max_lag is taken as zero).
+        """
+        rho_x = self.autocorrelation(name_x)
+        rho_y = self.autocorrelation(name_y)
+        product = np.where(self.pairs > 0, self.pairs * rho_x * rho_y, 0.0)
+        trace = float(np.nansum(product))
+        if trace <= 0:
+            return float(self.n)
+        return float(np.clip(1 + self.n ** 2 / trace, 3, self.n))
+
+
+def decimation_step(shape, max_grid: int = 2048) -> int:
+    """Stride that brings the longest grid side down to at most max_grid"""
+    return max(1, int(np.ceil(max(shape) / max_grid)))
+
+
+def spatial_significance(x: np.ndarray, y: np.ndarray, valid: np.ndarray,
+                         max_lag: int = 20, max_grid: int = 2048,
+                         tile_size: int = 512) -> dict:
+    """
+    Autocorrelation-aware significance of the x-y Pearson correlation
+
+    The correlation and OLS fit use every valid pixel (streamed by tile);
+    Moran's I of the residuals, correlograms and the Dutilleul effective
+    sample size are computed on a strided (decimated) grid with tiled FFTs.
+
+    Args:
+        x: Predictor grid
+        y: Response grid (e.g. dNBR)
+        valid: Boolean mask of usable pixels
+        max_lag: Largest lag, in decimated pixels
+        max_grid: Longest side of the decimated grid
+        tile_size: Tile size on the decimated grid
+
+    Returns:
+        Dict of JSON-serialisable statistics; with fewer than 3 valid pixels
+        or a constant x or y every statistic is None
+    """
+    # Centred moments merged tile by tile (same accumulator as stage 04's r)
+    moments = PearsonAccumulator()
+    for tile in iter_tiles(*valid.shape):
+        tile_valid = valid[tile.slices]
+        moments.update(x[tile.slices][tile_valid], y[tile.slices][tile_valid])
+    n = moments.n
+    r, _ = moments.pearson()
+    if not np.isfinite(r):
+        return {
+            'pearson_r': None, 'slope': None, 'intercept': None, 'n': int(n),
+            'n_effective': None, 'p_value_naive': None, 'p_value_dutilleul': None,
+            'residual_morans_i': {'morans_i': None, 'expected': None, 'z_score': None,
+                                  'p_value': None},
+            'correlogram': None, 'decimation_step': None, 'decimated_n': 0, 'max_lag': max_lag
+        }
+    mean_x, mean_y = moments.mean
+    slope, intercept = moments.linear_fit()
+
+    step = decimation_step(valid.shape, max_grid)
+    dec_valid = valid[::step, ::step]
+    dec_x = x[::step, ::step].astype(np.float64) - mean_x
+    dec_y = y[::step, ::step].astype(np.float64) - mean_y
+    residual = dec_y - slope * dec_x
+    residual -= residual[dec_valid].mean()
+
+    lag_cov = LagCovariance(['x', 'y', 'residual'], max_lag)
+    for tile in iter_tiles(*dec_valid.shape, tile_size):
+        lag_cov.update({'x': dec_x[tile.slices], 'y': dec_y[tile.slices],
+                        'residual': residual[tile.slices]}, dec_valid[tile.slices])
+
+    # n_eff depends on the correlation range in map units rather than the
+    # sampling density, so the decimated estimate is used directly (it is
+    # conservative when neighbouring decimated pixels are nearly independent)
+    n_eff_decimated = lag_cov.effective_sample_size('x', 'y')
+    n_eff = float(min(n, n_eff_decimated))
+    t_naive = r * np.sqrt((n - 2) / max(1 - r ** 2, 1e-300))
+    t_eff = r * np.sqrt(max(n_eff - 2, 0) / max(1 - r ** 2, 1e-300))
+
+    return {
+        'pearson_r': float(r),
+        'slope': float(slope),
+        'intercept': float(intercept),
+        'n': int(n),
+        'n_effective': n_eff,
+        'p_value_naive': float(2 * stats.t.sf(abs(t_naive), n - 2)),
+        'p_value_dutilleul': float(2 * stats.t.sf(abs(t_eff), n_eff - 2)) if n_eff > 2 else None,
+        'residual_morans_i': lag_cov.morans_i('residual'),
+        'correlogram': {
+            'predictor': lag_cov.correlogram('x'),
+            'response': lag_cov.correlogram('y'),
+            'residual': lag_cov.correlogram('residual')
+        },
+        'decimation_step': step,
+        'decimated_n': lag_cov.n,
+        'max_lag': max_lag
+    }
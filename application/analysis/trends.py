@@ -0,0 +1,268 @@
+"""
+Per-pixel Vegetation Trends
+Theil-Sen slope, Mann-Kendall trend test and seasonal amplitude of a
+per-pixel index time series (e.g. MOD13Q1 16-day NDVI/EVI), vectorised
+along the time axis and run over the grid tile by tile.
+
+Theil-Sen needs the median of all T(T-1)/2 pairwise slopes per pixel. The
+pairs are built lag by lag into one float32 block per chunk of pixels, the
+chunk sized to a memory budget, and the median is taken in place with a
+fixed-rank np.partition (utils.stats.nan_median: missing pairs are padded
+with -inf/+inf so every pixel's median lands on the same ranks). For
+T = 100 the slopes take ~20 KB per pixel, so the default 256 MB budget
+handles chunks of ~5k pixels.
+
+Usage:
+    python application/analysis/trends.py --stack data/satellite/hermits_peak_modis_ndvi_stack.tif \\
+        --select NDVI --scale 0.0001 --output outputs/trends/modis_ndvi_trends.tif
+"""
+
+import argparse
+import math
+import re
+import sys
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from scipy.special import ndtr
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.datacube import DataCube
+from utils.logger import setup_logger
+from utils.stats import nan_median
+from utils.tiling import iter_tiles
+
+logger = setup_logger(__name__)
+
+TREND_BANDS = ['sen_slope', 'mk_tau', 'mk_z', 'mk_p', 'seasonal_amplitude', 'peak_doy', 'n_obs']
+
+# Fewer valid dates than this leave a pixel's trend undefined (NaN)
+MIN_OBSERVATIONS = 10
+
+DEFAULT_MEMORY_MB = 256
+DAYS_PER_YEAR = 365.25
+
+# Dates in band descriptions: 2020_01_17_NDVI (Earth Engine toBands), 2020-01-17, 20200117
+BAND_DATE_PATTERN = re.compile(r'(20\d{2})[-_]?(\d{2})[-_]?(\d{2})')
+
+
+def decimal_years(dates) -> np.ndarray:
+    """Dates as fractional years (2020-07-02 -> ~2020.5)"""
+    return np.array([d.year + (d.timetuple().tm_yday - 1) / DAYS_PER_YEAR for d in dates])
+
+
+def theil_sen_mann_kendall(y: np.ndarray, t: np.ndarray):
+    """
+    Theil-Sen slope and Mann-Kendall S / variance for a block of pixels
+
+    Args:
+        y: (T, pixels) float values, NaN = missing
+        t: (T,) sorted observation times (fractional years)
+
+    Returns:
+        slope (per unit of t), S, var(S) with tie correction, n valid - all (pixels,)
+    """
+    n_times, n_pixels = y.shape
+    n_pairs = n_times * (n_times - 1) // 2
+    slopes = np.empty((n_pairs, n_pixels), dtype=np.float32)
+    s = np.zeros(n_pixels, dtype=np.int32)
+
+    row = 0
+    for lag in range(1, n_times):
+        diff = y[lag:] - y[:-lag]
+        dt = (t[lag:] - t[:-lag])[:, None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slopes[row:row + n_times - lag] = np.where(dt > 0, diff / dt, np.nan)
+        s += np.nansum(np.sign(diff), axis=0).astype(np.int32)
+        row += n_times - lag
+
+    slope = nan_median(slopes)
+    del slopes
+
+    # Tie groups of size g add g(g-1)(2g+5) = sum over k < g of 6k(k+2)
+    ordered = np.sort(y, axis=0)
+    run = np.zeros(n_pixels, dtype=np.int64)
+    ties = np.zeros(n_pixels, dtype=np.float64)
+    for i in range(1, n_times):
+        equal = ordered[i] == ordered[i - 1]
+        run = np.where(equal, run + 1, 0)
+        ties += np.where(equal, 6 * run * (run + 2), 0)
+
+    n = (~np.isnan(y)).sum(axis=0).astype(np.float64)
+    var_s = (n * (n - 1) * (2 * n + 5) - ties) / 18
+    return slope, s, var_s, n
+
+
+def seasonal_harmonic(y: np.ndarray, t: np.ndarray):
+    """
+    Annual harmonic fit y = a + b(t - t0) + c cos 2πt + d sin 2πt per pixel
+
+    Solved as a batch of 4x4 normal equations over each pixel's valid dates.
+
+    Returns:
+        amplitude sqrt(c² + d²) and day of year of the seasonal peak
+    """
+    valid = ~np.isnan(y)
+    w = valid.astype(np.float64)
+    design = np.stack([np.ones_like(t), t - t.mean(), np.cos(2 * np.pi * t), np.sin(2 * np.pi * t)],
+                      axis=1)
+    xtx = np.einsum('tp,ti,tj->pij', w, design, design)
+    xty = np.einsum('tp,ti,tp->pi', w, design, np.where(valid, y, 0.0))
+    # A tiny ridge keeps pixels with too few dates solvable (they are masked later)
+    coef = np.linalg.solve(xtx + 1e-9 * np.eye(4), xty[..., None])[..., 0]
+
+    amplitude = np.hypot(coef[:, 2], coef[:, 3])
+    phase = np.mod(np.arctan2(coef[:, 3], coef[:, 2]) / (2 * np.pi), 1.0)
+    return amplitude, phase * DAYS_PER_YEAR + 1
+
+
+def pixel_chunk_size(n_times: int, memory_mb: float) -> int:
+    """Pixels per Theil-Sen chunk: pair slopes, NaN mask, ranks and temporaries (~11 B per pair)"""
+    n_pairs = max(n_times * (n_times - 1) // 2, 1)
+    return max(int(memory_mb * 1024 ** 2 / (11 * n_pairs)), 1)
+
+
+def compute_trends(stack: np.ndarray, dates, memory_mb: float = DEFAULT_MEMORY_MB) -> dict:
+    """
+    Trend statistics of a (T, height, width) time stack
+
+    Args:
+        stack: Values by date (NaN = missing / masked)
+        dates: Observation dates (length T)
+        memory_mb: Working-memory budget for the pairwise slopes
+
+    Returns:
+        dict of TREND_BANDS -> float32 (height, width) arrays
+    """
+    order = np.argsort([d.toordinal() for d in dates], kind='stable')
+    t = decimal_years([dates[i] for i in order])
+    n_times, height, width = stack.shape
+    y = stack[order].reshape(n_times, -1).astype(np.float32)
+
+    out = {name: np.full(height * width, np.nan, dtype=np.float32) for name in TREND_BANDS}
+    chunk = pixel_chunk_size(n_times, memory_mb)
+    for start in range(0, y.shape[1], chunk):
+        block = y[:, start:start + chunk]
+        cols = slice(start, start + block.shape[1])
+        slope, s, var_s, n = theil_sen_mann_kendall(block, t)
+        amplitude, peak_doy = seasonal_harmonic(block, t)
+
+        enough = n >= MIN_OBSERVATIONS
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = np.where(var_s > 0, (s - np.sign(s)) / np.sqrt(var_s), 0.0)
+            tau = s / (n * (n - 1) / 2)
+        out['sen_slope'][cols] = np.where(enough, slope, np.nan)
+        out['mk_tau'][cols] = np.where(enough, tau, np.nan)
+        out['mk_z'][cols] = np.where(enough, z, np.nan)
+        out['mk_p'][cols] = np.where(enough, 2 * ndtr(-np.abs(z)), np.nan)
+        out['seasonal_amplitude'][cols] = np.where(enough, amplitude, np.nan)
+        out['peak_doy'][cols] = np.where(enough, peak_doy, np.nan)
+        out['n_obs'][cols] = n
+
+    return {name: values.reshape(height, width) for name, values in out.items()}
+
+
+class RasterTimeStack:
+    """Multi-band GeoTIFF whose bands are dates (band descriptions carry the date)"""
+
+    def __init__(self, path: Path, select: str = None, scale: float = 1.0):
+        """
+        Args:
+            path: Stacked GeoTIFF (e.g. an Earth Engine toBands() export)
+            select: Only use bands whose description contains this (e.g. 'NDVI')
+            scale: Multiplier applied to stored values (MOD13Q1: 0.0001)
+        """
+        self.src = rasterio.open(path)
+        self.scale = scale
+        self.bands, self.dates = [], []
+        for band, description in enumerate(self.src.descriptions, start=1):
+            match = BAND_DATE_PATTERN.search(description or '')
+            if match and (select is None or select in description):
+                self.bands.append(band)
+                self.dates.append(date(*map(int, match.groups())))
+        if not self.bands:
+            raise ValueError(f"No dated bands{f' matching {select!r}' if select else ''} in {path}")
+        self.height, self.width = self.src.height, self.src.width
+        self.profile = self.src.profile
+
+    def read(self, tile) -> np.ndarray:
+        data = self.src.read(self.bands, window=tile.window, masked=True)
+        return (data.astype(np.float32) * self.scale).filled(np.nan)
+
+    def close(self):
+        self.src.close()
+
+
+class CubeTimeStack:
+    """One band of a DataCube as a time stack"""
+
+    def __init__(self, path: Path, band: str, scale: float = 1.0):
+        self.cube = DataCube(path)
+        self.band = self.cube.bands.index(band)
+        self.scale = scale
+        self.dates = [date.fromisoformat(when[:10]) for when in self.cube.times]
+        self.height, self.width = self.cube.height, self.cube.width
+        index = self.cube.index
+        self.profile = {'driver': 'GTiff', 'height': self.height, 'width': self.width,
+                        'crs': index['crs'],
+                        'transform': rasterio.Affine.from_gdal(*index['transform'])
+                        if index['transform'] else None}
+
+    def read(self, tile) -> np.ndarray:
+        series = np.empty((len(self.dates), tile.height, tile.width), dtype=np.float32)
+        # Cube tiles may be larger or smaller than the trend tile; read() handles both
+        for t in range(len(self.dates)):
+            series[t] = self.cube.read(t, window=tile)[self.band]
+        return series * self.scale
+
+    def close(self):
+        pass
+
+
+def write_trends(stack, output_path: Path, memory_mb: float = DEFAULT_MEMORY_MB) -> Path:
+    """Compute trend rasters for every tile of a time stack and save them as one GeoTIFF"""
+    profile = dict(stack.profile)
+    profile.update(driver='GTiff', count=len(TREND_BANDS), dtype='float32', nodata=np.nan,
+                   compress='deflate', predictor=3, tiled=True, blockxsize=256, blockysize=256)
+    # Roughly T float32 values plus the harmonic design terms per pixel per read
+    tile_size = max(256, min(2048, math.isqrt(int(memory_mb * 1024 ** 2 / (8 * len(stack.dates))))
+                             // 256 * 256))
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with rasterio.open(output_path, 'w', **profile) as dst:
+        for band, name in enumerate(TREND_BANDS, start=1):
+            dst.set_band_description(band, name)
+        for tile in iter_tiles(stack.height, stack.width, tile_size):
+            trends = compute_trends(stack.read(tile), stack.dates, memory_mb)
+            dst.write(np.stack([trends[name] for name in TREND_BANDS]), window=tile.window)
+    return Path(output_path)
+
+
+def main(argv=None):
+    """Trend rasters from a dated GeoTIFF stack or a data cube"""
+    parser = argparse.ArgumentParser(description='Per-pixel Theil-Sen / Mann-Kendall trends')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--stack', type=Path, help='GeoTIFF with one dated band per observation')
+    source.add_argument('--cube', type=Path, help='Time-series data cube directory')
+    parser.add_argument('--select', default='NDVI',
+                        help='Band name: substring of the stack band descriptions / cube band')
+    parser.add_argument('--scale', type=float, default=1.0, help='Value scale (MOD13Q1: 0.0001)')
+    parser.add_argument('--output', required=True, type=Path)
+    parser.add_argument('--memory-mb', type=float, default=DEFAULT_MEMORY_MB)
+    args = parser.parse_args(argv)
+
+    stack = (RasterTimeStack(args.stack, args.select, args.scale) if args.stack
+             else CubeTimeStack(args.cube, args.select, args.scale))
+    try:
+        logger.info(f"Trends of {len(stack.dates)} dates ({stack.dates[0]} - {stack.dates[-1]}), "
+                    f"{stack.width} x {stack.height} px")
+        write_trends(stack, args.output, args.memory_mb)
+    finally:
+        stack.close()
+    logger.info(f"✓ Trends saved: {args.output} ({', '.join(TREND_BANDS)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,450 @@
+"""
+Streaming Validation Statistics
+Accumulators that are updated tile by tile and merged, so validation
+metrics never need the whole flattened raster in memory.
+"""
+
+import numpy as np
+from scipy import stats
+
+# USGS dNBR burn severity classes (see analysis/02_burn_severity.py)
+SEVERITY_CLASS_NAMES = ['Unburned', 'Low', 'Mod-Low', 'Mod-High', 'High']
+
+# Fuel risk classes, same breaks as analysis/03_enhanced_fuel_map.py
+RISK_CLASS_NAMES = ['Low', 'Moderate', 'High']
+RISK_CLASS_BREAKS = (40.0, 60.0)
+
+# Scott & Burgan FBFM40 fuel model families (GR 101-109, GS 121-124, SH 141-149,
+# TU 161-165, TL 181-189, SB 201-204). Non-burnable (NB 91-99) and unmapped
+# codes get -1 and are left out of the contingency tables
+FBFM40_FAMILY_NAMES = ['Grass', 'Grass-Shrub', 'Shrub', 'Timber-Understory', 'Timber-Litter',
+                       'Slash-Blowdown']
+_FBFM40_FAMILY_LUT = np.full(256, -1, dtype=np.int8)
+_FBFM40_FAMILY_LUT[101:110] = 0
+_FBFM40_FAMILY_LUT[121:125] = 1
+_FBFM40_FAMILY_LUT[141:150] = 2
+_FBFM40_FAMILY_LUT[161:166] = 3
+_FBFM40_FAMILY_LUT[181:190] = 4
+_FBFM40_FAMILY_LUT[201:205] = 5
+
+# Expected severity level of each family (index into RISK_CLASS_NAMES):
+# grass and grass-shrub burn light, shrub and litter moderate, timber
+# understory (ladder fuels) and slash heavy
+FBFM40_FAMILY_HAZARD = [0, 0, 1, 2, 1, 2]
+
+# Which predicted class each severity class counts as "correct" for,
+# used to collapse a K x 5 table into a square K x K agreement table
+RISK_SEVERITY_GROUPS = [0, 0, 1, 2, 2]        # Unburned/Low, Mod-Low, Mod-High/High
+FBFM40_SEVERITY_GROUPS = RISK_SEVERITY_GROUPS  # Families are scored on the same levels
+
+
+def risk_class(fuel_risk_score: np.ndarray) -> np.ndarray:
+    """Classify 0-100 fuel risk into Low (<=40), Moderate (40-60], High (>60)"""
+    return np.digitize(fuel_risk_score, RISK_CLASS_BREAKS, right=True).astype(np.uint8)
+
+
+def fbfm40_family(fbfm40: np.ndarray) -> np.ndarray:
+    """Map FBFM40 fuel model codes to family indices 0-5 (-1 = non-burnable / unmapped)"""
+    codes = np.asarray(fbfm40)
+    in_range = (codes >= 0) & (codes < _FBFM40_FAMILY_LUT.size)
+    return np.where(in_range, _FBFM40_FAMILY_LUT[np.clip(codes, 0, _FBFM40_FAMILY_LUT.size - 1)], -1)
+
+
+class ConfusionMatrix:
+    """
+    Contingency table of predicted classes (rows) vs observed classes (columns)
+
+    Each update is a single bincount over pred * n_obs + obs, so tiles can
+    be processed independently and merged by adding counts.
+    """
+
+    def __init__(self, n_pred: int, n_obs: int = len(SEVERITY_CLASS_NAMES)):
+        self.n_pred = n_pred
+        self.n_obs = n_obs
+        self.counts = np.zeros((n_pred, n_obs), dtype=np.int64)
+        self.excluded = 0
+
+    def update(self, pred: np.ndarray, obs: np.ndarray):
+        """Add one tile of paired class labels (out-of-range labels are ignored)"""
+        pred = np.asarray(pred).ravel().astype(np.int64)
+        obs = np.asarray(obs).ravel().astype(np.int64)
+        keep = (pred >= 0) & (pred < self.n_pred) & (obs >= 0) & (obs < self.n_obs)
+        self.excluded += int(keep.size - np.count_nonzero(keep))
+        flat = np.bincount(pred[keep] * self.n_obs + obs[keep],
+                           minlength=self.n_pred * self.n_obs)
+        self.counts += flat.reshape(self.n_pred, self.n_obs)
+
+    def merge(self, other: 'ConfusionMatrix') -> 'ConfusionMatrix':
+        """Merge counts from another accumulator of the same shape"""
+        if other.counts.shape != self.counts.shape:
+            raise ValueError(f"Cannot merge {other.counts.shape} table into {self.counts.shape}")
+        self.counts += other.counts
+        self.excluded += other.excluded
+        return self
+
+    def collapse(self, obs_groups, pred_groups=None) -> np.ndarray:
+        """
+        Collapse the table onto a square table of agreement classes
+
+        Args:
+            obs_groups: For each observed class, the agreement class it counts as
+            pred_groups: For each predicted class, its agreement class
+                (default: the predicted classes themselves)
+
+        Returns:
+            Square K x K count matrix (K = number of agreement classes)
+        """
+        pred_groups = np.arange(self.n_pred) if pred_groups is None else np.asarray(pred_groups)
+        obs_groups = np.asarray(obs_groups)
+        n_groups = int(max(pred_groups.max(), obs_groups.max())) + 1
+        pred_onehot = np.zeros((self.n_pred, n_groups), dtype=np.int64)
+        pred_onehot[np.arange(self.n_pred), pred_groups] = 1
+        obs_onehot = np.zeros((self.n_obs, n_groups), dtype=np.int64)
+        obs_onehot[np.arange(self.n_obs), obs_groups] = 1
+        return pred_onehot.T @ self.counts @ obs_onehot
+
+    def to_dict(self, pred_names, obs_names, obs_groups, pred_groups=None, group_names=None) -> dict:
+        """Serialize the table and its agreement metrics for JSON output"""
+        group_names = list(group_names if group_names is not None else pred_names)
+        return {
+            'predicted_classes': list(pred_names),
+            'observed_classes': list(obs_names),
+            'agreement_classes': group_names,
+            'counts': self.counts.tolist(),
+            'excluded': self.excluded,
+            'agreement': agreement_metrics(self.collapse(obs_groups, pred_groups), group_names)
+        }
+
+
+def agreement_metrics(square: np.ndarray, class_names) -> dict:
+    """
+    Cohen's kappa, overall accuracy and per-class errors from a square table
+
+    Rows are predictions and columns observations, so recall (producer's
+    accuracy) is diag / column total and omission error is 1 - recall;
+    commission error is 1 - diag / row total.
+    """
+    square = np.asarray(square, dtype=np.float64)
+    total = square.sum()
+    if total == 0:
+        return {'n': 0, 'overall_accuracy': None, 'cohens_kappa': None, 'per_class': {}}
+
+    diag = np.diag(square)
+    row_tot = square.sum(axis=1)
+    col_tot = square.sum(axis=0)
+
+    p_observed = diag.sum() / total
+    p_expected = np.dot(row_tot, col_tot) / total ** 2
+    kappa = (p_observed - p_expected) / (1 - p_expected) if p_expected < 1 else 0.0
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        recall = diag / col_tot
+        precision = diag / row_tot
+
+    def _clean(value):
+        return float(value) if np.isfinite(value) else None
+
+    per_class = {}
+    for i, name in enumerate(class_names):
+        per_class[name] = {
+            'recall': _clean(recall[i]),
+            'omission_error': _clean(1 - recall[i]),
+            'commission_error': _clean(1 - precision[i]),
+            'observed': int(col_tot[i]),
+            'predicted': int(row_tot[i])
+        }
+
+    return {
+        'n': int(total),
+        'overall_accuracy': float(p_observed),
+        'cohens_kappa': float(kappa),
+        'per_class': per_class
+    }
+
+
+class PearsonAccumulator:
+    """
+    Streaming Pearson correlation of a predictor with a response
+
+    Each tile is reduced in float64 around its own means and merged with
+    Chan's pairwise update of the co-moments, so float32 rasters give the
+    same r as a two-pass float64 computation without a float64 copy of
+    the whole grid (and without the cancellation of raw sums of squares).
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = np.zeros(2)
+        self.comoment = np.zeros((2, 2))  # [[Sxx, Sxy], [Sxy, Syy]] about the means
+
+    def _combine(self, n: int, mean: np.ndarray, comoment: np.ndarray):
+        total = self.n + n
+        delta = mean - self.mean
+        self.comoment += comoment + np.outer(delta, delta) * (self.n * n / total)
+        self.mean += delta * (n / total)
+        self.n = total
+
+    def update(self, x: np.ndarray, y: np.ndarray):
+        """Add one tile of paired values (pairs with a NaN are skipped)"""
+        x = np.asarray(x).ravel()
+        y = np.asarray(y).ravel()
+        keep = np.isfinite(x) & np.isfinite(y)
+        if not keep.any():
+            return
+        pair = np.stack([x[keep], y[keep]]).astype(np.float64)
+        mean = pair.mean(axis=1)
+        centred = pair - mean[:, None]
+        self._combine(pair.shape[1], mean, centred @ centred.T)
+
+    def merge(self, other: 'PearsonAccumulator') -> 'PearsonAccumulator':
+        """Merge another accumulator"""
+        if other.n:
+            self._combine(other.n, other.mean, other.comoment)
+        return self
+
+    def pearson(self):
+        """(r, two-sided p-value); NaN with fewer than 3 pairs or a constant variable"""
+        sxx, sxy, syy = self.comoment[0, 0], self.comoment[0, 1], self.comoment[1, 1]
+        if self.n < 3 or sxx <= 0 or syy <= 0:
+            return float('nan'), float('nan')
+        r = float(np.clip(sxy / np.sqrt(sxx * syy), -1, 1))
+        t = r * np.sqrt((self.n - 2) / max(1 - r ** 2, 1e-300))
+        return r, float(2 * stats.t.sf(abs(t), self.n - 2))
+
+    def linear_fit(self):
+        """Least-squares (slope, intercept) of y on x; NaN when x is constant"""
+        sxx, sxy = self.comoment[0, 0], self.comoment[0, 1]
+        if self.n < 2 or sxx <= 0:
+            return float('nan'), float('nan')
+        slope = sxy / sxx
+        return float(slope), float(self.mean[1] - slope * self.mean[0])
+
+
+class QuantileSketch:
+    """
+    Mergeable approximate quantile sketch (KLL-style compactor levels)
+
+    Items at level i carry weight 2**i. When a level overflows its
+    capacity it is sorted and every other item is promoted, so memory
+    stays O(k log n) and two sketches merge by concatenating levels.
+    """
+
+    def __init__(self, k: int = 256, seed: int = 0):
+        self.k = k
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            buf = self.levels[level]
+            if buf.size > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                buf = np.sort(buf)
+                leftover = buf[buf.size - buf.size % 2:]
+                promoted = buf[self._rng.integers(2):buf.size - buf.size % 2:2]
+                self.levels[level] = leftover
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values: np.ndarray):
+        """Add a batch of values (non-finite values are ignored)"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        self.n += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        """Merge another sketch into this one"""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, buf in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], buf])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantiles(self, qs) -> np.ndarray:
+        """Approximate values at quantiles qs (each in [0, 1])"""
+        qs = np.asarray(qs, dtype=np.float64)
+        if self.n == 0:
+            return np.full(qs.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(buf.size, 2.0 ** level)
+                                  for level, buf in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items = items[order]
+        cum_weights = np.cumsum(weights[order])
+        idx = np.searchsorted(cum_weights, qs * cum_weights[-1], side='left')
+        result = items[np.clip(idx, 0, items.size - 1)]
+        # Extremes are tracked exactly
+        return np.where(qs <= 0, self.min, np.where(qs >= 1, self.max, result))
+
+
+class ResponseCurve:
+    """
+    Binned response of dNBR to one predictor
+
+    Keeps per-bin counts, predictor sums, response means and centred sums
+    of squares (merged with Chan's update, for the std) plus a per-bin
+    histogram of the response over a fixed range (for quantiles), all
+    filled with bincount so tiles can be accumulated and merged without
+    sorting.
+    """
+
+    def __init__(self, edges, response_range=(-0.5, 2.0), response_bins: int = 250):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.n_bins = self.edges.size - 1
+        self.response_edges = np.linspace(response_range[0], response_range[1], response_bins + 1)
+        self.count = np.zeros(self.n_bins, dtype=np.int64)
+        self.x_sum = np.zeros(self.n_bins)
+        self.y_mean = np.zeros(self.n_bins)
+        self.y_m2 = np.zeros(self.n_bins)
+        self.y_hist = np.zeros((self.n_bins, response_bins), dtype=np.int64)
+
+    @classmethod
+    def from_sketch(cls, sketch: QuantileSketch, n_bins: int = 10, **kwargs) -> 'ResponseCurve':
+        """Quantile bins (deciles by default); tied edges are merged"""
+        edges = np.unique(sketch.quantiles(np.linspace(0, 1, n_bins + 1)))
+        if edges.size < 2:
+            edges = np.array([edges[0], edges[0]]) if edges.size else np.array([0.0, 0.0])
+        return cls(edges, **kwargs)
+
+    @classmethod
+    def fixed(cls, lo: float, hi: float, n_bins: int = 10, **kwargs) -> 'ResponseCurve':
+        """Equal-width bins between lo and hi"""
+        return cls(np.linspace(lo, hi, n_bins + 1), **kwargs)
+
+    def update(self, x: np.ndarray, y: np.ndarray):
+        """Add one tile of paired predictor / response values"""
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        keep = np.isfinite(x) & np.isfinite(y)
+        x, y = x[keep], y[keep]
+
+        # Values outside the outer edges go to the first/last bin
+        xbin = np.clip(np.searchsorted(self.edges[1:-1], x, side='right'), 0, self.n_bins - 1)
+        n_resp = self.response_edges.size - 1
+        ybin = np.clip(np.searchsorted(self.response_edges[1:-1], y, side='right'), 0, n_resp - 1)
+
+        count = np.bincount(xbin, minlength=self.n_bins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.bincount(xbin, weights=y, minlength=self.n_bins) / count
+        mean = np.where(count > 0, mean, 0.0)
+        m2 = np.bincount(xbin, weights=(y - mean[xbin]) ** 2, minlength=self.n_bins)
+        self._combine(count, mean, m2)
+        self.x_sum += np.bincount(xbin, weights=x, minlength=self.n_bins)
+        self.y_hist += np.bincount(xbin * n_resp + ybin,
+                                   minlength=self.n_bins * n_resp).reshape(self.n_bins, n_resp)
+
+    def _combine(self, count: np.ndarray, mean: np.ndarray, m2: np.ndarray):
+        """Chan's pairwise merge of per-bin (count, mean, centred sum of squares)"""
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(total > 0, count / total, 0.0)
+        delta = mean - self.y_mean
+        self.y_m2 += m2 + delta ** 2 * self.count * weight
+        self.y_mean += delta * weight
+        self.count = total
+
+    def merge(self, other: 'ResponseCurve') -> 'ResponseCurve':
+        """Merge another curve built on the same edges"""
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge response curves with different bin edges")
+        self._combine(other.count, other.y_mean, other.y_m2)
+        self.x_sum += other.x_sum
+        self.y_hist += other.y_hist
+        return self
+
+    def _hist_quantile(self, hist: np.ndarray, q: float) -> float:
+        """Quantile from a response histogram, interpolated within the bin"""
+        cum = np.cumsum(hist)
+        target = q * cum[-1]
+        i = int(np.searchsorted(cum, target, side='left'))
+        prev = cum[i - 1] if i > 0 else 0
+        frac = (target - prev) / hist[i] if hist[i] > 0 else 0.0
+        lo, hi = self.response_edges[i], self.response_edges[i + 1]
+        return float(lo + frac * (hi - lo))
+
+    def to_dict(self, quantiles=(0.1, 0.25, 0.5, 0.75, 0.9)) -> dict:
+        """Serialize per-bin statistics for JSON output"""
+        bins = []
+        for i in range(self.n_bins):
+            n = int(self.count[i])
+            entry = {
+                'lower': float(self.edges[i]),
+                'upper': float(self.edges[i + 1]),
+                'count': n
+            }
+            if n > 0:
+                entry['predictor_mean'] = float(self.x_sum[i] / n)
+                entry['dnbr_mean'] = float(self.y_mean[i])
+                entry['dnbr_std'] = float(np.sqrt(self.y_m2[i] / n))
+                entry['dnbr_quantiles'] = {f'q{int(round(q * 100)):02d}': self._hist_quantile(self.y_hist[i], q)
+                                           for q in quantiles}
+            bins.append(entry)
+        return {'edges': self.edges.tolist(), 'bins': bins}
+
+
+class DensityHistogram:
+    """
+    Streaming 2D histogram of predictor vs response for density plots
+
+    The same pairs also feed a PearsonAccumulator, so the least-squares line
+    comes from centred co-moments without a second pass.
+    """
+
+    def __init__(self, x_range, y_range, bins=(200, 150)):
+        self.x_edges = np.linspace(x_range[0], x_range[1], bins[0] + 1)
+        self.y_edges = np.linspace(y_range[0], y_range[1], bins[1] + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.moments = PearsonAccumulator()
+
+    @property
+    def n(self) -> int:
+        return self.moments.n
+
+    def update(self, x: np.ndarray, y: np.ndarray):
+        """Add one tile of paired values (values outside the ranges are clipped)"""
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        keep = np.isfinite(x) & np.isfinite(y)
+        x, y = x[keep], y[keep]
+
+        nx, ny = self.counts.shape
+        xbin = np.clip(np.searchsorted(self.x_edges[1:-1], x, side='right'), 0, nx - 1)
+        ybin = np.clip(np.searchsorted(self.y_edges[1:-1], y, side='right'), 0, ny - 1)
+        self.counts += np.bincount(xbin * ny + ybin, minlength=nx * ny).reshape(nx, ny)
+
+        self.moments.update(x, y)
+
+    def merge(self, other: 'DensityHistogram') -> 'DensityHistogram':
+        """Merge another histogram built on the same edges"""
+        if not (np.array_equal(self.x_edges, other.x_edges) and
+                np.array_equal(self.y_edges, other.y_edges)):
+            raise ValueError("Cannot merge density histograms with different edges")
+        self.counts += other.counts
+        self.moments.merge(other.moments)
+        return self
+
+    def linear_fit(self):
+        """Least-squares (slope, intercept) of y on x; a flat line at the mean when x is constant"""
+        slope, intercept = self.moments.linear_fit()
+        if np.isnan(slope):
+            return 0.0, float(self.moments.mean[1])
+        return slope, intercept
@@ -19,6 +19,7 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from pathlib import Path
+import json
 from scipy.stats import pearsonr
 
 # Page config
@@ -115,6 +116,15 @@ def load_validation_results():
     }
     return results
 
+@st.cache_data
+def load_response_curves():
+    """Load dNBR response curves written by analysis/04_validation.py"""
+    curves_path = Path(__file__).parent.parent / 'outputs' / 'validation' / 'response_curves.json'
+    if not curves_path.exists():
+        return None
+    with open(curves_path) as f:
+        return json.load(f)
+
 @st.cache_data
 def load_raster_stats(raster_path):
     """Load raster and compute basic stats"""
@@ -381,6 +391,36 @@ elif view_mode == "📈 Validation Analysis":
 
     st.markdown("---")
 
+    # Response curves from the validation run
+    response_curves = load_response_curves()
+    if response_curves is not None:
+        st.markdown("### Burn Severity Response by Predictor Decile")
+
+        curve_rows = []
+        for predictor, curve in response_curves.items():
+            bins = [b for b in curve['bins'] if b['count'] > 0]
+            for rank, b in enumerate(bins, start=1):
+                curve_rows.append({
+                    'Predictor': predictor,
+                    'Decile': rank,
+                    'Mean dNBR': b['dnbr_mean'],
+                    'Median dNBR': b['dnbr_quantiles']['q50']
+                })
+
+        fig_curves = px.line(
+            pd.DataFrame(curve_rows),
+            x='Decile',
+            y='Mean dNBR',
+            color='Predictor',
+            markers=True,
+            hover_data=['Median dNBR'],
+            title='Mean dNBR per Predictor Decile'
+        )
+        fig_curves.update_layout(height=400)
+        st.plotly_chart(fig_curves, use_container_width=True)
+
+        st.markdown("---")
+
     # Severity class breakdown
     st.markdown("### Performance by Burn Severity Class")
 
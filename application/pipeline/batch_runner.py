@@ -0,0 +1,255 @@
+"""
+Multi-Fire Batch Runner
+Runs the analysis pipeline (01 -> 04) for every fire in a catalog in a
+process pool, with per-fire output directories and a memory-based
+concurrency cap, then writes a cross-fire summary of R² improvements.
+"""
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+import rasterio
+
+sys.path.append(str(Path(__file__).parent.parent))
+from pipeline.fire_catalog import FireRecord, load_fire_catalog
+from utils.config import Config
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+ROOT_DIR = Path(__file__).parent.parent.parent
+ANALYSIS_DIR = ROOT_DIR / 'analysis'
+
+STAGES = [
+    '01_change_detection.py',
+    '02_burn_severity.py',
+    '03_enhanced_fuel_map.py',
+    '04_validation.py'
+]
+
+# Rough peak number of full-grid arrays alive per stage and their item size,
+# measured on Hermits Peak; used only to cap concurrency
+SENTINEL_ARRAYS_PEAK = 24   # 01: 7 bands + 2 MODIS + stress temporaries (float32)
+LANDFIRE_ARRAYS_PEAK = 24   # 04: inputs, reprojections and masks (float32)
+MEMORY_OVERHEAD_BYTES = 512 * 1024 ** 2
+
+SUMMARY_FIELDS = [
+    'fire_id', 'name', 'status', 'elapsed_s', 'sample_size',
+    'landfire_r2', 'enhanced_r2', 'absolute_improvement', 'improvement_percent',
+    'landfire_p_value_dutilleul', 'enhanced_p_value_dutilleul', 'failed_stage'
+]
+
+
+def estimate_peak_memory(record: FireRecord) -> int:
+    """Estimate a fire's peak pipeline memory (bytes) from raster headers only"""
+    with rasterio.open(record.sentinel_prefire) as src:
+        sentinel_pixels = src.width * src.height
+    with rasterio.open(record.landfire) as src:
+        landfire_pixels = src.width * src.height
+
+    return int(max(sentinel_pixels * 4 * SENTINEL_ARRAYS_PEAK,
+                   landfire_pixels * 4 * LANDFIRE_ARRAYS_PEAK) + MEMORY_OVERHEAD_BYTES)
+
+
+def available_memory() -> int:
+    """Currently available physical memory in bytes (Linux/macOS sysconf)"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 4 * 1024 ** 3
+
+
+def fire_config(record: FireRecord, fire_dir: Path) -> Config:
+    """Per-fire Config (bounding box and UTM zone derived from the AOI)"""
+    return Config.from_dict({
+        'FIRE_ID': record.fire_id,
+        'FIRE_NAME': record.name,
+        'FIRE_YEAR': int(record.fire_start[:4]),
+        'FIRE_START_DATE': record.fire_start,
+        'FIRE_END_DATE': record.fire_end,
+        'FIRE_SIZE_ACRES': record.extra.get('fire_size_acres'),
+        'FIRE_DAMAGE_USD': record.extra.get('fire_damage_usd'),
+        'FIRE_AOI_PATH': record.aoi,
+        'OUTPUTS_DIR': fire_dir,
+        'SENTINEL_PREFIRE_PATH': record.sentinel_prefire,
+        'SENTINEL_POSTFIRE_PATH': record.sentinel_postfire,
+        'MODIS_PREFIRE_PATH': record.modis_prefire,
+        'MODIS_POSTFIRE_PATH': record.modis_postfire,
+        'LANDFIRE_PATH': record.landfire,
+        'TARGET_CRS': record.extra.get('target_crs')
+    })
+
+
+def fire_environment(config: Config) -> dict:
+    """Environment variables that point the analysis scripts at one fire"""
+    env = os.environ.copy()
+    env.update(config.to_env())
+    env['MPLBACKEND'] = 'Agg'
+    return env
+
+
+def run_fire(record: FireRecord, output_root: Path) -> dict:
+    """
+    Run all pipeline stages for one fire (executed in a worker process)
+
+    Each stage runs as a subprocess writing under output_root/<fire_id>,
+    with its stdout/stderr appended to pipeline.log there.
+
+    Returns:
+        Summary row for the cross-fire table
+    """
+    # Absolute: stages run with cwd=fire_dir and read the directory back from the env
+    fire_dir = (Path(output_root) / record.fire_id).resolve()
+    config = fire_config(record, fire_dir)
+    config.ensure_dir(fire_dir)
+    env = fire_environment(config)
+    row = {'fire_id': record.fire_id, 'name': record.name, 'status': 'ok', 'failed_stage': ''}
+
+    start = time.time()
+    with open(fire_dir / 'pipeline.log', 'w') as log:
+        for stage in STAGES:
+            log.write(f"\n===== {stage} =====\n")
+            log.flush()
+            result = subprocess.run([sys.executable, str(ANALYSIS_DIR / stage)],
+                                    cwd=fire_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+            if result.returncode != 0:
+                row.update(status='failed', failed_stage=stage)
+                break
+    row['elapsed_s'] = round(time.time() - start, 1)
+
+    metrics_path = fire_dir / 'validation' / 'validation_metrics.json'
+    if row['status'] == 'ok' and metrics_path.exists():
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+        correlation = metrics['correlation_analysis']
+        significance = metrics.get('statistical_significance', {})
+        row.update(
+            sample_size=metrics.get('sample_size'),
+            landfire_r2=correlation['landfire_r2'],
+            enhanced_r2=correlation['enhanced_r2'],
+            absolute_improvement=correlation['absolute_improvement'],
+            improvement_percent=correlation['improvement_percent'],
+            landfire_p_value_dutilleul=significance.get('landfire_p_value_dutilleul'),
+            enhanced_p_value_dutilleul=significance.get('enhanced_p_value_dutilleul')
+        )
+    return row
+
+
+def run_batch(records, output_root: Path, max_workers: int = None,
+              memory_budget: int = None) -> list:
+    """
+    Run many fires in a process pool without exceeding the memory budget
+
+    A fire is only started when its estimated peak memory fits next to the
+    fires already running; a fire larger than the whole budget runs alone.
+
+    Args:
+        records: FireRecord list
+        output_root: Directory receiving one sub-directory per fire
+        max_workers: Process cap (defaults to CPU count)
+        memory_budget: Bytes available to the batch (defaults to free memory)
+
+    Returns:
+        Summary rows in catalog order
+    """
+    output_root = Path(output_root).resolve()
+    output_root.mkdir(parents=True, exist_ok=True)
+    max_workers = max_workers or os.cpu_count() or 1
+    memory_budget = memory_budget or available_memory()
+
+    rows = {}
+    pending = []
+    for record in records:
+        missing = record.missing_inputs()
+        if missing:
+            logger.warning(f"  ⚠ {record.fire_id}: missing {', '.join(missing)}, skipping")
+            rows[record.fire_id] = {'fire_id': record.fire_id, 'name': record.name,
+                                    'status': 'missing_inputs', 'failed_stage': ''}
+            continue
+        pending.append((record, estimate_peak_memory(record)))
+
+    logger.info(f"Running {len(pending)} fires with up to {max_workers} workers, "
+                f"memory budget {memory_budget / 1024 ** 3:.1f} GB")
+
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            in_use = sum(estimate for _, estimate in running.values())
+            started = False
+            for i, (record, estimate) in enumerate(pending):
+                fits = in_use + estimate <= memory_budget or not running
+                if fits and len(running) < max_workers:
+                    future = pool.submit(run_fire, record, output_root)
+                    running[future] = (record, estimate)
+                    pending.pop(i)
+                    logger.info(f"  ▶ {record.fire_id} (est. {estimate / 1024 ** 3:.1f} GB)")
+                    started = True
+                    break
+            if started:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                record, _ = running.pop(future)
+                try:
+                    row = future.result()
+                except Exception as e:
+                    row = {'fire_id': record.fire_id, 'name': record.name,
+                           'status': f'error: {e}', 'failed_stage': ''}
+                rows[record.fire_id] = row
+                logger.info(f"  ✓ {record.fire_id}: {row['status']}")
+
+    return [rows[record.fire_id] for record in records]
+
+
+def write_summary(rows, output_root: Path):
+    """Write the cross-fire summary as CSV and JSON and log it as a table"""
+    output_root = Path(output_root)
+    with open(output_root / 'cross_fire_summary.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(output_root / 'cross_fire_summary.json', 'w') as f:
+        json.dump(rows, f, indent=2)
+
+    logger.info("")
+    logger.info(f"{'Fire':<28}{'Status':<16}{'LANDFIRE R²':>12}{'Enhanced R²':>12}{'ΔR²':>10}")
+    for row in rows:
+        if row.get('enhanced_r2') is not None:
+            logger.info(f"{row['fire_id']:<28}{row['status']:<16}{row['landfire_r2']:>12.4f}"
+                        f"{row['enhanced_r2']:>12.4f}{row['absolute_improvement']:>+10.4f}")
+        else:
+            logger.info(f"{row['fire_id']:<28}{row['status']:<16}")
+
+    improved = [row for row in rows if (row.get('absolute_improvement') or 0) > 0]
+    completed = [row for row in rows if row.get('enhanced_r2') is not None]
+    logger.info(f"Enhanced map improved R² on {len(improved)} of {len(completed)} completed fires")
+
+
+def main(argv=None):
+    """Run the batch pipeline from the command line"""
+    parser = argparse.ArgumentParser(description='Run the fuel mapping pipeline over a fire catalog')
+    parser.add_argument('--catalog', required=True, type=Path, help='Fire catalog (.yaml or .csv)')
+    parser.add_argument('--output', type=Path, default=ROOT_DIR / 'outputs' / 'batch',
+                        help='Root directory for per-fire outputs')
+    parser.add_argument('--workers', type=int, default=None, help='Maximum parallel fires')
+    parser.add_argument('--memory-gb', type=float, default=None,
+                        help='Memory budget for the batch (default: currently free memory)')
+    args = parser.parse_args(argv)
+
+    records = load_fire_catalog(args.catalog)
+    budget = int(args.memory_gb * 1024 ** 3) if args.memory_gb else None
+    rows = run_batch(records, args.output, max_workers=args.workers, memory_budget=budget)
+    write_summary(rows, args.output)
+    logger.info(f"✅ Batch complete: {args.output / 'cross_fire_summary.csv'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Fire Catalog
+Describes the fires to run the pipeline over (name, AOI, dates, input rasters)
+"""
+
+import csv
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+import yaml
+
+# Catalog keys that hold file paths (resolved relative to the catalog file)
+PATH_FIELDS = [
+    'aoi', 'sentinel_prefire', 'sentinel_postfire',
+    'modis_prefire', 'modis_postfire', 'landfire'
+]
+
+
+@dataclass
+class FireRecord:
+    """One fire in the catalog"""
+
+    name: str
+    aoi: Path
+    fire_start: str
+    fire_end: str
+    sentinel_prefire: Path
+    sentinel_postfire: Path
+    modis_prefire: Path
+    modis_postfire: Path
+    landfire: Path
+    fire_id: Optional[str] = None
+    extra: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        if not self.fire_id:
+            self.fire_id = re.sub(r'[^a-z0-9]+', '_', self.name.lower()).strip('_')
+
+    @property
+    def input_paths(self) -> dict:
+        """Input rasters keyed by catalog field name"""
+        return {name: getattr(self, name) for name in PATH_FIELDS if name != 'aoi'}
+
+    def missing_inputs(self) -> List[str]:
+        """Names of catalog paths that do not exist on disk"""
+        return [name for name in PATH_FIELDS if not Path(getattr(self, name)).exists()]
+
+
+def _record_from_dict(entry: dict, base_dir: Path) -> FireRecord:
+    entry = {key: value for key, value in entry.items() if value not in (None, '')}
+    missing = [key for key in ['name', 'fire_start', 'fire_end'] + PATH_FIELDS if key not in entry]
+    if missing:
+        raise ValueError(f"Catalog entry {entry.get('name', '?')!r} is missing: {', '.join(missing)}")
+
+    known = {'name', 'fire_id', 'fire_start', 'fire_end'} | set(PATH_FIELDS)
+    kwargs = {key: entry[key] for key in known if key in entry}
+    for key in PATH_FIELDS:
+        path = Path(kwargs[key]).expanduser()
+        kwargs[key] = path if path.is_absolute() else (base_dir / path).resolve()
+    kwargs['fire_start'] = str(kwargs['fire_start'])
+    kwargs['fire_end'] = str(kwargs['fire_end'])
+    kwargs['extra'] = {key: value for key, value in entry.items() if key not in known}
+    return FireRecord(**kwargs)
+
+
+def load_fire_catalog(path: Path) -> List[FireRecord]:
+    """
+    Load a fire catalog from YAML (list under 'fires') or CSV (one row per fire)
+
+    Args:
+        path: Catalog file; relative paths inside it are resolved against its directory
+
+    Returns:
+        List of FireRecord
+    """
+    path = Path(path)
+    if path.suffix.lower() in ('.yaml', '.yml'):
+        with open(path) as f:
+            document = yaml.safe_load(f) or {}
+        entries = document.get('fires', []) if isinstance(document, dict) else document
+    elif path.suffix.lower() == '.csv':
+        with open(path, newline='') as f:
+            entries = list(csv.DictReader(f))
+    else:
+        raise ValueError(f"Unsupported catalog format: {path.suffix} (use .yaml or .csv)")
+
+    records = [_record_from_dict(entry, path.parent) for entry in entries]
+    fire_ids = [record.fire_id for record in records]
+    duplicates = sorted({fid for fid in fire_ids if fire_ids.count(fid) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate fire ids in catalog: {', '.join(duplicates)}")
+    return records
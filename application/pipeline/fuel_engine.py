@@ -0,0 +1,241 @@
+"""
+Tile-wise Fuel Map Engine
+Runs the 01 -> 03 stage math for one block of the LANDFIRE grid at a time,
+reading only the Sentinel-2 window that covers the block. Used by the
+sharded pipeline, where the full AOI does not fit in memory.
+"""
+
+import sys
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.warp import reproject, transform_bounds, Resampling
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import bounds as window_bounds
+from rasterio.windows import transform as window_transform
+
+sys.path.append(str(Path(__file__).parent.parent))
+from analysis.changepoints import BREAK_BANDS
+from analysis.climatology import Climatology, INDEX_FILE as CLIMATOLOGY_INDEX
+from analysis.fuel_stages import (stress_components, anomaly_stress_components, burn_severity,
+                                   severity_class, fuel_risk, enhanced_fuel, disturbance_stress,
+                                   risk_weighting)
+from utils.config import Config
+from utils.coverage import CoverageMap, load_aoi_geometries
+from utils.logger import setup_logger
+from utils.tiling import Tile, DEFAULT_TILE_SIZE
+
+logger = setup_logger(__name__)
+
+# Output layers, in band order of shard and mosaic rasters
+OUTPUT_LAYERS = [
+    'stress_score',
+    'fuel_risk_score',
+    'fuel_load_factor',
+    'enhanced_cbd',
+    'dnbr',
+    'burn_severity'
+]
+
+# Sentinel-2 band numbers (B2, B3, B4, B8, B11, B12, NDVI, NBR, NDMI)
+S2_NDVI_BAND = 7
+S2_NBR_BAND = 8
+S2_NDMI_BAND = 9
+
+# Context read around each block, in target pixels, so bilinear resampling
+# at block edges sees the same source pixels as a full-grid run
+DEFAULT_OVERLAP = 4
+
+
+class FuelMapEngine:
+    """
+    Computes enhanced fuel layers block by block on the LANDFIRE grid
+
+    Use as a context manager so the input rasters stay open across blocks.
+    When the config's AOI polygon exists, blocks outside it are skipped
+    without reading any input and pixels outside it are set to NaN.
+    """
+
+    def __init__(self, config: Config, overlap: int = DEFAULT_OVERLAP,
+                 block_size: int = DEFAULT_TILE_SIZE, use_aoi: bool = True):
+        """
+        Args:
+            config: Fire / AOI configuration
+            overlap: Context pixels read around each block
+            block_size: Resolution of the AOI coverage bitmap (the block size used by callers)
+            use_aoi: Restrict processing to config.FIRE_AOI_PATH when it exists
+        """
+        self.config = config
+        self.overlap = overlap
+        self._sources = {}
+        self._climatology = None
+
+        with rasterio.open(config.LANDFIRE_PATH) as src:
+            self.height = src.height
+            self.width = src.width
+            self.transform = src.transform
+            self.crs = src.crs
+            self.profile = src.profile.copy()
+
+        self.coverage = None
+        if use_aoi and config.FIRE_AOI_PATH and config.FIRE_AOI_PATH.exists():
+            geometries = load_aoi_geometries(config.FIRE_AOI_PATH, self.crs)
+            self.coverage = CoverageMap(geometries, self.transform, self.height,
+                                        self.width, block_size)
+            logger.info(f"AOI covers {self.coverage.covered_fraction:.1%} of "
+                        f"{block_size}-pixel blocks ({config.FIRE_AOI_PATH.name})")
+
+    def intersects(self, tile: Tile) -> bool:
+        """Whether a block has any pixels inside the AOI"""
+        return self.coverage is None or self.coverage.intersects(tile)
+
+    @property
+    def uses_disturbance(self) -> bool:
+        """Whether a vegetation break raster feeds the risk score"""
+        breaks_path = self.config.VEGETATION_BREAKS_PATH
+        return bool(breaks_path and breaks_path.exists())
+
+    @property
+    def risk_weighting(self) -> dict:
+        """fuel_risk weighting used by compute(), for the statistics JSON"""
+        return risk_weighting(self.uses_disturbance)
+
+    def __enter__(self):
+        self._sources = {
+            'landfire': rasterio.open(self.config.LANDFIRE_PATH),
+            'prefire': rasterio.open(self.config.SENTINEL_PREFIRE_PATH),
+            'postfire': rasterio.open(self.config.SENTINEL_POSTFIRE_PATH)
+        }
+        if self.uses_disturbance:
+            self._sources['breaks'] = rasterio.open(self.config.VEGETATION_BREAKS_PATH)
+        climatology_dir = self.config.CLIMATOLOGY_DIR
+        self._climatology = None
+        if climatology_dir and (climatology_dir / CLIMATOLOGY_INDEX).exists():
+            self._climatology = Climatology(climatology_dir)
+        return self
+
+    def __exit__(self, *exc):
+        for src in self._sources.values():
+            src.close()
+        self._sources = {}
+
+    def source_window(self, src, tile: Tile):
+        """Window of src covering the tile plus overlap, or None if disjoint"""
+        outer = Window(tile.col_off - self.overlap, tile.row_off - self.overlap,
+                       tile.width + 2 * self.overlap, tile.height + 2 * self.overlap)
+        bounds = transform_bounds(self.crs, src.crs, *window_bounds(outer, self.transform))
+        window = from_bounds(*bounds, transform=src.transform).round_offsets().round_lengths()
+        try:
+            return window.intersection(Window(0, 0, src.width, src.height))
+        except rasterio.errors.WindowError:
+            return None
+
+    def _to_tile(self, array: np.ndarray, src, window: Window, tile: Tile) -> np.ndarray:
+        """Bilinearly resample a source-window array onto the tile grid"""
+        out = np.full((tile.height, tile.width), np.nan, dtype=np.float32)
+        reproject(
+            source=array,
+            destination=out,
+            src_transform=src.window_transform(window),
+            src_crs=src.crs,
+            dst_transform=window_transform(tile.window, self.transform),
+            dst_crs=self.crs,
+            dst_nodata=np.nan,
+            resampling=Resampling.bilinear
+        )
+        return out
+
+    def compute(self, tile: Tile) -> dict:
+        """
+        Run stages 01 -> 03 for one block of the LANDFIRE grid
+
+        Args:
+            tile: Block of the LANDFIRE grid
+
+        Returns:
+            Dict of float32 (tile.height, tile.width) arrays keyed by OUTPUT_LAYERS
+        """
+        if not self._sources:
+            raise RuntimeError("FuelMapEngine must be used as a context manager")
+
+        empty = np.full((tile.height, tile.width), np.nan, dtype=np.float32)
+        inside = None if self.coverage is None else self.coverage.mask(tile)
+        if inside is not None and not inside.any():
+            return {name: empty.copy() for name in OUTPUT_LAYERS}
+
+        prefire = self._sources['prefire']
+        window = self.source_window(prefire, tile)
+        if window is None:
+            return {name: empty.copy() for name in OUTPUT_LAYERS}
+        cbd = self._sources['landfire'].read(2, window=tile.window).astype(np.float32)
+
+        # Step 1: stress on the Sentinel-2 grid, then onto the LANDFIRE block
+        ndvi = prefire.read(S2_NDVI_BAND, window=window)
+        nbr = prefire.read(S2_NBR_BAND, window=window)
+        ndmi = prefire.read(S2_NDMI_BAND, window=window)
+        if self._climatology is None:
+            stress = stress_components(ndvi, nbr, ndmi)
+        else:
+            when = date.fromisoformat(self.config.FIRE_START_DATE)
+            normals = {name: self._climatology.normals_on(name, when, prefire.window_transform(window),
+                                                          ndvi.shape, prefire.crs)
+                       for name in ('NDVI', 'NBR', 'NDMI')}
+            stress = anomaly_stress_components(ndvi, nbr, ndmi, normals)
+        stress_score = self._to_tile(stress['stress_score'].astype(np.float32), prefire, window, tile)
+        ndvi_change = self._to_tile(stress['ndvi_change'].astype(np.float32), prefire, window, tile)
+        ndmi_change = self._to_tile(stress['ndmi_change'].astype(np.float32), prefire, window, tile)
+
+        # Step 2: dNBR from both composites resampled onto the block
+        postfire = self._sources['postfire']
+        post_window = self.source_window(postfire, tile)
+        nbr_pre = self._to_tile(nbr, prefire, window, tile)
+        if post_window is None:
+            nbr_post = empty.copy()
+        else:
+            nbr_post = self._to_tile(postfire.read(S2_NBR_BAND, window=post_window),
+                                     postfire, post_window, tile)
+        dnbr, _ = burn_severity(nbr_pre, nbr_post)
+        severity = np.where(np.isnan(dnbr), np.nan, severity_class(dnbr))
+
+        # Step 3: risk score (+ vegetation-break disturbance) and enhanced canopy bulk density
+        disturbance = None
+        breaks = self._sources.get('breaks')
+        if breaks is not None:
+            breaks_window = self.source_window(breaks, tile)
+            disturbance = np.zeros((tile.height, tile.width), dtype=np.float32)
+            if breaks_window is not None:
+                magnitude, confidence = (
+                    self._to_tile(breaks.read(BREAK_BANDS.index(name) + 1, window=breaks_window),
+                                  breaks, breaks_window, tile)
+                    for name in ('break_magnitude', 'break_confidence'))
+                disturbance = disturbance_stress(magnitude, confidence)
+        risk = fuel_risk(stress_score, ndvi_change, ndmi_change, disturbance)
+        fuel_load_factor, enhanced_cbd = enhanced_fuel(cbd, risk)
+
+        layers = {
+            'stress_score': stress_score,
+            'fuel_risk_score': risk,
+            'fuel_load_factor': fuel_load_factor,
+            'enhanced_cbd': enhanced_cbd,
+            'dnbr': dnbr,
+            'burn_severity': severity
+        }
+        layers = {name: layers[name].astype(np.float32) for name in OUTPUT_LAYERS}
+        if inside is not None:
+            for array in layers.values():
+                array[~inside] = np.nan
+        return layers
+
+    def output_profile(self, tile: Tile = None) -> dict:
+        """GeoTIFF profile for OUTPUT_LAYERS over the whole grid or one tile"""
+        profile = self.profile.copy()
+        profile.update(
+            count=len(OUTPUT_LAYERS), dtype='float32', nodata=np.nan,
+            compress='deflate', predictor=3, tiled=True, blockxsize=256, blockysize=256
+        )
+        if tile is not None:
+            profile.update(height=tile.height, width=tile.width,
+                           transform=window_transform(tile.window, self.transform))
+        return profile
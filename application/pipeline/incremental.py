@@ -0,0 +1,474 @@
+"""
+Incremental Fuel Map Updates
+Keeps tiled stress / fuel-risk / enhanced-CBD rasters on the LANDFIRE grid
+up to date as new imagery arrives. A new acquisition's valid-data
+footprint is mapped to the target tiles it touches; the scene is composited
+into the pre- or post-fire composite (by its date) under those tiles, and
+only those tiles are recomputed (stages 01 -> 03), written in place, propagated up the overview pyramid, and folded
+into the summary statistics by subtracting the tiles' old contributions and
+adding the new ones.
+
+Output directory:
+    <layer>.tif                   Full-resolution tiled GeoTIFF
+    overviews/<layer>_<f>.tif     Pyramid levels (factor f = 2, 4, ...)
+    <layer>.vrt                   Full resolution + pyramid for GIS viewers
+    tile_stats.json               Per-tile additive statistics and running totals
+    enhancement_statistics.json   Summary in the format of 03_enhanced_fuel_map.py
+
+Usage:
+    python application/pipeline/incremental.py --footprint data/satellite/scenes/S2_20220915.tif
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import warnings
+from datetime import date, timedelta
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.warp import reproject
+
+sys.path.append(str(Path(__file__).parent.parent))
+from pipeline.fuel_engine import FuelMapEngine
+from preprocessing.compositing import (DEFAULT_MEMORY_MB, Scene, composite_scenes, find_scenes,
+                                       update_composite)
+from utils.config import Config
+from utils.logger import setup_logger
+from utils.tiling import Tile, iter_tiles, DEFAULT_TILE_SIZE
+
+logger = setup_logger(__name__)
+
+LAYERS = ['stress_score', 'fuel_risk_score', 'enhanced_cbd', 'dnbr']
+
+# Pyramid levels stop once a level is smaller than this (pixels)
+MIN_OVERVIEW_SIZE = 256
+
+# Fuel risk classes used in the summary (same breaks as 03)
+HIGH_RISK = 60
+MODERATE_RISK = 40
+
+# Footprints are inspected at this many pixels per target tile edge
+FOOTPRINT_SAMPLES_PER_TILE = 8
+
+STATS_FILE = 'tile_stats.json'
+SUMMARY_FILE = 'enhancement_statistics.json'
+
+
+def footprint_tiles(footprint_path: Path, engine: FuelMapEngine, tile_size: int) -> list:
+    """
+    Target tiles touched by the valid pixels of a new acquisition
+
+    The acquisition's dataset mask is resampled (max) onto a grid of
+    FOOTPRINT_SAMPLES_PER_TILE cells per target tile edge in the target CRS,
+    and any tile with a valid cell is returned.
+
+    Args:
+        footprint_path: New scene or composite (any CRS / resolution)
+        engine: FuelMapEngine on the target grid
+        tile_size: Target tile size
+    """
+    cell = max(tile_size // FOOTPRINT_SAMPLES_PER_TILE, 1)
+    shape = (math.ceil(engine.height / cell), math.ceil(engine.width / cell))
+    touched = np.zeros(shape, dtype=np.uint8)
+
+    with rasterio.open(footprint_path) as src:
+        # Decimate the source mask to about the target cell size first
+        # (average > 0 keeps any cell with a valid pixel)
+        src_res = max(abs(src.transform.a), abs(src.transform.e))
+        dst_res = abs(engine.transform.a) * cell
+        factor = max(int(dst_res // (2 * src_res)), 1) if src.crs == engine.crs else 1
+        out_shape = (max(src.height // factor, 1), max(src.width // factor, 1))
+        valid = src.dataset_mask(out_shape=out_shape, resampling=Resampling.average)
+        valid = (valid > 0).astype(np.uint8)
+        src_transform = src.transform * Affine.scale(src.width / out_shape[1],
+                                                     src.height / out_shape[0])
+        reproject(valid, touched, src_transform=src_transform, src_crs=src.crs,
+                  dst_transform=engine.transform * Affine.scale(cell), dst_crs=engine.crs,
+                  resampling=Resampling.max)
+
+    per_tile = tile_size // cell
+    tiles = []
+    for tile in iter_tiles(engine.height, engine.width, tile_size):
+        r, c = tile.row_off // cell, tile.col_off // cell
+        if touched[r:r + per_tile, c:c + per_tile].any() and engine.intersects(tile):
+            tiles.append(tile)
+    return tiles
+
+
+def composite_for(config: Config, when: date) -> Path:
+    """
+    Composite an acquisition belongs to: pre-fire before FIRE_START_DATE,
+    post-fire after FIRE_END_DATE
+
+    Raises:
+        ValueError: Acquired during the fire (in neither composite)
+    """
+    if when < date.fromisoformat(config.FIRE_START_DATE):
+        return config.SENTINEL_PREFIRE_PATH
+    if when > date.fromisoformat(config.FIRE_END_DATE):
+        return config.SENTINEL_POSTFIRE_PATH
+    raise ValueError(f"acquired {when}, during the fire ({config.FIRE_START_DATE} - "
+                     f"{config.FIRE_END_DATE}); it belongs to neither composite")
+
+
+def period_scenes(config: Config, composite_path: Path, scene_dir: Path) -> list:
+    """Scenes in scene_dir acquired in the period of the pre- or post-fire composite"""
+    if composite_path == config.SENTINEL_PREFIRE_PATH:
+        return find_scenes(scene_dir, end=config.FIRE_START_DATE)
+    start = date.fromisoformat(config.FIRE_END_DATE) + timedelta(days=1)
+    return find_scenes(scene_dir, start=start.isoformat())
+
+
+def fold_scenes(engine: FuelMapEngine, tiles, new_scenes, scene_dir: Path,
+                memory_mb: float = DEFAULT_MEMORY_MB) -> int:
+    """
+    Composite new scenes into the pre- / post-fire composite under target tiles
+
+    The engine reads only the composites (stress from the pre-fire one,
+    dNBR from both), so a new acquisition changes the outputs only once it
+    is composited in. Each scene goes to the composite of its date
+    (composite_for()); the composite windows the tiles read are composited
+    again from the scenes the composite is made of (compositing.composite_scenes(),
+    else the scenes of its period in scene_dir) plus the new ones.
+
+    Args:
+        engine: FuelMapEngine on the target grid (not entered)
+        tiles: Target tiles about to be recomputed
+        new_scenes: Paths of the new acquisitions
+        scene_dir: Scene directory used when a composite does not record its scenes
+        memory_mb: Compositing memory budget
+
+    Returns:
+        Number of composite pixels rewritten
+
+    Raises:
+        ValueError: A scene was acquired during the fire, or a composite is
+            not on the scene grid
+    """
+    tiles = list(tiles)
+    by_composite = {}
+    for path in new_scenes:
+        scene = Scene.from_path(Path(path))
+        by_composite.setdefault(composite_for(engine.config, scene.date), []).append(scene)
+
+    n_pixels = 0
+    for composite_path, new in by_composite.items():
+        scenes = composite_scenes(composite_path)
+        if scenes is None:
+            scenes = period_scenes(engine.config, composite_path, scene_dir)
+        scenes = {scene.path.resolve(): scene for scene in scenes}
+        for scene in new:
+            scenes.setdefault(scene.path.resolve(), scene)
+
+        with rasterio.open(composite_path) as src:
+            windows = [engine.source_window(src, tile) for tile in tiles]
+        windows = [Tile(int(w.row_off), int(w.col_off), int(w.height), int(w.width))
+                   for w in windows if w is not None]
+        n_pixels += update_composite(composite_path,
+                                     sorted(scenes.values(), key=lambda scene: scene.date),
+                                     windows, memory_mb=memory_mb)
+        logger.info(f"  ✓ {', '.join(scene.path.name for scene in new)} composited into "
+                    f"{composite_path.name} under {len(windows)} tiles")
+    return n_pixels
+
+
+def overview_factors(height: int, width: int, tile_size: int) -> list:
+    """Pyramid decimation factors (powers of two up to the tile size)"""
+    factors = []
+    factor = 2
+    while min(height, width) // factor >= MIN_OVERVIEW_SIZE and factor <= tile_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def downsample_2x(data: np.ndarray) -> np.ndarray:
+    """NaN-aware 2 x 2 mean (odd edges are padded with NaN)"""
+    height, width = data.shape
+    padded = np.full((height + height % 2, width + width % 2), np.nan, dtype=np.float32)
+    padded[:height, :width] = data
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanmean(blocks, axis=(1, 3)).astype(np.float32)
+
+
+def tile_stats(layers: dict, cbd: np.ndarray) -> dict:
+    """Additive statistics of one tile (sums, counts) plus its maxima"""
+    stats = {}
+    for name in LAYERS:
+        values = layers[name][np.isfinite(layers[name])].astype(np.float64)
+        stats[name] = {'n': int(values.size), 'sum': float(values.sum()),
+                       'sum_sq': float(np.square(values).sum()),
+                       'max': float(values.max()) if values.size else None}
+
+    risk = layers['fuel_risk_score']
+    stats['fuel_risk_score'].update(
+        high=int(np.sum(risk > HIGH_RISK)),
+        moderate=int(np.sum((risk > MODERATE_RISK) & (risk <= HIGH_RISK))),
+        low=int(np.sum(risk <= MODERATE_RISK)),
+        increased_20pct=int(np.sum(risk > 20))  # fuel load factor > 1.2
+    )
+    valid_cbd = np.isfinite(layers['enhanced_cbd'])
+    stats['enhanced_cbd']['original_sum'] = float(cbd[valid_cbd].astype(np.float64).sum())
+    return stats
+
+
+ADDITIVE_KEYS = ('n', 'sum', 'sum_sq', 'high', 'moderate', 'low', 'increased_20pct', 'original_sum')
+
+
+def combine_stats(totals: dict, stats: dict, sign: int):
+    """Add (sign=1) or subtract (sign=-1) one tile's stats from the totals in place"""
+    for name, values in stats.items():
+        layer_totals = totals.setdefault(name, {})
+        for key in ADDITIVE_KEYS:
+            if key in values:
+                layer_totals[key] = layer_totals.get(key, 0) + sign * values[key]
+
+
+def summarize(totals: dict, tiles: dict, weighting: dict = None) -> dict:
+    """enhancement_statistics.json content from running totals (and the risk weighting used)"""
+    def _mean(name):
+        n = totals[name]['n']
+        return totals[name]['sum'] / n if n else float('nan')
+
+    def _std(name):
+        n = totals[name]['n']
+        if not n:
+            return float('nan')
+        return math.sqrt(max(totals[name]['sum_sq'] / n - _mean(name) ** 2, 0.0))
+
+    risk = totals['fuel_risk_score']
+    cbd = totals['enhanced_cbd']
+    n_risk = max(risk['n'], 1)
+    original_mean = cbd['original_sum'] / cbd['n'] if cbd['n'] else float('nan')
+    enhanced_mean = _mean('enhanced_cbd')
+    max_risk = max((t['fuel_risk_score']['max'] for t in tiles.values()
+                    if t['fuel_risk_score']['max'] is not None), default=float('nan'))
+
+    return {
+        "fuel_risk_score": {
+            "mean": _mean('fuel_risk_score'),
+            "std": _std('fuel_risk_score'),
+            "high_risk_percent": risk['high'] / n_risk * 100,
+            "moderate_risk_percent": risk['moderate'] / n_risk * 100,
+            "low_risk_percent": risk['low'] / n_risk * 100
+        },
+        "fuel_load_adjustment": {
+            "mean_factor": 1.0 + _mean('fuel_risk_score') / 100,
+            "max_factor": 1.0 + max_risk / 100,
+            "areas_increased_20pct": risk['increased_20pct'] / n_risk * 100
+        },
+        "cbd_enhancement": {
+            "original_mean": original_mean,
+            "enhanced_mean": enhanced_mean,
+            "mean_increase": enhanced_mean - original_mean,
+            "percent_increase": (enhanced_mean - original_mean) / original_mean * 100
+            if original_mean else float('nan')
+        },
+        "stress_score": {
+            "mean": _mean('stress_score'),
+            "std": _std('stress_score')
+        },
+        "risk_weighting": weighting,
+        "valid_pixels": risk['n']
+    }
+
+
+class TiledFuelMap:
+    """Tiled stress / risk / CBD rasters with a pyramid and running statistics"""
+
+    def __init__(self, engine: FuelMapEngine, output_dir: Path, tile_size: int = DEFAULT_TILE_SIZE):
+        self.engine = engine
+        self.output_dir = Path(output_dir)
+        self.tile_size = tile_size
+        self.factors = overview_factors(engine.height, engine.width, tile_size)
+        self.stats_path = self.output_dir / STATS_FILE
+
+    def layer_path(self, name: str, factor: int = 1) -> Path:
+        if factor == 1:
+            return self.output_dir / f"{name}.tif"
+        return self.output_dir / 'overviews' / f"{name}_{factor}.tif"
+
+    def _profile(self, factor: int = 1) -> dict:
+        profile = self.engine.profile.copy()
+        profile.update(
+            count=1, dtype='float32', nodata=np.nan, compress='deflate', predictor=3,
+            tiled=True, blockxsize=256, blockysize=256,
+            height=math.ceil(self.engine.height / factor),
+            width=math.ceil(self.engine.width / factor),
+            transform=self.engine.transform * Affine.scale(factor)
+        )
+        return profile
+
+    @property
+    def exists(self) -> bool:
+        return self.stats_path.exists() and all(self.layer_path(name).exists() for name in LAYERS)
+
+    def create(self):
+        """Create empty (nodata) rasters, pyramid levels, VRTs and statistics"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        (self.output_dir / 'overviews').mkdir(exist_ok=True)
+        for name in LAYERS:
+            for factor in [1] + self.factors:
+                with rasterio.open(self.layer_path(name, factor), 'w', **self._profile(factor)) as dst:
+                    dst.set_band_description(1, name)
+            self._write_vrt(name)
+        self._save_stats({'tiles': {}, 'totals': {}})
+
+    def _write_vrt(self, name: str):
+        """VRT exposing the pyramid levels as overviews of the full-resolution layer"""
+        profile = self._profile()
+        lines = [f'<VRTDataset rasterXSize="{profile["width"]}" rasterYSize="{profile["height"]}">',
+                 f'  <SRS>{escape(profile["crs"].to_wkt())}</SRS>',
+                 '  <GeoTransform>' + ', '.join(repr(float(v)) for v in profile['transform'].to_gdal())
+                 + '</GeoTransform>',
+                 '  <VRTRasterBand dataType="Float32" band="1">',
+                 '    <NoDataValue>nan</NoDataValue>',
+                 '    <SimpleSource>',
+                 f'      <SourceFilename relativeToVRT="1">{name}.tif</SourceFilename>',
+                 '      <SourceBand>1</SourceBand>',
+                 '    </SimpleSource>']
+        for factor in self.factors:
+            source = self.layer_path(name, factor).relative_to(self.output_dir).as_posix()
+            lines += ['    <Overview>',
+                      f'      <SourceFilename relativeToVRT="1">{source}</SourceFilename>',
+                      '      <SourceBand>1</SourceBand>',
+                      '    </Overview>']
+        lines += ['  </VRTRasterBand>', '</VRTDataset>']
+        with open(self.output_dir / f"{name}.vrt", 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def _load_stats(self) -> dict:
+        with open(self.stats_path) as f:
+            return json.load(f)
+
+    def _save_stats(self, state: dict):
+        tmp_path = self.stats_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.stats_path)
+        if state['tiles']:
+            with open(self.output_dir / SUMMARY_FILE, 'w') as f:
+                json.dump(summarize(state['totals'], state['tiles'], self.engine.risk_weighting), f, indent=2)
+
+    def _refresh_pyramid(self, dst_levels: dict, tile: Tile):
+        """Recompute the pyramid nodes above one tile, level by level"""
+        for name in LAYERS:
+            previous, previous_factor = dst_levels[name][1], 1
+            for factor in self.factors:
+                row0, col0 = tile.row_off // factor, tile.col_off // factor
+                row1 = math.ceil((tile.row_off + tile.height) / factor)
+                col1 = math.ceil((tile.col_off + tile.width) / factor)
+                ratio = factor // previous_factor
+                src_window = Tile(row0 * ratio, col0 * ratio,
+                                  min(row1 * ratio, previous.height) - row0 * ratio,
+                                  min(col1 * ratio, previous.width) - col0 * ratio)
+                data = downsample_2x(previous.read(1, window=src_window.window))
+                level = dst_levels[name][factor]
+                level.write(data[:row1 - row0, :col1 - col0], 1,
+                            window=Tile(row0, col0, row1 - row0, col1 - col0).window)
+                previous, previous_factor = level, factor
+
+    def update(self, tiles) -> int:
+        """
+        Recompute tiles in place and propagate them to the pyramid and statistics
+
+        Args:
+            tiles: Target tiles to recompute (on this map's tile grid)
+
+        Returns:
+            Number of tiles recomputed
+        """
+        if not self.exists:
+            self.create()
+        state = self._load_stats()
+        tiles = list(tiles)
+
+        datasets = {name: {factor: rasterio.open(self.layer_path(name, factor), 'r+')
+                           for factor in [1] + self.factors} for name in LAYERS}
+        try:
+            with self.engine, rasterio.open(self.engine.config.LANDFIRE_PATH) as landfire:
+                for tile in tiles:
+                    key = f"{tile.row_off},{tile.col_off}"
+                    layers = self.engine.compute(tile)
+                    for name in LAYERS:
+                        datasets[name][1].write(layers[name], 1, window=tile.window)
+                    self._refresh_pyramid(datasets, tile)
+
+                    cbd = landfire.read(2, window=tile.window).astype(np.float32)
+                    new = tile_stats(layers, cbd)
+                    if key in state['tiles']:
+                        combine_stats(state['totals'], state['tiles'][key], -1)
+                    combine_stats(state['totals'], new, +1)
+                    state['tiles'][key] = new
+        finally:
+            for levels in datasets.values():
+                for dst in levels.values():
+                    dst.close()
+
+        self._save_stats(state)
+        return len(tiles)
+
+    def rebuild(self) -> int:
+        """Compute every tile inside the AOI"""
+        return self.update(tile for tile in iter_tiles(self.engine.height, self.engine.width,
+                                                       self.tile_size)
+                           if self.engine.intersects(tile))
+
+
+def main(argv=None):
+    """Composite a new acquisition in and recompute the tiles it touches (or everything)"""
+    parser = argparse.ArgumentParser(description='Incremental fuel map update')
+    parser.add_argument('--footprint', type=Path,
+                        help='New scene; it is composited into the pre- or post-fire composite under '
+                             'its valid pixels and only the target tiles there are recomputed')
+    parser.add_argument('--scenes', type=Path,
+                        help='Scene directory for composites that do not record their scenes '
+                             '(default: <data>/satellite/scenes)')
+    parser.add_argument('--composite-rebuilt', action='store_true',
+                        help='The composite was already rebuilt with --footprint; only recompute '
+                             '(the composite must be newer than the scene)')
+    parser.add_argument('--memory-mb', type=float, default=DEFAULT_MEMORY_MB,
+                        help='Compositing memory budget')
+    parser.add_argument('--config', type=Path, help='YAML/JSON config (default: FUELMAP_* env vars)')
+    parser.add_argument('--output', type=Path, help='Output directory (default: <outputs>/incremental)')
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument('--full', action='store_true', help='Recompute every tile')
+    args = parser.parse_args(argv)
+
+    config = Config.from_file(args.config) if args.config else Config.from_env()
+    engine = FuelMapEngine(config, block_size=args.tile_size)
+    fuel_map = TiledFuelMap(engine, args.output or config.OUTPUTS_DIR / 'incremental', args.tile_size)
+
+    if args.full or not fuel_map.exists or args.footprint is None:
+        n = fuel_map.rebuild()
+        logger.info(f"✓ Computed all {n} tiles")
+    else:
+        tiles = footprint_tiles(args.footprint, engine, args.tile_size)
+        n_total = len(list(iter_tiles(engine.height, engine.width, args.tile_size)))
+        try:
+            if args.composite_rebuilt:
+                composite = composite_for(config, Scene.from_path(args.footprint).date)
+                if composite.stat().st_mtime < args.footprint.stat().st_mtime:
+                    parser.error(f"{composite.name} is older than {args.footprint.name}; rebuild "
+                                 f"it first or drop --composite-rebuilt to composite the scene in")
+            else:
+                fold_scenes(engine, tiles, [args.footprint],
+                            args.scenes or config.DATA_DIR / 'satellite' / 'scenes', args.memory_mb)
+        except ValueError as e:
+            parser.error(str(e))
+        n = fuel_map.update(tiles)
+        logger.info(f"✓ Recomputed {n} of {n_total} tiles touched by {args.footprint.name}")
+    logger.info(f"  Outputs: {fuel_map.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+"""
+Scene Ingestion Service
+Long-running watcher for a drop directory of new Sentinel-2 GeoTIFFs (e.g.
+Earth Engine exports synced from Drive). Files are picked up once they stop
+growing, validated, moved into the scene directory and indexed; arrivals
+close together in time are batched into one incremental fuel map update
+(pipeline/incremental.py) that runs on a bounded worker pool: the batch is
+composited into the pre- / post-fire composite under the tiles it touches,
+then those tiles are recomputed.
+
+Directory layout:
+    <drop>/                 Incoming files (polled)
+    <drop>/rejected/        Files that failed validation, with <name>.reason.txt
+    <scenes>/               Accepted scenes (compositor input)
+    <state>/ingest_index.jsonl  One record per accepted file
+    <state>/metrics.json        Queue depth, job latency and counters
+
+Usage:
+    python application/pipeline/ingest.py --drop-dir data/incoming --workers 2 --metrics-port 9108
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import rasterio
+from rasterio.errors import RasterioIOError
+from rasterio.transform import array_bounds
+from rasterio.warp import transform_bounds
+
+sys.path.append(str(Path(__file__).parent.parent))
+from pipeline.fuel_engine import FuelMapEngine
+from pipeline.incremental import TiledFuelMap, composite_for, fold_scenes, footprint_tiles
+from preprocessing.compositing import Scene
+from preprocessing.scene_catalog import SceneCatalog
+from utils.config import Config
+from utils.logger import setup_logger
+from utils.tiling import DEFAULT_TILE_SIZE
+
+logger = setup_logger(__name__)
+
+SCENE_SUFFIXES = ('.tif', '.tiff')
+# Quality sidecars travel with their scene but do not trigger updates
+AUXILIARY_SUFFIXES = ('_mask', '_SCL', '_QA60')
+
+DEFAULT_POLL_SECONDS = 10.0
+# A file must keep the same size and mtime this long before it is picked up
+DEFAULT_SETTLE_SECONDS = 20.0
+# A batch is flushed once no new scene arrived for this long...
+DEFAULT_DEBOUNCE_SECONDS = 60.0
+# ...or when it holds this many scenes, or its oldest scene waited this long
+DEFAULT_MAX_BATCH = 16
+DEFAULT_MAX_WAIT_SECONDS = 600.0
+DEFAULT_WORKERS = 2
+
+INDEX_FILE = 'ingest_index.jsonl'
+METRICS_FILE = 'metrics.json'
+REJECTED_DIR = 'rejected'
+
+# Recent job latencies kept for the percentiles in the metrics
+LATENCY_WINDOW = 200
+
+
+def validate_scene(path: Path, engine: FuelMapEngine) -> dict:
+    """
+    Check that a dropped file is a usable scene and describe it
+
+    Args:
+        path: Candidate GeoTIFF
+        engine: FuelMapEngine on the target grid (for the overlap check)
+
+    Returns:
+        Index record (name, date, crs, bounds, size, bands)
+
+    Raises:
+        ValueError: with the reason the file is rejected
+    """
+    path = Path(path)
+    auxiliary = path.stem.endswith(AUXILIARY_SUFFIXES)
+    acquired = None
+    if not auxiliary:
+        acquired = Scene.from_path(path).date.isoformat()
+
+    try:
+        with rasterio.open(path) as src:
+            if src.driver != 'GTiff':
+                raise ValueError(f"not a GeoTIFF (driver {src.driver})")
+            if src.crs is None:
+                raise ValueError("no CRS")
+            if src.count == 0 or src.width == 0 or src.height == 0:
+                raise ValueError("empty raster")
+
+            # Reading the last block catches truncated downloads
+            block_row, block_col = (src.height - 1) // src.block_shapes[0][0], \
+                (src.width - 1) // src.block_shapes[0][1]
+            src.read(1, window=src.block_window(1, block_row, block_col))
+
+            bounds = transform_bounds(src.crs, engine.crs, *src.bounds)
+            record = {
+                'name': path.name,
+                'date': acquired,
+                'auxiliary': auxiliary,
+                'crs': src.crs.to_string(),
+                'bounds': list(src.bounds),
+                'width': src.width,
+                'height': src.height,
+                'bands': list(src.descriptions),
+                'bytes': path.stat().st_size
+            }
+    except RasterioIOError as e:
+        raise ValueError(f"unreadable: {e}") from e
+
+    west, south, east, north = array_bounds(engine.height, engine.width, engine.transform)
+    if bounds[2] <= west or bounds[0] >= east or bounds[3] <= south or bounds[1] >= north:
+        raise ValueError("does not overlap the fuel map grid")
+    return record
+
+
+class Metrics:
+    """Thread-safe counters, gauges and job latencies of the service"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {'scenes_ingested': 0, 'scenes_rejected': 0,
+                         'jobs_completed': 0, 'jobs_failed': 0, 'tiles_recomputed': 0}
+        self.gauges = {'pending_scenes': 0, 'jobs_queued': 0, 'jobs_running': 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.started = time.time()
+
+    def inc(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def set(self, name: str, value: int):
+        with self._lock:
+            self.gauges[name] = value
+
+    def add(self, name: str, value: int):
+        with self._lock:
+            self.gauges[name] += value
+
+    def observe_latency(self, seconds: float):
+        """Record one job's latency (first arrival in the batch -> update done)"""
+        with self._lock:
+            self.latencies.append(seconds)
+            self.latency_sum += seconds
+            self.latency_count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            recent = sorted(self.latencies)
+            gauges = dict(self.gauges)
+            snapshot = {
+                'uptime_seconds': time.time() - self.started,
+                'queue_depth': gauges['pending_scenes'] + gauges['jobs_queued'],
+                **gauges,
+                **self.counters,
+                'job_latency_seconds': {
+                    'count': self.latency_count,
+                    'sum': self.latency_sum,
+                    'p50': recent[len(recent) // 2] if recent else None,
+                    'p95': recent[min(int(len(recent) * 0.95), len(recent) - 1)] if recent else None,
+                    'max': recent[-1] if recent else None
+                }
+            }
+        return snapshot
+
+    def prometheus(self) -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        for name in ['queue_depth', 'pending_scenes', 'jobs_queued', 'jobs_running']:
+            lines += [f"# TYPE fuelmap_ingest_{name} gauge", f"fuelmap_ingest_{name} {snapshot[name]}"]
+        for name in self.counters:
+            lines += [f"# TYPE fuelmap_ingest_{name}_total counter",
+                      f"fuelmap_ingest_{name}_total {snapshot[name]}"]
+        latency = snapshot['job_latency_seconds']
+        lines.append("# TYPE fuelmap_ingest_job_latency_seconds summary")
+        for quantile in ('p50', 'p95'):
+            if latency[quantile] is not None:
+                lines.append(f'fuelmap_ingest_job_latency_seconds{{quantile="0.{quantile[1:]}"}} '
+                             f'{latency[quantile]:.3f}')
+        lines += [f"fuelmap_ingest_job_latency_seconds_sum {latency['sum']:.3f}",
+                  f"fuelmap_ingest_job_latency_seconds_count {latency['count']}"]
+        return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(metrics: Metrics, port: int) -> ThreadingHTTPServer:
+    """Serve /metrics (Prometheus) and /metrics.json from a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = metrics.prometheus(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(metrics.snapshot()), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            payload = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"  Metrics on http://localhost:{port}/metrics")
+    return server
+
+
+class IngestService:
+    """Polls a drop directory and turns new scenes into batched incremental updates"""
+
+    def __init__(self, fuel_map: TiledFuelMap, drop_dir: Path, scene_dir: Path, state_dir: Path,
+                 workers: int = DEFAULT_WORKERS, settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+                 debounce_seconds: float = DEFAULT_DEBOUNCE_SECONDS,
+                 max_batch: int = DEFAULT_MAX_BATCH,
+                 max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS, catalog=None):
+        """
+        Args:
+            fuel_map: Incremental fuel map to keep up to date
+            drop_dir: Directory watched for new GeoTIFFs
+            scene_dir: Where accepted scenes are moved
+            state_dir: Index and metrics location
+            workers: Maximum concurrent update jobs
+            settle_seconds: Quiet time before a file counts as fully written
+            debounce_seconds: Quiet time before a batch of arrivals is flushed
+            max_batch: Flush a batch once it holds this many scenes
+            max_wait_seconds: Flush a batch once its oldest scene waited this long
+            catalog: Optional SceneCatalog that accepted scenes are added to
+        """
+        self.fuel_map = fuel_map
+        self.drop_dir = Path(drop_dir)
+        self.scene_dir = Path(scene_dir)
+        self.state_dir = Path(state_dir)
+        self.settle_seconds = settle_seconds
+        self.debounce_seconds = debounce_seconds
+        self.max_batch = max_batch
+        self.max_wait_seconds = max_wait_seconds
+        self.catalog = catalog
+
+        for directory in (self.drop_dir, self.drop_dir / REJECTED_DIR, self.scene_dir, self.state_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        self.metrics = Metrics()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest')
+        # Jobs write the same rasters and statistics; footprints run in parallel,
+        # the in-place update itself is serialised
+        self._update_lock = threading.Lock()
+        self._seen = {}          # path -> (size, mtime, first seen with that signature)
+        self._batch = []         # (scene path, arrival time)
+        self._futures = set()
+        self._stop = threading.Event()
+
+    # --- watching ------------------------------------------------------
+
+    def _settled_files(self, now: float) -> list:
+        """Drop-directory files whose size and mtime have not changed for settle_seconds"""
+        settled, present = [], set()
+        for path in sorted(self.drop_dir.iterdir()):
+            if not path.is_file() or path.suffix.lower() not in SCENE_SUFFIXES:
+                continue
+            present.add(path)
+            stat = path.stat()
+            signature = (stat.st_size, stat.st_mtime)
+            previous = self._seen.get(path)
+            if previous is None or previous[:2] != signature:
+                self._seen[path] = signature + (now,)
+            elif now - previous[2] >= self.settle_seconds:
+                settled.append(path)
+        for path in set(self._seen) - present:
+            del self._seen[path]
+        return settled
+
+    def _reject(self, path: Path, reason: str):
+        target = self.drop_dir / REJECTED_DIR / path.name
+        shutil.move(str(path), target)
+        target.with_name(target.name + '.reason.txt').write_text(reason + '\n')
+        self.metrics.inc('scenes_rejected')
+        logger.warning(f"  ⚠ Rejected {path.name}: {reason}")
+
+    def _accept(self, path: Path, record: dict) -> Path:
+        target = self.scene_dir / path.name
+        tmp_target = target.with_name(target.name + '.partial')
+        shutil.move(str(path), tmp_target)
+        os.replace(tmp_target, target)
+
+        record['path'] = str(target)
+        record['ingested_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        with open(self.state_dir / INDEX_FILE, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        if self.catalog is not None and not record['auxiliary']:
+            self.catalog.add_paths([target])
+        self.metrics.inc('scenes_ingested')
+        logger.info(f"  ✓ Ingested {path.name}")
+        return target
+
+    def ingest(self, path: Path, now: float):
+        """Validate one settled file and queue it (or reject it)"""
+        self._seen.pop(path, None)
+        try:
+            record = validate_scene(path, self.fuel_map.engine)
+        except ValueError as e:
+            self._reject(path, str(e))
+            return
+
+        target = self._accept(path, record)
+        if not record['auxiliary']:
+            self._batch.append((target, now))
+
+    # --- batching and jobs ---------------------------------------------
+
+    def _batch_due(self, now: float) -> bool:
+        if not self._batch:
+            return False
+        first, last = self._batch[0][1], self._batch[-1][1]
+        return (now - last >= self.debounce_seconds or len(self._batch) >= self.max_batch
+                or now - first >= self.max_wait_seconds)
+
+    def flush(self):
+        """Submit the pending batch as one update job"""
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        self.metrics.add('jobs_queued', 1)
+        future = self.pool.submit(self._run_job, [path for path, _ in batch], batch[0][1])
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+
+    def _run_job(self, scene_paths: list, first_arrival: float):
+        self.metrics.add('jobs_queued', -1)
+        self.metrics.add('jobs_running', 1)
+        try:
+            engine = self.fuel_map.engine
+            tiles, composited = {}, []
+            for path in scene_paths:
+                try:
+                    composite_for(engine.config, Scene.from_path(path).date)
+                except ValueError as e:
+                    logger.warning(f"  ⚠ {path.name}: {e}, not composited")
+                    continue
+                composited.append(path)
+                for tile in footprint_tiles(path, engine, self.fuel_map.tile_size):
+                    tiles[(tile.row_off, tile.col_off)] = tile
+            tiles = [tiles[key] for key in sorted(tiles)]
+            with self._update_lock:
+                if composited:
+                    fold_scenes(engine, tiles, composited, self.scene_dir)
+                n = self.fuel_map.update(tiles)
+            self.metrics.inc('jobs_completed')
+            self.metrics.inc('tiles_recomputed', n)
+            latency = time.time() - first_arrival
+            self.metrics.observe_latency(latency)
+            logger.info(f"  ✓ Updated {n} tiles for {len(scene_paths)} scene(s) ({latency:.0f}s after arrival)")
+        except Exception:
+            self.metrics.inc('jobs_failed')
+            logger.exception(f"  ⚠ Update failed for {', '.join(path.name for path in scene_paths)}")
+        finally:
+            self.metrics.add('jobs_running', -1)
+
+    # --- main loop -----------------------------------------------------
+
+    def _write_metrics(self):
+        tmp_path = self.state_dir / (METRICS_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.metrics.snapshot(), f, indent=2)
+        os.replace(tmp_path, self.state_dir / METRICS_FILE)
+
+    def poll(self, now: float = None):
+        """One pass: pick up settled files, flush a due batch, publish metrics"""
+        now = time.time() if now is None else now
+        for path in self._settled_files(now):
+            self.ingest(path, now)
+        if self._batch_due(now):
+            self.flush()
+        self.metrics.set('pending_scenes', len(self._batch))
+        self._write_metrics()
+
+    def run(self, poll_seconds: float = DEFAULT_POLL_SECONDS):
+        """Poll until stop() (or SIGINT / SIGTERM), then drain pending work"""
+        logger.info(f"Watching {self.drop_dir} (every {poll_seconds:g}s)")
+        while not self._stop.is_set():
+            self.poll()
+            self._stop.wait(poll_seconds)
+        self.close()
+
+    def drain(self):
+        """Flush the pending batch and wait for all jobs"""
+        self.flush()
+        self.metrics.set('pending_scenes', 0)
+        while self._futures:
+            next(iter(self._futures)).result()
+        self._write_metrics()
+
+    def stop(self, *args):
+        self._stop.set()
+
+    def close(self):
+        self.drain()
+        self.pool.shutdown(wait=True)
+
+
+def main(argv=None):
+    """Run the ingestion service"""
+    parser = argparse.ArgumentParser(description='Watch a drop directory and update the fuel map')
+    parser.add_argument('--config', type=Path, help='YAML/JSON config (default: FUELMAP_* env vars)')
+    parser.add_argument('--drop-dir', type=Path, help='Directory to watch (default: <data>/incoming)')
+    parser.add_argument('--scene-dir', type=Path,
+                        help='Where accepted scenes go (default: <data>/satellite/scenes)')
+    parser.add_argument('--output', type=Path, help='Incremental fuel map (default: <outputs>/incremental)')
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent update jobs')
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL_SECONDS, help='Polling interval (s)')
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help='Seconds a file must stay unchanged before it is ingested')
+    parser.add_argument('--debounce', type=float, default=DEFAULT_DEBOUNCE_SECONDS,
+                        help='Seconds without arrivals before a batch is processed')
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument('--catalog', type=Path, help='Also add accepted scenes to this scene catalog')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port')
+    parser.add_argument('--once', action='store_true',
+                        help='Ingest what is in the drop directory now, run the update and exit')
+    args = parser.parse_args(argv)
+
+    config = Config.from_file(args.config) if args.config else Config.from_env()
+    engine = FuelMapEngine(config, block_size=args.tile_size)
+    output_dir = args.output or config.OUTPUTS_DIR / 'incremental'
+    fuel_map = TiledFuelMap(engine, output_dir, args.tile_size)
+    if not fuel_map.exists:
+        logger.info(f"No complete fuel map in {output_dir}, computing every tile first")
+        fuel_map.rebuild()
+
+    service = IngestService(
+        fuel_map,
+        drop_dir=args.drop_dir or config.DATA_DIR / 'incoming',
+        scene_dir=args.scene_dir or config.DATA_DIR / 'satellite' / 'scenes',
+        state_dir=output_dir / 'ingest',
+        workers=args.workers,
+        settle_seconds=0 if args.once else args.settle,
+        debounce_seconds=args.debounce,
+        max_batch=args.max_batch,
+        catalog=SceneCatalog(args.catalog) if args.catalog else None
+    )
+
+    if args.once:
+        service.poll()
+        service.poll()      # second pass: files seen once are now settled
+        service.close()
+        return
+
+    if args.metrics_port:
+        serve_metrics(service.metrics, args.metrics_port)
+    signal.signal(signal.SIGTERM, service.stop)
+    signal.signal(signal.SIGINT, service.stop)
+    service.run(args.poll)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Shard Work Queue
+A SQLite-backed job queue that lets worker processes on any number of
+hosts claim shards from a shared run directory. Claims are leases: a
+worker that dies stops renewing its lease and the shard is handed to
+another worker once the lease expires.
+
+SQLite locking requires a filesystem with working POSIX locks (local
+disk, most SMB/Lustre/GPFS mounts, NFSv4); avoid NFSv3 without lockd.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+# Seconds a claim stays valid without a heartbeat
+DEFAULT_LEASE_SECONDS = 600
+# Claims per shard before it is marked failed for good
+DEFAULT_MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    shard_id    INTEGER PRIMARY KEY,
+    spec        TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    worker      TEXT,
+    lease_until REAL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    updated     REAL
+);
+CREATE INDEX IF NOT EXISTS shards_status ON shards (status, lease_until);
+"""
+
+
+def worker_name() -> str:
+    """Identifier of this worker process (host:pid)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ShardQueue:
+    """Queue of shard jobs stored in one SQLite file"""
+
+    def __init__(self, path: Path, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # isolation_level=None: transactions are opened explicitly below
+        self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def enqueue(self, specs) -> int:
+        """
+        Add shard jobs (dicts with an integer 'shard_id'); existing ids are kept
+
+        Returns:
+            Number of new jobs
+        """
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            added = 0
+            for spec in specs:
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO shards (shard_id, spec, updated) VALUES (?, ?, ?)",
+                    (spec['shard_id'], json.dumps(spec), now))
+                added += cursor.rowcount
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        return added
+
+    def claim(self, worker: str = None):
+        """
+        Lease the next pending (or abandoned) shard
+
+        Returns:
+            (shard_id, spec dict), or None when nothing is claimable
+        """
+        worker = worker or worker_name()
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can
+        # never select the same row
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute(
+                "UPDATE shards SET status = 'failed', error = 'lease expired', updated = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts))
+            row = self._db.execute(
+                "SELECT shard_id, spec FROM shards "
+                "WHERE (status = 'pending' OR (status = 'running' AND lease_until < ?)) "
+                "AND attempts < ? ORDER BY shard_id LIMIT 1",
+                (now, self.max_attempts)).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE shards SET status = 'running', worker = ?, lease_until = ?, "
+                    "attempts = attempts + 1, updated = ? WHERE shard_id = ?",
+                    (worker, now + self.lease_seconds, now, row[0]))
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def heartbeat(self, shard_id: int, worker: str = None) -> bool:
+        """
+        Renew a lease
+
+        Returns:
+            False if the shard was reassigned (the caller should stop)
+        """
+        worker = worker or worker_name()
+        now = time.time()
+        cursor = self._db.execute(
+            "UPDATE shards SET lease_until = ?, updated = ? "
+            "WHERE shard_id = ? AND worker = ? AND status = 'running'",
+            (now + self.lease_seconds, now, shard_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, shard_id: int, worker: str = None):
+        """Mark a shard done"""
+        self._db.execute(
+            "UPDATE shards SET status = 'done', lease_until = NULL, error = NULL, updated = ? "
+            "WHERE shard_id = ? AND worker = ?",
+            (time.time(), shard_id, worker or worker_name()))
+
+    def fail(self, shard_id: int, error: str, worker: str = None):
+        """Release a shard after an error (retried until max_attempts)"""
+        self._db.execute(
+            "UPDATE shards SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+            "lease_until = NULL, error = ?, updated = ? WHERE shard_id = ? AND worker = ?",
+            (self.max_attempts, error, time.time(), shard_id, worker or worker_name()))
+
+    def counts(self) -> dict:
+        """Number of shards per status"""
+        rows = self._db.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall()
+        return dict(rows)
+
+    def unfinished(self) -> int:
+        """Shards that may still be claimed or are being worked on"""
+        return self._db.execute(
+            "SELECT COUNT(*) FROM shards WHERE status IN ('pending', 'running')").fetchone()[0]
+
+    def specs(self) -> list:
+        """Spec dicts of all shards, in shard_id order"""
+        rows = self._db.execute("SELECT spec FROM shards ORDER BY shard_id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def failures(self) -> list:
+        """(shard_id, error) of shards that exhausted their attempts"""
+        return self._db.execute(
+            "SELECT shard_id, error FROM shards WHERE status = 'failed' ORDER BY shard_id").fetchall()
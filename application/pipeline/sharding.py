@@ -0,0 +1,369 @@
+"""
+Sharded Fuel Mapping for Large AOIs
+Splits the LANDFIRE target grid into shards, queues them in a SQLite work
+queue inside a shared run directory, lets any number of worker processes
+(on this or other hosts) run stages 01 -> 03 per shard, and mosaics the
+shard rasters into a VRT and a Cloud-Optimized GeoTIFF.
+
+Run directory layout:
+    run.json        Config (as FUELMAP_* variables) and shard settings
+    queue.sqlite    Shard work queue
+    shards/         One GeoTIFF per shard, plus its block checkpoint
+    fuel_map.vrt    Mosaic of all shards
+    fuel_map.tif    COG copy of the mosaic
+
+Usage:
+    python application/pipeline/sharding.py plan --run-dir RUN [--config CFG]
+    python application/pipeline/sharding.py work --run-dir RUN     # on every host
+    python application/pipeline/sharding.py mosaic --run-dir RUN
+    python application/pipeline/sharding.py run --run-dir RUN --workers 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+
+sys.path.append(str(Path(__file__).parent.parent))
+from pipeline.fuel_engine import FuelMapEngine, OUTPUT_LAYERS, DEFAULT_OVERLAP
+from pipeline.shard_queue import ShardQueue, worker_name
+from utils.checkpoint import CheckpointedRaster
+from utils.config import Config
+from utils.logger import setup_logger
+from utils.tiling import Tile, iter_tiles, DEFAULT_TILE_SIZE
+
+logger = setup_logger(__name__)
+
+# Shard edge in target (LANDFIRE) pixels; each shard is processed in
+# DEFAULT_TILE_SIZE blocks, so memory per worker does not depend on it
+DEFAULT_SHARD_SIZE = 4096
+
+RUN_FILE = 'run.json'
+QUEUE_FILE = 'queue.sqlite'
+SHARD_DIR = 'shards'
+MOSAIC_VRT = 'fuel_map.vrt'
+MOSAIC_COG = 'fuel_map.tif'
+
+
+def shard_path(run_dir: Path, shard_id: int) -> Path:
+    return Path(run_dir) / SHARD_DIR / f"shard_{shard_id:05d}.tif"
+
+
+def reset_run(run_dir: Path):
+    """Delete the queue, shard rasters (with checkpoints) and mosaic of a run directory"""
+    run_dir = Path(run_dir)
+    for name in (QUEUE_FILE, MOSAIC_VRT, MOSAIC_COG):
+        (run_dir / name).unlink(missing_ok=True)
+    shard_dir = run_dir / SHARD_DIR
+    if shard_dir.exists():
+        for path in shard_dir.iterdir():
+            path.unlink()
+    logger.info(f"  Cleared the queue and shards of {run_dir}")
+
+
+def plan_run(config: Config, run_dir: Path, shard_size: int = DEFAULT_SHARD_SIZE,
+             tile_size: int = DEFAULT_TILE_SIZE, overlap: int = DEFAULT_OVERLAP,
+             use_aoi: bool = True, reset: bool = False) -> int:
+    """
+    Partition the target grid into shards and enqueue them
+
+    Shards own non-overlapping blocks of the grid; each reads `overlap`
+    pixels of context beyond its edges, so the mosaic is seamless without
+    blending. Shards outside the AOI polygon are not queued (the mosaic
+    reads them as nodata). Re-planning an existing run directory with the
+    same settings keeps finished shards; with different settings the shard
+    ids would describe other extents, so it is refused unless reset clears
+    the run first.
+
+    Args:
+        config: Fire / AOI configuration (input paths must be valid on every worker host)
+        run_dir: Shared run directory
+        shard_size: Shard edge length in target pixels
+        tile_size: Block size used inside a shard
+        overlap: Context pixels read around each block
+        use_aoi: Skip shards and blocks outside config.FIRE_AOI_PATH
+        reset: Clear the queue and shards of a run planned with other settings
+
+    Returns:
+        Number of shards in the run
+
+    Raises:
+        ValueError: The run directory was planned with other settings (and not reset)
+    """
+    run_dir = config.ensure_dir(run_dir)
+    engine = FuelMapEngine(config, overlap=overlap, block_size=tile_size, use_aoi=use_aoi)
+
+    settings = {
+        'config': config.to_env(),
+        'height': engine.height,
+        'width': engine.width,
+        'crs': engine.crs.to_wkt(),
+        'geotransform': engine.transform.to_gdal(),
+        'shard_size': shard_size,
+        'tile_size': tile_size,
+        'overlap': overlap,
+        'use_aoi': use_aoi,
+        'layers': OUTPUT_LAYERS
+    }
+    settings = json.loads(json.dumps(settings))
+    run_path = run_dir / RUN_FILE
+    if run_path.exists():
+        with open(run_path) as f:
+            previous = json.load(f)
+        changed = sorted(key for key in set(settings) | set(previous)
+                         if settings.get(key) != previous.get(key))
+        if changed and not reset:
+            raise ValueError(f"{run_dir} was planned with other {', '.join(changed)}; "
+                             f"finished shards would not match the new partition "
+                             f"(re-plan with --reset to start over)")
+        if changed:
+            reset_run(run_dir)
+    with open(run_path, 'w') as f:
+        json.dump(settings, f, indent=2)
+
+    shards = list(iter_tiles(engine.height, engine.width, shard_size))
+    specs = [{'shard_id': shard_id, 'row_off': shard.row_off, 'col_off': shard.col_off,
+              'height': shard.height, 'width': shard.width}
+             for shard_id, shard in enumerate(shards) if engine.intersects(shard)]
+    with ShardQueue(run_dir / QUEUE_FILE) as queue:
+        added = queue.enqueue(specs)
+
+    logger.info(f"✓ Planned {len(specs)} of {len(shards)} shards ({added} new) over a "
+                f"{engine.width} x {engine.height} grid in {run_dir}")
+    return len(specs)
+
+
+def load_run(run_dir: Path):
+    """(Config, settings dict) of a planned run directory"""
+    with open(Path(run_dir) / RUN_FILE) as f:
+        settings = json.load(f)
+    return Config.from_env(settings['config']), settings
+
+
+def process_shard(engine: FuelMapEngine, shard: Tile, tile_size: int, out_path: Path,
+                  heartbeat=None) -> bool:
+    """
+    Compute one shard block by block into a multi-band GeoTIFF
+
+    Finished blocks are checkpointed next to the shard raster, so a shard
+    re-claimed after a crash or preemption only computes the blocks that
+    are missing or fail their checksum.
+
+    Args:
+        engine: Open FuelMapEngine
+        shard: Shard extent on the target grid
+        tile_size: Block size
+        out_path: Shard GeoTIFF path
+        heartbeat: Optional callable run after each block; returning False aborts
+
+    Returns:
+        True if the shard is complete, False if aborted
+    """
+    signature = {
+        'config': engine.config.to_env(),
+        'shard': [shard.row_off, shard.col_off, shard.height, shard.width],
+        'tile_size': tile_size,
+        'overlap': engine.overlap,
+        'use_aoi': engine.coverage is not None,
+        'layers': OUTPUT_LAYERS
+    }
+    blocks = iter_tiles(shard.height, shard.width, tile_size)
+
+    with CheckpointedRaster(out_path, engine.output_profile(shard), signature,
+                            descriptions=OUTPUT_LAYERS) as out:
+        for block in out.pending(blocks):
+            grid_block = Tile(shard.row_off + block.row_off, shard.col_off + block.col_off,
+                              block.height, block.width)
+            layers = engine.compute(grid_block)
+            out.write(block, np.stack([layers[name] for name in OUTPUT_LAYERS]))
+            if heartbeat is not None and not heartbeat():
+                return False
+        if out.resumed:
+            logger.info(f"  ↺ resumed {out.resumed} verified blocks from {out.checkpoint_path.name}")
+    return True
+
+
+def work(run_dir: Path, wait: bool = False, poll_seconds: float = 10.0) -> int:
+    """
+    Claim and process shards until the queue is drained
+
+    Args:
+        run_dir: Shared run directory
+        wait: Keep polling while other workers still hold shards, to pick up
+            shards whose worker died (lease expiry); otherwise exit as soon
+            as nothing is claimable
+        poll_seconds: Polling interval when waiting
+
+    Returns:
+        Number of shards this worker completed
+    """
+    run_dir = Path(run_dir)
+    config, settings = load_run(run_dir)
+    me = worker_name()
+    done = 0
+
+    with ShardQueue(run_dir / QUEUE_FILE) as queue, \
+            FuelMapEngine(config, overlap=settings['overlap'], block_size=settings['tile_size'],
+                          use_aoi=settings.get('use_aoi', True)) as engine:
+        while True:
+            claimed = queue.claim(me)
+            if claimed is None:
+                if wait and queue.unfinished():
+                    time.sleep(poll_seconds)
+                    continue
+                break
+
+            shard_id, spec = claimed
+            shard = Tile(spec['row_off'], spec['col_off'], spec['height'], spec['width'])
+            start = time.time()
+            try:
+                written = process_shard(engine, shard, settings['tile_size'],
+                                        shard_path(run_dir, shard_id),
+                                        heartbeat=lambda: queue.heartbeat(shard_id, me))
+            except Exception:
+                queue.fail(shard_id, traceback.format_exc(limit=5), me)
+                logger.warning(f"  ⚠ [{me}] shard {shard_id} failed")
+                continue
+
+            if written:
+                queue.complete(shard_id, me)
+                done += 1
+                logger.info(f"  ✓ [{me}] shard {shard_id} ({shard.width} x {shard.height}) "
+                            f"in {time.time() - start:.1f}s")
+            else:
+                logger.warning(f"  ⚠ [{me}] lost lease on shard {shard_id}, skipping")
+
+    logger.info(f"Worker {me} finished {done} shards")
+    return done
+
+
+def write_vrt(run_dir: Path, settings: dict, shard_specs, vrt_path: Path):
+    """Write a VRT that places every shard GeoTIFF at its grid offset"""
+    geotransform = ', '.join(repr(float(value)) for value in settings['geotransform'])
+    lines = [f'<VRTDataset rasterXSize="{settings["width"]}" rasterYSize="{settings["height"]}">',
+             f'  <SRS>{escape(settings["crs"])}</SRS>',
+             f'  <GeoTransform>{geotransform}</GeoTransform>']
+    for band, name in enumerate(settings['layers'], start=1):
+        lines += [f'  <VRTRasterBand dataType="Float32" band="{band}">',
+                  f'    <Description>{escape(name)}</Description>',
+                  '    <NoDataValue>nan</NoDataValue>']
+        # Shards outside the AOI have no source and read as nodata
+        for spec in shard_specs:
+            source = shard_path(run_dir, spec['shard_id']).relative_to(vrt_path.parent)
+            size = f'xSize="{spec["width"]}" ySize="{spec["height"]}"'
+            lines += ['    <SimpleSource>',
+                      f'      <SourceFilename relativeToVRT="1">{escape(source.as_posix())}</SourceFilename>',
+                      f'      <SourceBand>{band}</SourceBand>',
+                      f'      <SrcRect xOff="0" yOff="0" {size}/>',
+                      f'      <DstRect xOff="{spec["col_off"]}" yOff="{spec["row_off"]}" {size}/>',
+                      '    </SimpleSource>']
+        lines.append('  </VRTRasterBand>')
+    lines.append('</VRTDataset>')
+
+    with open(vrt_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def mosaic(run_dir: Path, cog: bool = True) -> Path:
+    """
+    Mosaic finished shards into fuel_map.vrt (and fuel_map.tif as a COG)
+
+    Raises:
+        RuntimeError: If shards are still pending, running or failed
+    """
+    run_dir = Path(run_dir)
+    _, settings = load_run(run_dir)
+
+    with ShardQueue(run_dir / QUEUE_FILE) as queue:
+        counts = queue.counts()
+        if set(counts) - {'done'}:
+            raise RuntimeError(f"Cannot mosaic, shards not finished: {counts}")
+        specs = queue.specs()
+
+    vrt_path = run_dir / MOSAIC_VRT
+    write_vrt(run_dir, settings, specs, vrt_path)
+    logger.info(f"✓ Mosaic VRT: {vrt_path}")
+
+    if not cog:
+        return vrt_path
+
+    cog_path = run_dir / MOSAIC_COG
+    rasterio.shutil.copy(vrt_path, cog_path, driver='COG', compress='DEFLATE',
+                         predictor='YES', blocksize=512, overviews='AUTO',
+                         overview_resampling='AVERAGE', bigtiff='IF_SAFER')
+    logger.info(f"✓ Mosaic COG: {cog_path}")
+    return cog_path
+
+
+def run_local(config: Config, run_dir: Path, workers: int = None, **plan_kwargs) -> Path:
+    """
+    Plan, process with several local worker processes, and mosaic
+
+    Workers are separate `work` processes, exactly as they would be started
+    on other hosts against a shared run directory.
+    """
+    run_dir = Path(run_dir)
+    n_shards = plan_run(config, run_dir, **plan_kwargs)
+    workers = max(1, min(workers or os.cpu_count() or 1, n_shards))
+
+    logger.info(f"Starting {workers} local workers")
+    command = [sys.executable, str(Path(__file__).resolve()), 'work', '--run-dir', str(run_dir)]
+    processes = [subprocess.Popen(command) for _ in range(workers)]
+    codes = [process.wait() for process in processes]
+    if any(codes):
+        logger.warning(f"  ⚠ Worker exit codes: {codes}")
+
+    with ShardQueue(run_dir / QUEUE_FILE) as queue:
+        for shard_id, error in queue.failures():
+            logger.error(f"Shard {shard_id} failed:\n{error}")
+    return mosaic(run_dir)
+
+
+def main(argv=None):
+    """Command-line entry point (plan / work / mosaic / run)"""
+    parser = argparse.ArgumentParser(description='Sharded fuel mapping over a large AOI')
+    parser.add_argument('command', choices=['plan', 'work', 'mosaic', 'run'])
+    parser.add_argument('--run-dir', required=True, type=Path, help='Shared run directory')
+    parser.add_argument('--config', type=Path,
+                        help='YAML/JSON config for plan/run (default: FUELMAP_* env vars)')
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument('--overlap', type=int, default=DEFAULT_OVERLAP)
+    parser.add_argument('--no-aoi', action='store_true',
+                        help='plan/run: process the full rectangle instead of the AOI polygon')
+    parser.add_argument('--workers', type=int, default=None, help='Local worker processes for run')
+    parser.add_argument('--wait', action='store_true',
+                        help='work: keep polling for shards abandoned by dead workers')
+    parser.add_argument('--no-cog', action='store_true', help='mosaic: write only the VRT')
+    parser.add_argument('--reset', action='store_true',
+                        help='plan/run: discard the queue and shards of a run planned with other settings')
+    args = parser.parse_args(argv)
+
+    if args.command in ('plan', 'run'):
+        config = Config.from_file(args.config) if args.config else Config.from_env()
+        plan_kwargs = dict(shard_size=args.shard_size, tile_size=args.tile_size,
+                           overlap=args.overlap, use_aoi=not args.no_aoi, reset=args.reset)
+        try:
+            if args.command == 'plan':
+                plan_run(config, args.run_dir, **plan_kwargs)
+            else:
+                run_local(config, args.run_dir, workers=args.workers, **plan_kwargs)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.command == 'work':
+        work(args.run_dir, wait=args.wait)
+    else:
+        mosaic(args.run_dir, cog=not args.no_cog)
+
+
+if __name__ == '__main__':
+    main()
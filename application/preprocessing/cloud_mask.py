@@ -0,0 +1,292 @@
+"""
+Sentinel-2 Cloud / Shadow Masking
+Per-pixel validity from the L2A Scene Classification Layer (SCL) and the
+QA60 cloud bits, decoded with a lookup table and bitwise ops in one pass.
+Masks are kept bit-packed (8 pixels per byte) and can be dilated directly
+in packed form, so a buffer around clouds costs a few shifts per row.
+
+Usage (writes <scene>_mask.tif next to every scene for the compositor):
+    python application/preprocessing/cloud_mask.py --scenes data/satellite/scenes --dilate 3
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import rasterio
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.logger import setup_logger
+from utils.tiling import Tile, iter_tiles
+
+logger = setup_logger(__name__)
+
+# L2A Scene Classification Layer classes
+SCL_CLASSES = {
+    0: 'no_data',
+    1: 'saturated_defective',
+    2: 'dark_area_pixels',
+    3: 'cloud_shadows',
+    4: 'vegetation',
+    5: 'not_vegetated',
+    6: 'water',
+    7: 'unclassified',
+    8: 'cloud_medium_probability',
+    9: 'cloud_high_probability',
+    10: 'thin_cirrus',
+    11: 'snow'
+}
+
+# Classes treated as unusable (snow hides the fuel bed as much as cloud does)
+DEFAULT_INVALID_SCL = (0, 1, 3, 8, 9, 10, 11)
+
+# QA60 bits: 10 = opaque clouds, 11 = cirrus
+QA60_OPAQUE_BIT = 10
+QA60_CIRRUS_BIT = 11
+DEFAULT_QA60_BITS = (QA60_OPAQUE_BIT, QA60_CIRRUS_BIT)
+
+DEFAULT_DILATE_PX = 0
+
+
+def scl_lookup(invalid_classes=DEFAULT_INVALID_SCL) -> np.ndarray:
+    """256-entry boolean LUT: True for SCL values that are usable"""
+    lut = np.ones(256, dtype=bool)
+    lut[list(invalid_classes)] = False
+    return lut
+
+
+class PackedMask:
+    """
+    Boolean raster mask stored with np.packbits along rows
+
+    Padding bits past the last column are kept at zero so counts and
+    logical ops on whole bytes stay exact.
+    """
+
+    def __init__(self, bits: np.ndarray, width: int):
+        self.bits = bits
+        self.width = width
+
+    @classmethod
+    def from_bool(cls, mask: np.ndarray) -> 'PackedMask':
+        return cls(np.packbits(mask, axis=1), mask.shape[1])
+
+    def to_bool(self) -> np.ndarray:
+        return np.unpackbits(self.bits, axis=1, count=self.width).astype(bool)
+
+    @property
+    def shape(self):
+        return (self.bits.shape[0], self.width)
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def count(self) -> int:
+        """Number of True pixels"""
+        return int(np.unpackbits(self.bits).sum())
+
+    def _clear_padding(self, bits: np.ndarray) -> np.ndarray:
+        pad = self.bits.shape[1] * 8 - self.width
+        if pad:
+            bits[:, -1] &= np.uint8((0xFF << pad) & 0xFF)
+        return bits
+
+    def __and__(self, other: 'PackedMask') -> 'PackedMask':
+        return PackedMask(self.bits & other.bits, self.width)
+
+    def __or__(self, other: 'PackedMask') -> 'PackedMask':
+        return PackedMask(self.bits | other.bits, self.width)
+
+    def __invert__(self) -> 'PackedMask':
+        return PackedMask(self._clear_padding(~self.bits), self.width)
+
+    def _shift_cols(self, bits: np.ndarray, k: int) -> np.ndarray:
+        """Shift every row by k pixels (k > 0 towards higher columns), zero fill"""
+        n_bytes = bits.shape[1]
+        byte_shift, bit_shift = divmod(abs(k), 8)
+        out = np.zeros_like(bits)
+        if byte_shift >= n_bytes:
+            return out
+        if k > 0:
+            # packbits is big-endian: column c is bit 7 - c % 8 of byte c // 8
+            src = bits[:, :n_bytes - byte_shift]
+            out[:, byte_shift:] = src >> bit_shift
+            if bit_shift:
+                out[:, byte_shift + 1:] |= (src[:, :-1] << (8 - bit_shift)).astype(np.uint8)
+        else:
+            src = bits[:, byte_shift:]
+            out[:, :n_bytes - byte_shift] = (src << bit_shift).astype(np.uint8)
+            if bit_shift:
+                out[:, :n_bytes - byte_shift - 1] |= (src[:, 1:] >> (8 - bit_shift)).astype(np.uint8)
+        return out
+
+    @staticmethod
+    def _shift_rows(bits: np.ndarray, k: int) -> np.ndarray:
+        out = np.zeros_like(bits)
+        if abs(k) >= bits.shape[0]:
+            return out
+        if k > 0:
+            out[k:] = bits[:-k]
+        else:
+            out[:k] = bits[-k:]
+        return out
+
+    def dilate(self, radius: int) -> 'PackedMask':
+        """
+        Binary dilation with a (2 * radius + 1) square, on the packed bits
+
+        The square is separable into a row and a column pass; each pass
+        grows the covered radius by doubling, so it costs O(log radius)
+        shifted ORs of the packed array.
+        """
+        if radius <= 0:
+            return PackedMask(self.bits.copy(), self.width)
+
+        bits = self.bits.copy()
+        for shift in (self._shift_cols, self._shift_rows):
+            covered = 0
+            while covered < radius:
+                step = min(covered + 1, radius - covered)
+                bits = bits | shift(bits, step) | shift(bits, -step)
+                covered += step
+        return PackedMask(self._clear_padding(bits), self.width)
+
+
+class CloudMasker:
+    """Decodes SCL / QA60 into (optionally dilated) packed validity masks"""
+
+    def __init__(self, invalid_scl=DEFAULT_INVALID_SCL, qa60_bits=DEFAULT_QA60_BITS,
+                 dilate_px: int = DEFAULT_DILATE_PX):
+        """
+        Args:
+            invalid_scl: SCL classes treated as unusable
+            qa60_bits: QA60 bit positions that flag a pixel as cloudy
+            dilate_px: Buffer (pixels) grown around unusable pixels
+        """
+        self.scl_lut = scl_lookup(invalid_scl)
+        self.qa60_mask = np.uint16(sum(1 << bit for bit in qa60_bits))
+        self.dilate_px = dilate_px
+
+    def valid(self, scl: np.ndarray = None, qa60: np.ndarray = None) -> PackedMask:
+        """
+        Validity mask from SCL and/or QA60 arrays of the same shape
+
+        Returns:
+            PackedMask, True where the pixel is usable
+        """
+        if scl is None and qa60 is None:
+            raise ValueError("CloudMasker.valid needs an SCL or a QA60 array")
+
+        shape = (scl if scl is not None else qa60).shape
+        valid = np.ones(shape, dtype=bool)
+        if scl is not None:
+            valid &= self.scl_lut[scl.astype(np.uint8, copy=False)]
+        if qa60 is not None:
+            valid &= (qa60.astype(np.uint16, copy=False) & self.qa60_mask) == 0
+
+        packed = PackedMask.from_bool(valid)
+        if self.dilate_px:
+            packed = ~(~packed).dilate(self.dilate_px)
+        return packed
+
+
+def quality_bands(src) -> dict:
+    """1-based band numbers of 'SCL' and 'QA60' in a dataset, by description"""
+    descriptions = [d.upper() if d else None for d in src.descriptions]
+    return {name: descriptions.index(name) + 1 for name in ('SCL', 'QA60') if name in descriptions}
+
+
+def quality_sources(scene_path: Path) -> dict:
+    """
+    Where a scene's SCL / QA60 live: {'SCL': (path, band), 'QA60': (path, band)}
+
+    Bands with those descriptions inside the scene win; otherwise sidecar
+    files <scene>_SCL.tif / <scene>_QA60.tif (band 1) are used.
+    """
+    scene_path = Path(scene_path)
+    with rasterio.open(scene_path) as src:
+        sources = {name: (scene_path, band) for name, band in quality_bands(src).items()}
+    for name in ('SCL', 'QA60'):
+        sidecar = scene_path.with_name(f"{scene_path.stem}_{name}{scene_path.suffix}")
+        if name not in sources and sidecar.exists():
+            sources[name] = (sidecar, 1)
+    return sources
+
+
+def read_valid(masker: CloudMasker, datasets: dict, tile: Tile, height: int, width: int) -> np.ndarray:
+    """
+    Boolean validity of a tile from open SCL / QA60 datasets
+
+    Reads a halo of masker.dilate_px so the dilation is seamless across tiles.
+
+    Args:
+        masker: CloudMasker
+        datasets: {'SCL'/'QA60': (open dataset, band)}
+        tile: Tile to mask
+        height: Grid height
+        width: Grid width
+    """
+    outer, inner = tile.expand(masker.dilate_px, height, width)
+    arrays = {name.lower(): src.read(band, window=outer.window)
+              for name, (src, band) in datasets.items()}
+    return masker.valid(**arrays).to_bool()[inner]
+
+
+def write_scene_mask(scene_path: Path, masker: CloudMasker, tile_size: int = 1024) -> Path:
+    """
+    Write <scene>_mask.tif (1-bit GeoTIFF, 1 = usable) from the scene's SCL / QA60
+
+    Returns:
+        Path of the mask, or None if the scene has no SCL or QA60
+    """
+    scene_path = Path(scene_path)
+    sources = quality_sources(scene_path)
+    if not sources:
+        return None
+
+    mask_path = scene_path.with_name(f"{scene_path.stem}_mask{scene_path.suffix}")
+    with rasterio.open(scene_path) as src:
+        profile = src.profile.copy()
+    profile.update(driver='GTiff', count=1, dtype='uint8', nodata=None, nbits=1,
+                   compress='deflate', tiled=True, blockxsize=256, blockysize=256)
+
+    opened = {name: (rasterio.open(path), band) for name, (path, band) in sources.items()}
+    usable = 0
+    try:
+        with rasterio.open(mask_path, 'w', **profile) as dst:
+            for tile in iter_tiles(profile['height'], profile['width'], tile_size):
+                valid = read_valid(masker, opened, tile, profile['height'], profile['width'])
+                dst.write(valid.astype(np.uint8), 1, window=tile.window)
+                usable += int(valid.sum())
+    finally:
+        for src, _ in opened.values():
+            src.close()
+
+    total = profile['height'] * profile['width']
+    logger.info(f"  ✓ {mask_path.name}: {usable / total:.1%} usable ({', '.join(sources)})")
+    return mask_path
+
+
+def main(argv=None):
+    """Write validity masks for every scene in a directory"""
+    parser = argparse.ArgumentParser(description='Per-pixel cloud/shadow masks from SCL and QA60')
+    parser.add_argument('--scenes', required=True, type=Path, help='Directory of scene GeoTIFFs')
+    parser.add_argument('--dilate', type=int, default=DEFAULT_DILATE_PX,
+                        help='Buffer in pixels around clouds and shadows')
+    parser.add_argument('--invalid-scl', type=int, nargs='+', default=list(DEFAULT_INVALID_SCL),
+                        help='SCL classes to mask')
+    args = parser.parse_args(argv)
+
+    masker = CloudMasker(invalid_scl=args.invalid_scl, dilate_px=args.dilate)
+    suffixes = ('_mask', '_SCL', '_QA60')
+    for scene_path in sorted(args.scenes.glob('*.tif')):
+        if scene_path.stem.endswith(suffixes):
+            continue
+        if write_scene_mask(scene_path, masker) is None:
+            logger.warning(f"  ⚠ {scene_path.name}: no SCL or QA60, skipped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,484 @@
+"""
+Local Sentinel-2 Compositing
+Builds the pre/post-fire composites from a directory of co-registered
+Sentinel-2 scenes instead of Earth Engine. Scenes are stacked tile by tile
+along the time axis, masked per scene, and reduced to a nan-median or a
+best-available-pixel (BAP) composite. Output bands match what the analysis
+scripts expect: B2, B3, B4, B8, B11, B12, NDVI, NBR, NDMI (float32).
+
+update_composite() recomposites only some windows of an existing composite
+in place, so scenes that arrive later can be folded in without a rebuild.
+
+Usage:
+    python application/preprocessing/compositing.py --scenes data/satellite/scenes \\
+        --start 2020-01-01 --end 2022-04-01 \\
+        --output data/satellite/hermits_peak_prefire_2020_2022.tif
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from scipy.ndimage import distance_transform_edt
+
+sys.path.append(str(Path(__file__).parent.parent))
+from preprocessing.cloud_mask import CloudMasker, quality_sources, read_valid
+from utils.checkpoint import CheckpointedRaster, checkpoint_path
+from utils.datacube import DataCube
+from utils.logger import setup_logger
+from utils.stats import nan_median
+from utils.tiling import Tile, iter_tiles
+
+logger = setup_logger(__name__)
+
+# Reflectance bands read from each scene, in output order
+SCENE_BANDS = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
+COMPOSITE_BANDS = SCENE_BANDS + ['NDVI', 'NBR', 'NDMI']
+
+# Normalized differences appended to the composite (same as the GEE export)
+INDEX_BANDS = {
+    'NDVI': ('B8', 'B4'),
+    'NBR': ('B8', 'B12'),
+    'NDMI': ('B8', 'B11')
+}
+
+METHODS = ['median', 'bap']
+
+# Best-available-pixel scoring: day-of-year proximity to the target date
+# and distance to the nearest masked (cloud/shadow/nodata) pixel
+BAP_DOY_WEIGHT = 0.5
+BAP_DOY_SIGMA_DAYS = 30
+BAP_DISTANCE_WEIGHT = 0.5
+BAP_DISTANCE_MAX_PX = 50
+
+DEFAULT_MEMORY_MB = 1024
+SCENE_DATE_PATTERN = re.compile(r'(20\d{2})-?(\d{2})-?(\d{2})')
+
+
+@dataclass
+class Scene:
+    """One co-registered Sentinel-2 scene on disk"""
+
+    path: Path
+    date: date
+    mask_path: Path = None
+
+    @classmethod
+    def from_path(cls, path: Path) -> 'Scene':
+        match = SCENE_DATE_PATTERN.search(path.stem)
+        if match is None:
+            raise ValueError(f"No acquisition date (YYYYMMDD) in scene name: {path.name}")
+        mask_path = path.with_name(f"{path.stem}_mask{path.suffix}")
+        return cls(path, date(*map(int, match.groups())),
+                   mask_path if mask_path.exists() else None)
+
+
+def find_scenes(scene_dir: Path, start: str = None, end: str = None,
+                pattern: str = '*.tif') -> list:
+    """
+    Scenes in a directory acquired in [start, end), sorted by date
+
+    Files named <scene>_mask.tif are per-scene validity masks (non-zero =
+    usable) and <scene>_SCL.tif / <scene>_QA60.tif are quality sidecars;
+    both are paired with their scene rather than listed.
+    """
+    start = date.fromisoformat(start) if start else date.min
+    end = date.fromisoformat(end) if end else date.max
+    scenes = [Scene.from_path(path) for path in sorted(Path(scene_dir).glob(pattern))
+              if not path.stem.endswith(('_mask', '_SCL', '_QA60'))]
+    return sorted((scene for scene in scenes if start <= scene.date < end),
+                  key=lambda scene: scene.date)
+
+
+def normalized_difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """(a - b) / (a + b), NaN where undefined"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = (a - b) / (a + b)
+    return np.where(np.isfinite(result), result, np.nan).astype(np.float32)
+
+
+def tile_size_for_budget(n_scenes: int, memory_mb: float) -> int:
+    """
+    Largest square tile (multiple of 256) whose time stack fits the budget
+
+    Per pixel and scene a tile holds one float32 band, one float32 quality
+    score, one mask byte and a float32 working copy (~13 bytes).
+    """
+    pixels = memory_mb * 1024 ** 2 / (13 * max(n_scenes, 1))
+    return int(min(max(math.isqrt(int(pixels)) // 256 * 256, 256), 4096))
+
+
+class SceneCompositor:
+    """Tile-wise median / best-available-pixel compositing of co-registered scenes"""
+
+    def __init__(self, scenes, method: str = 'median', target_date: date = None,
+                 cloud_masker: CloudMasker = None):
+        """
+        Args:
+            scenes: Scene list (same grid, bands B2, B3, B4, B8, B11, B12)
+            method: 'median' or 'bap'
+            target_date: BAP target date (default: middle of the scene dates)
+            cloud_masker: Optional per-pixel masking from each scene's SCL / QA60
+        """
+        if not scenes:
+            raise ValueError("No scenes to composite")
+        if method not in METHODS:
+            raise ValueError(f"Unknown compositing method: {method} (expected one of {METHODS})")
+        self.scenes = list(scenes)
+        self.method = method
+        self.cloud_masker = cloud_masker
+        if target_date is None:
+            ordinals = [scene.date.toordinal() for scene in self.scenes]
+            target_date = date.fromordinal((min(ordinals) + max(ordinals)) // 2)
+        self.target_date = target_date
+
+        with rasterio.open(self.scenes[0].path) as src:
+            self.profile = src.profile.copy()
+            grid = (src.crs, src.transform, src.width, src.height)
+        for scene in self.scenes[1:]:
+            with rasterio.open(scene.path) as src:
+                if (src.crs, src.transform, src.width, src.height) != grid:
+                    raise ValueError(f"Scene {scene.path.name} is not on the grid of "
+                                     f"{self.scenes[0].path.name}; resample scenes first")
+        self.height = self.profile['height']
+        self.width = self.profile['width']
+        self._sources = []
+
+    def __enter__(self):
+        self._sources = [(rasterio.open(scene.path),
+                          rasterio.open(scene.mask_path) if scene.mask_path else None)
+                         for scene in self.scenes]
+        self._band_index = [self._scene_band_index(src) for src, _ in self._sources]
+        self._quality = []
+        if self.cloud_masker is not None:
+            for scene in self.scenes:
+                sources = quality_sources(scene.path)
+                if not sources:
+                    logger.warning(f"  ⚠ {scene.path.name}: no SCL or QA60, not cloud-masked")
+                self._quality.append({name: (rasterio.open(path), band)
+                                      for name, (path, band) in sources.items()})
+        return self
+
+    def __exit__(self, *exc):
+        for src, mask_src in self._sources:
+            src.close()
+            if mask_src is not None:
+                mask_src.close()
+        for datasets in self._quality:
+            for src, _ in datasets.values():
+                src.close()
+        self._sources = []
+        self._quality = []
+
+    @staticmethod
+    def _scene_band_index(src) -> dict:
+        """1-based band number of each SCENE_BANDS name (by description, else by order)"""
+        descriptions = [d.upper() if d else None for d in src.descriptions]
+        if all(band in descriptions for band in SCENE_BANDS):
+            return {band: descriptions.index(band) + 1 for band in SCENE_BANDS}
+        if src.count < len(SCENE_BANDS):
+            raise ValueError(f"{src.name}: expected bands {SCENE_BANDS}, found {src.count}")
+        return {band: i for i, band in enumerate(SCENE_BANDS, start=1)}
+
+    def output_profile(self) -> dict:
+        profile = self.profile.copy()
+        profile.update(driver='GTiff', count=len(COMPOSITE_BANDS), dtype='float32',
+                       nodata=np.nan, compress='deflate', predictor=3,
+                       tiled=True, blockxsize=256, blockysize=256)
+        return profile
+
+    def scene_valid(self, i: int, tile: Tile) -> np.ndarray:
+        """Per-scene validity of a tile: dataset mask, optional _mask.tif and SCL / QA60"""
+        src, mask_src = self._sources[i]
+        valid = src.read_masks(1, window=tile.window) > 0
+        if mask_src is not None:
+            valid &= mask_src.read(1, window=tile.window) > 0
+        if self._quality and self._quality[i]:
+            valid &= read_valid(self.cloud_masker, self._quality[i], tile, self.height, self.width)
+        return valid
+
+    def _read_band(self, band: str, tile: Tile, valid: np.ndarray) -> np.ndarray:
+        """(time, rows, cols) float32 stack of one band with invalid pixels as NaN"""
+        stack = np.empty((len(self.scenes),) + valid.shape[1:], dtype=np.float32)
+        for i, (src, _) in enumerate(self._sources):
+            stack[i] = src.read(self._band_index[i][band], window=tile.window)
+        stack[~valid] = np.nan
+        return stack
+
+    def _bap_quality(self, tile: Tile) -> np.ndarray:
+        """(time, rows, cols) BAP score; -inf where the scene is not usable"""
+        outer, inner = tile.expand(BAP_DISTANCE_MAX_PX, self.height, self.width)
+        target_doy = self.target_date.timetuple().tm_yday
+
+        quality = np.empty((len(self.scenes), tile.height, tile.width), dtype=np.float32)
+        for i, scene in enumerate(self.scenes):
+            valid = self.scene_valid(i, outer)
+            if valid.all():
+                distance = np.full(valid.shape, BAP_DISTANCE_MAX_PX, dtype=np.float32)
+            else:
+                distance = distance_transform_edt(valid).astype(np.float32)
+            distance_score = np.minimum(distance[inner], BAP_DISTANCE_MAX_PX) / BAP_DISTANCE_MAX_PX
+
+            doy_diff = abs(scene.date.timetuple().tm_yday - target_doy)
+            doy_diff = min(doy_diff, 365 - doy_diff)
+            doy_score = math.exp(-0.5 * (doy_diff / BAP_DOY_SIGMA_DAYS) ** 2)
+
+            quality[i] = BAP_DOY_WEIGHT * doy_score + BAP_DISTANCE_WEIGHT * distance_score
+            quality[i][~valid[inner]] = -np.inf
+        return quality
+
+    def composite(self, tile: Tile) -> np.ndarray:
+        """
+        Composite one tile
+
+        Returns:
+            (len(COMPOSITE_BANDS), rows, cols) float32 array, NaN where no scene is valid
+        """
+        valid = np.stack([self.scene_valid(i, tile) for i in range(len(self.scenes))])
+        out = np.empty((len(COMPOSITE_BANDS), tile.height, tile.width), dtype=np.float32)
+
+        if self.method == 'bap':
+            quality = self._bap_quality(tile)
+            best = np.argmax(quality, axis=0)[None]
+            none_valid = ~valid.any(axis=0)
+            del quality
+
+        for b, band in enumerate(SCENE_BANDS):
+            stack = self._read_band(band, tile, valid)
+            if self.method == 'median':
+                out[b] = nan_median(stack)
+            else:
+                out[b] = np.take_along_axis(stack, best, axis=0)[0]
+                out[b][none_valid] = np.nan
+            del stack
+
+        for b, (first, second) in enumerate(INDEX_BANDS.values(), start=len(SCENE_BANDS)):
+            out[b] = normalized_difference(out[SCENE_BANDS.index(first)],
+                                           out[SCENE_BANDS.index(second)])
+        return out
+
+
+def build_composite(scenes, output_path: Path, method: str = 'median',
+                    target_date: date = None, memory_mb: float = DEFAULT_MEMORY_MB,
+                    cloud_masker: CloudMasker = None) -> Path:
+    """
+    Composite scenes into a 9-band GeoTIFF, tile by tile within a memory budget
+
+    Progress is checkpointed next to the output, so an interrupted run
+    resumes where it stopped.
+
+    Args:
+        scenes: Scene list from find_scenes()
+        output_path: Composite GeoTIFF
+        method: 'median' or 'bap'
+        target_date: BAP target date
+        memory_mb: Working-memory budget that sets the tile size
+        cloud_masker: Optional per-pixel SCL / QA60 masking
+
+    Returns:
+        output_path
+    """
+    tile_size = tile_size_for_budget(len(scenes), memory_mb)
+    compositor = SceneCompositor(scenes, method=method, target_date=target_date,
+                                 cloud_masker=cloud_masker)
+    logger.info(f"Compositing {len(scenes)} scenes ({method}) into {output_path.name}: "
+                f"{compositor.width} x {compositor.height} px, {tile_size} px tiles")
+
+    signature = {
+        'scenes': [str(scene.path) for scene in compositor.scenes],
+        'masks': [str(scene.mask_path) if scene.mask_path else None for scene in compositor.scenes],
+        'method': method,
+        'target_date': compositor.target_date.isoformat(),
+        'tile_size': tile_size,
+        'cloud_mask': None if cloud_masker is None else {
+            'valid_scl': np.flatnonzero(cloud_masker.scl_lut[:16]).tolist(),
+            'qa60_mask': int(cloud_masker.qa60_mask),
+            'dilate_px': cloud_masker.dilate_px
+        }
+    }
+    tiles = iter_tiles(compositor.height, compositor.width, tile_size)
+    with compositor, CheckpointedRaster(output_path, compositor.output_profile(), signature,
+                                        descriptions=COMPOSITE_BANDS) as out:
+        for tile in out.pending(tiles):
+            out.write(tile, compositor.composite(tile))
+    # A fresh build supersedes the scene list of earlier in-place updates
+    scene_list_path(output_path).unlink(missing_ok=True)
+
+    logger.info(f"✓ Composite saved: {output_path}")
+    return output_path
+
+
+def _build_signature(output_path: Path) -> dict:
+    """Signature build_composite() recorded in the composite's checkpoint (None if absent)"""
+    try:
+        with open(checkpoint_path(output_path)) as f:
+            return json.load(f)['signature']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def composite_settings(output_path: Path) -> dict:
+    """
+    Method, BAP target date and cloud masking an existing composite was built with
+
+    Read from the signature in its build checkpoint; a composite without one
+    (e.g. an Earth Engine export) is treated as an unmasked median.
+
+    Returns:
+        SceneCompositor keyword arguments (method, target_date, cloud_masker)
+    """
+    settings = {'method': 'median', 'target_date': None, 'cloud_masker': None}
+    signature = _build_signature(output_path)
+    if signature is None:
+        return settings
+    settings['method'] = signature.get('method', 'median')
+    if signature.get('target_date'):
+        settings['target_date'] = date.fromisoformat(signature['target_date'])
+    cloud_mask = signature.get('cloud_mask')
+    if cloud_mask:
+        settings['cloud_masker'] = CloudMasker(
+            invalid_scl=[c for c in range(16) if c not in cloud_mask['valid_scl']],
+            qa60_bits=[bit for bit in range(16) if cloud_mask['qa60_mask'] >> bit & 1],
+            dilate_px=cloud_mask['dilate_px'])
+    return settings
+
+
+def scene_list_path(output_path: Path) -> Path:
+    """Sidecar listing the scenes of a composite after update_composite()"""
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.name + '.scenes.json')
+
+
+def composite_scenes(output_path: Path) -> list:
+    """
+    Scenes an existing composite is made of (None if that is not recorded)
+
+    The list written by the last update_composite() wins over the one in
+    the build checkpoint. Scenes that no longer exist on disk are left out
+    with a warning.
+    """
+    try:
+        with open(scene_list_path(output_path)) as f:
+            paths = json.load(f)['scenes']
+    except (OSError, ValueError, KeyError, TypeError):
+        signature = _build_signature(output_path)
+        if signature is None or 'scenes' not in signature:
+            return None
+        paths = signature['scenes']
+    scenes = []
+    for path in map(Path, paths):
+        if path.exists():
+            scenes.append(Scene.from_path(path))
+        else:
+            logger.warning(f"  ⚠ {path.name} of {Path(output_path).name} is missing, left out")
+    return scenes
+
+
+def update_composite(output_path: Path, scenes, windows, memory_mb: float = DEFAULT_MEMORY_MB) -> int:
+    """
+    Recomposite windows of an existing composite in place
+
+    Used when scenes arrive after the composite was built: the windows they
+    touch are composited again from the full scene list with the settings
+    the composite was built with (composite_settings()); the rest of the
+    composite is left as it is. The scene list is recorded next to the
+    composite (scene_list_path()) for the next update.
+
+    Args:
+        output_path: Composite GeoTIFF from build_composite(), on the scenes' grid
+        scenes: All scenes of the composite period, including the new ones
+        windows: Tiles of the composite grid to recomposite
+        memory_mb: Working-memory budget; larger windows are split to fit it
+
+    Returns:
+        Number of composite pixels rewritten
+
+    Raises:
+        ValueError: The composite is not on the scenes' grid or not a 9-band composite
+    """
+    compositor = SceneCompositor(scenes, **composite_settings(output_path))
+    tile_size = tile_size_for_budget(len(compositor.scenes), memory_mb)
+    n_pixels = 0
+    with compositor, rasterio.open(output_path, 'r+') as dst:
+        if (dst.crs, dst.transform, dst.width, dst.height) != \
+                (compositor.profile['crs'], compositor.profile['transform'],
+                 compositor.width, compositor.height):
+            raise ValueError(f"{output_path.name} is not on the grid of the scenes; "
+                             f"rebuild it with build_composite()")
+        if dst.count != len(COMPOSITE_BANDS):
+            raise ValueError(f"{output_path.name} has {dst.count} bands, expected {COMPOSITE_BANDS}")
+        for window in windows:
+            for part in iter_tiles(window.height, window.width, tile_size):
+                tile = Tile(window.row_off + part.row_off, window.col_off + part.col_off,
+                            part.height, part.width)
+                dst.write(compositor.composite(tile), window=tile.window)
+                n_pixels += tile.height * tile.width
+
+    tmp_path = scene_list_path(output_path).with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({'scenes': [str(scene.path) for scene in compositor.scenes]}, f, indent=2)
+    os.replace(tmp_path, scene_list_path(output_path))
+    return n_pixels
+
+
+def main(argv=None):
+    """Build a composite from the command line"""
+    parser = argparse.ArgumentParser(description='Composite local Sentinel-2 scenes')
+    parser.add_argument('--scenes', type=Path, help='Directory of scene GeoTIFFs')
+    parser.add_argument('--catalog', type=Path,
+                        help='Select scenes from a scene catalog instead of a directory')
+    parser.add_argument('--aoi', type=Path, help='With --catalog: GeoJSON AOI the scenes must intersect')
+    parser.add_argument('--max-cloud', type=float, help='With --catalog: maximum scene cloud percent')
+    parser.add_argument('--start', help='First acquisition date (YYYY-MM-DD, inclusive)')
+    parser.add_argument('--end', help='Last acquisition date (YYYY-MM-DD, exclusive)')
+    parser.add_argument('--output', required=True, type=Path, help='Output composite GeoTIFF')
+    parser.add_argument('--method', choices=METHODS, default='median')
+    parser.add_argument('--target-date', type=date.fromisoformat,
+                        help='BAP target date (default: middle of the period)')
+    parser.add_argument('--memory-mb', type=float, default=DEFAULT_MEMORY_MB,
+                        help='Working-memory budget')
+    parser.add_argument('--cloud-mask', action='store_true',
+                        help='Mask clouds/shadows per pixel from each scene\'s SCL / QA60')
+    parser.add_argument('--dilate', type=int, default=0,
+                        help='With --cloud-mask: buffer in pixels around masked pixels')
+    parser.add_argument('--cube', type=Path,
+                        help='Also append the composite to this time-series cube (created if missing)')
+    parser.add_argument('--cube-date', type=date.fromisoformat,
+                        help='Date of the composite in the cube (default: last scene date)')
+    args = parser.parse_args(argv)
+    if (args.scenes is None) == (args.catalog is None):
+        parser.error("give exactly one of --scenes or --catalog")
+
+    if args.catalog:
+        from preprocessing.scene_catalog import SceneCatalog
+        with SceneCatalog(args.catalog) as catalog:
+            scenes = catalog.scenes(aoi=args.aoi, start=args.start, end=args.end,
+                                    max_cloud=args.max_cloud)
+    else:
+        scenes = find_scenes(args.scenes, args.start, args.end)
+    if not scenes:
+        logger.error(f"No scenes found in {args.scenes or args.catalog} for {args.start} - {args.end}")
+        sys.exit(1)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    masker = CloudMasker(dilate_px=args.dilate) if args.cloud_mask else None
+    build_composite(scenes, args.output, method=args.method, target_date=args.target_date,
+                    memory_mb=args.memory_mb, cloud_masker=masker)
+
+    if args.cube:
+        cube = (DataCube(args.cube) if (args.cube / 'cube.json').exists()
+                else DataCube.create_like(args.cube, args.output, bands=COMPOSITE_BANDS))
+        when = args.cube_date or scenes[-1].date
+        t = cube.append_raster(when, args.output)
+        logger.info(f"✓ Appended {when} to cube {args.cube} (time step {t})")
+
+
+if __name__ == '__main__':
+    main()
@@ -39,6 +39,7 @@ class DataPreprocessor:
             aoi_geometry: Optional GeoDataFrame geometry for masking
         """
         logger.info(f"Processing {input_path.name}...")
+        self.config.ensure_dir(output_path.parent)
 
         with rasterio.open(input_path) as src:
             # Calculate transform for reprojection
@@ -153,13 +154,14 @@ class DataPreprocessor:
             profile = src.profile.copy()
             profile.update(dtype=dtype, nodata=np.nan if dtype == 'float32' else 255)
 
+        self.config.ensure_dir(output_path.parent)
         with rasterio.open(output_path, 'w', **profile) as dst:
             dst.write(data, 1)
 
 
-def main():
+def main(config: Config = None):
     """Run preprocessing pipeline"""
-    config = Config()
+    config = config or Config.from_env()
     preprocessor = DataPreprocessor(config)
 
     # Load AOI
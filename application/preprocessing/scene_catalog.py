@@ -0,0 +1,407 @@
+"""
+Local Scene Catalog
+STAC-like index of the scene GeoTIFFs on disk, the offline counterpart of
+the Earth Engine filterDate / filterBounds / CLOUDY_PIXEL_PERCENTAGE
+filters in scripts/download_satellite_gee.py. Each scene's footprint,
+acquisition time, cloud percentage, band layout and CRS are stored in
+SQLite; an R-tree over (lon, lat, day) answers AOI + date range queries
+without touching the rasters.
+
+Schema (catalog.sqlite):
+    scenes        id, path, datetime (ISO, UTC), cloud_percent, crs, width,
+                  height, transform (GDAL 6-tuple JSON), bands (JSON),
+                  dtype, footprint (EPSG:4326 WKB), size, mtime
+    scenes_rtree  R-tree (id, lon, lat, day) bounds; day = proleptic
+                  ordinal + fraction, rounded outwards to float32
+
+Building the catalog reads raster headers only (plus an optional STAC item
+<scene>.json next to the scene), in a thread pool.
+
+Usage:
+    python application/preprocessing/scene_catalog.py scan --catalog data/satellite/catalog.sqlite \\
+        --root data/satellite/scenes
+    python application/preprocessing/scene_catalog.py search --catalog data/satellite/catalog.sqlite \\
+        --aoi data/fire_perimeters/hermits_peak_area_of_interest.geojson \\
+        --start 2022-08-22 --end 2022-12-31 --max-cloud 20
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import shapely
+from rasterio.errors import RasterioIOError
+from rasterio.warp import transform
+
+sys.path.append(str(Path(__file__).parent.parent))
+from preprocessing.compositing import SCENE_DATE_PATTERN, Scene
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+FOOTPRINT_CRS = 'EPSG:4326'
+# Points per raster edge when projecting the extent (UTM edges curve in lon/lat)
+FOOTPRINT_EDGE_POINTS = 21
+SIDECAR_SUFFIXES = ('_mask', '_SCL', '_QA60')
+
+# Header fields that carry the acquisition time / cloud cover, in priority order
+DATETIME_TAGS = ('datetime', 'ACQUISITION_DATETIME', 'DATE_ACQUIRED')
+CLOUD_TAGS = ('eo:cloud_cover', 'CLOUDY_PIXEL_PERCENTAGE', 'CLOUD_COVER', 'cloud_percent')
+
+DEFAULT_SCAN_WORKERS = 16
+INSERT_BATCH = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    datetime TEXT NOT NULL,
+    cloud_percent REAL,
+    crs TEXT,
+    width INTEGER,
+    height INTEGER,
+    transform TEXT,
+    bands TEXT,
+    dtype TEXT,
+    footprint BLOB NOT NULL,
+    size INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS scenes_datetime ON scenes (datetime);
+CREATE VIRTUAL TABLE IF NOT EXISTS scenes_rtree USING rtree (
+    id, min_lon, max_lon, min_lat, max_lat, min_day, max_day
+);
+"""
+
+
+def _day_number(when: datetime) -> float:
+    """Proleptic ordinal day with the time of day as a fraction"""
+    seconds = when.hour * 3600 + when.minute * 60 + when.second
+    return when.toordinal() + seconds / 86400
+
+
+def _parse_datetime(value: str) -> datetime:
+    value = value.strip().replace('Z', '+00:00')
+    when = datetime.fromisoformat(value) if 'T' in value or '-' in value else \
+        datetime.strptime(value, '%Y%m%d')
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.astimezone(timezone.utc)
+
+
+def _as_datetime(value) -> datetime:
+    """Query bound (None, date, datetime or ISO string) as an aware UTC datetime"""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    return _parse_datetime(str(value))
+
+
+def extent_footprint(src) -> shapely.Polygon:
+    """Raster extent as a lon/lat polygon, densified along its edges"""
+    t = np.linspace(0, 1, FOOTPRINT_EDGE_POINTS)[:-1]
+    cols = np.concatenate([t, np.ones_like(t), 1 - t, np.zeros_like(t)]) * src.width
+    rows = np.concatenate([np.zeros_like(t), t, np.ones_like(t), 1 - t]) * src.height
+    xs, ys = src.transform * (cols, rows)
+    if src.crs != FOOTPRINT_CRS:
+        xs, ys = transform(src.crs, FOOTPRINT_CRS, xs, ys)
+    return shapely.Polygon(zip(xs, ys))
+
+
+def read_header(path: Path) -> dict:
+    """
+    Catalog record of one scene from its header (and STAC sidecar, if any)
+
+    Returns:
+        Record dict, or None if the file is not a dated, georeferenced raster
+    """
+    path = Path(path)
+    properties = {}
+    stac_path = path.with_suffix('.json')
+    if stac_path.exists():
+        try:
+            with open(stac_path) as f:
+                properties = json.load(f).get('properties', {})
+            if not isinstance(properties, dict):
+                raise ValueError("'properties' is not an object")
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"  ⚠ {stac_path.name}: malformed STAC sidecar ({e}), not catalogued")
+            return None
+
+    try:
+        with rasterio.open(path) as src:
+            if src.crs is None:
+                logger.warning(f"  ⚠ {path.name}: no CRS, not catalogued")
+                return None
+            tags = {**src.tags(), **properties}
+            footprint = extent_footprint(src)
+            record = {
+                'crs': src.crs.to_string(),
+                'width': src.width,
+                'height': src.height,
+                'transform': json.dumps(src.transform.to_gdal()),
+                'bands': json.dumps([d or f'band_{i}' for i, d in enumerate(src.descriptions, start=1)]),
+                'dtype': src.dtypes[0]
+            }
+    except RasterioIOError as e:
+        logger.warning(f"  ⚠ {path.name}: unreadable ({e}), not catalogued")
+        return None
+
+    when = next((tags[key] for key in DATETIME_TAGS if tags.get(key)), None)
+    if when is None:
+        match = SCENE_DATE_PATTERN.search(path.stem)
+        if match is None:
+            logger.warning(f"  ⚠ {path.name}: no acquisition date in tags or name, not catalogued")
+            return None
+        when = ''.join(match.groups())
+    cloud = next((tags[key] for key in CLOUD_TAGS if tags.get(key) not in (None, '')), None)
+    try:
+        when = _parse_datetime(str(when))
+        cloud = float(cloud) if cloud is not None else None
+    except (TypeError, ValueError) as e:
+        logger.warning(f"  ⚠ {path.name}: bad date or cloud cover tag ({e}), not catalogued")
+        return None
+
+    stat = path.stat()
+    record.update({
+        'path': str(path.resolve()),
+        'datetime': when.isoformat(),
+        'day': _day_number(when),
+        'cloud_percent': cloud,
+        'footprint': shapely.to_wkb(footprint),
+        'bounds': footprint.bounds,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime
+    })
+    return record
+
+
+@dataclass
+class CatalogEntry:
+    """One catalogued scene"""
+
+    path: Path
+    datetime: datetime
+    cloud_percent: float
+    crs: str
+    width: int
+    height: int
+    bands: list
+    footprint: shapely.Polygon
+
+    def to_scene(self) -> Scene:
+        """Compositor Scene (with its _mask.tif, if present)"""
+        mask_path = self.path.with_name(f"{self.path.stem}_mask{self.path.suffix}")
+        return Scene(self.path, self.datetime.date(), mask_path if mask_path.exists() else None)
+
+
+class SceneCatalog:
+    """SQLite + R-tree catalog of local scenes"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM scenes").fetchone()[0]
+
+    # --- building ------------------------------------------------------
+
+    def add(self, records):
+        """Insert or replace header records (from read_header) in one transaction"""
+        with self.conn:
+            for record in records:
+                self.conn.execute("DELETE FROM scenes_rtree WHERE id IN "
+                                  "(SELECT id FROM scenes WHERE path = ?)", (record['path'],))
+                self.conn.execute("DELETE FROM scenes WHERE path = ?", (record['path'],))
+                cursor = self.conn.execute(
+                    "INSERT INTO scenes (path, datetime, cloud_percent, crs, width, height, "
+                    "transform, bands, dtype, footprint, size, mtime) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (record['path'], record['datetime'], record['cloud_percent'], record['crs'],
+                     record['width'], record['height'], record['transform'], record['bands'],
+                     record['dtype'], record['footprint'], record['size'], record['mtime']))
+                min_lon, min_lat, max_lon, max_lat = record['bounds']
+                self.conn.execute("INSERT INTO scenes_rtree VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (cursor.lastrowid, min_lon, max_lon, min_lat, max_lat,
+                                   record['day'], record['day']))
+
+    def add_paths(self, paths, workers: int = DEFAULT_SCAN_WORKERS) -> int:
+        """Read headers of scene files in parallel and catalog them"""
+        paths = list(paths)
+        added = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for start in range(0, len(paths), INSERT_BATCH):
+                records = [r for r in pool.map(read_header, paths[start:start + INSERT_BATCH])
+                           if r is not None]
+                self.add(records)
+                added += len(records)
+        return added
+
+    def remove(self, paths):
+        with self.conn:
+            for path in paths:
+                self.conn.execute("DELETE FROM scenes_rtree WHERE id IN "
+                                  "(SELECT id FROM scenes WHERE path = ?)", (str(path),))
+                self.conn.execute("DELETE FROM scenes WHERE path = ?", (str(path),))
+
+    def scan(self, root: Path, pattern: str = '**/*.tif', workers: int = DEFAULT_SCAN_WORKERS) -> dict:
+        """
+        Bring the catalog in line with the scenes under a directory
+
+        New and modified files (size or mtime changed) are (re)read; rows of
+        files under root that no longer exist are dropped.
+
+        Returns:
+            Counts of added/updated, unchanged and removed scenes
+        """
+        root = Path(root).resolve()
+        known = {path: (size, mtime) for path, size, mtime in
+                 self.conn.execute("SELECT path, size, mtime FROM scenes WHERE path LIKE ?",
+                                   (str(root) + os.sep + '%',))}
+
+        changed, present = [], set()
+        for path in root.glob(pattern):
+            if path.stem.endswith(SIDECAR_SUFFIXES):
+                continue
+            key = str(path.resolve())
+            present.add(key)
+            stat = path.stat()
+            if known.get(key) != (stat.st_size, stat.st_mtime):
+                changed.append(path)
+
+        removed = set(known) - present
+        self.remove(removed)
+        added = self.add_paths(changed, workers)
+        return {'added': added, 'unchanged': len(present) - len(changed), 'removed': len(removed)}
+
+    # --- querying ------------------------------------------------------
+
+    def search(self, aoi=None, start=None, end=None, max_cloud: float = None,
+               crs: str = None, limit: int = None) -> list:
+        """
+        Scenes intersecting an AOI, acquired in [start, end), sorted by time
+
+        Args:
+            aoi: GeoJSON geometry / FeatureCollection (dict or file, lon/lat)
+                or a shapely geometry; None = anywhere
+            start: Earliest acquisition (date, datetime or ISO string, inclusive)
+            end: Latest acquisition (exclusive)
+            max_cloud: Keep scenes with cloud_percent below this (unknown = kept)
+            crs: Keep scenes in this CRS only
+            limit: Maximum number of results
+
+        Returns:
+            List of CatalogEntry
+        """
+        geometry = load_geometry(aoi) if aoi is not None else None
+        start = _as_datetime(start) if start is not None else None
+        end = _as_datetime(end) if end is not None else None
+
+        # R-tree coordinates are float32 rounded outwards, so the box test
+        # is a superset; exact time and footprint tests follow
+        conditions, params = [], []
+        if geometry is not None:
+            min_lon, min_lat, max_lon, max_lat = geometry.bounds
+            conditions += ["r.max_lon >= ?", "r.min_lon <= ?", "r.max_lat >= ?", "r.min_lat <= ?"]
+            params += [min_lon, max_lon, min_lat, max_lat]
+        if start is not None:
+            conditions += ["r.max_day >= ?", "s.datetime >= ?"]
+            params += [_day_number(start) - 1, start.isoformat()]
+        if end is not None:
+            conditions += ["r.min_day <= ?", "s.datetime < ?"]
+            params += [_day_number(end) + 1, end.isoformat()]
+        if max_cloud is not None:
+            conditions.append("(s.cloud_percent IS NULL OR s.cloud_percent < ?)")
+            params.append(max_cloud)
+        if crs is not None:
+            conditions.append("s.crs = ?")
+            params.append(crs)
+
+        query = ("SELECT s.path, s.datetime, s.cloud_percent, s.crs, s.width, s.height, s.bands, "
+                 "s.footprint FROM scenes_rtree r JOIN scenes s ON s.id = r.id")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY s.datetime"
+        rows = self.conn.execute(query, params).fetchall()
+
+        if geometry is not None and rows:
+            footprints = shapely.from_wkb([row[7] for row in rows])
+            shapely.prepare(geometry)
+            hits = shapely.intersects(geometry, footprints)
+            rows = [row for row, hit in zip(rows, hits) if hit]
+
+        entries = [CatalogEntry(Path(path), datetime.fromisoformat(when), cloud, scene_crs,
+                                width, height, json.loads(bands), shapely.from_wkb(footprint))
+                   for path, when, cloud, scene_crs, width, height, bands, footprint in rows]
+        return entries[:limit] if limit else entries
+
+    def scenes(self, **kwargs) -> list:
+        """search() results as compositor Scenes"""
+        return [entry.to_scene() for entry in self.search(**kwargs)]
+
+
+def load_geometry(aoi) -> shapely.Geometry:
+    """Union of a GeoJSON geometry / Feature / FeatureCollection (dict or file path)"""
+    if isinstance(aoi, shapely.Geometry):
+        return aoi
+    if isinstance(aoi, (str, Path)):
+        with open(aoi) as f:
+            aoi = json.load(f)
+    features = aoi.get('features', [aoi])
+    geometries = [shapely.geometry.shape(feature.get('geometry', feature)) for feature in features]
+    return shapely.union_all(geometries)
+
+
+def main(argv=None):
+    """Build or query the scene catalog"""
+    parser = argparse.ArgumentParser(description='Local scene catalog (SQLite + R-tree)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scan_parser = subparsers.add_parser('scan', help='Index scenes under a directory')
+    scan_parser.add_argument('--catalog', required=True, type=Path)
+    scan_parser.add_argument('--root', required=True, type=Path)
+    scan_parser.add_argument('--pattern', default='**/*.tif')
+    scan_parser.add_argument('--workers', type=int, default=DEFAULT_SCAN_WORKERS)
+
+    search_parser = subparsers.add_parser('search', help='Scenes over an AOI in a date range')
+    search_parser.add_argument('--catalog', required=True, type=Path)
+    search_parser.add_argument('--aoi', type=Path, help='GeoJSON AOI (lon/lat)')
+    search_parser.add_argument('--start', help='YYYY-MM-DD, inclusive')
+    search_parser.add_argument('--end', help='YYYY-MM-DD, exclusive')
+    search_parser.add_argument('--max-cloud', type=float)
+    args = parser.parse_args(argv)
+
+    with SceneCatalog(args.catalog) as catalog:
+        if args.command == 'scan':
+            counts = catalog.scan(args.root, args.pattern, args.workers)
+            logger.info(f"✓ {args.catalog}: {counts['added']} added/updated, {counts['unchanged']} "
+                        f"unchanged, {counts['removed']} removed ({len(catalog)} scenes)")
+        else:
+            for entry in catalog.search(args.aoi, args.start, args.end, args.max_cloud):
+                cloud = f"{entry.cloud_percent:5.1f}%" if entry.cloud_percent is not None else '    ?'
+                print(f"{entry.datetime:%Y-%m-%d %H:%M}  {cloud}  {entry.crs:<11}  {entry.path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Tile-level checkpointing for incrementally written rasters
+
+A CheckpointedRaster writes a GeoTIFF tile by tile and keeps a
+`<output>.checkpoint.json` next to it listing the finished tiles with a
+checksum of their pixel values. After a crash the raster is reopened, each
+recorded tile is read back and verified, and only missing or corrupt tiles
+are computed again.
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.errors import RasterioIOError
+
+from utils.tiling import Tile
+
+# Seconds between checkpoint commits (close raster, persist tile list)
+DEFAULT_COMMIT_SECONDS = 60.0
+
+
+def tile_checksum(data: np.ndarray) -> str:
+    """Checksum of a tile's pixel values (bands x rows x cols)"""
+    data = np.ascontiguousarray(data)
+    digest = hashlib.blake2b(data.tobytes(), digest_size=16)
+    digest.update(str((data.dtype.str, data.shape)).encode())
+    return digest.hexdigest()
+
+
+def tile_key(tile: Tile) -> str:
+    return f"{tile.row_off},{tile.col_off},{tile.height},{tile.width}"
+
+
+def checkpoint_path(output_path: Path) -> Path:
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.name + '.checkpoint.json')
+
+
+class CheckpointedRaster:
+    """
+    Multi-band GeoTIFF written tile by tile with resumable progress
+
+    Usage:
+        with CheckpointedRaster(path, profile, signature) as out:
+            for tile in out.pending(tiles):
+                out.write(tile, compute(tile))
+
+    Tiles are durable only after a commit, which happens every
+    commit_seconds and on a clean exit; a crash loses at most the tiles
+    written since the last commit.
+    """
+
+    def __init__(self, path: Path, profile: dict, signature: dict,
+                 descriptions=None, commit_seconds: float = DEFAULT_COMMIT_SECONDS):
+        """
+        Args:
+            path: Output GeoTIFF
+            profile: rasterio profile of the full output
+            signature: JSON-serialisable description of the job (inputs,
+                extent, settings); a checkpoint with another signature is discarded
+            descriptions: Optional band descriptions
+            commit_seconds: Time between commits
+        """
+        self.path = Path(path)
+        self.checkpoint_path = checkpoint_path(self.path)
+        self.profile = profile
+        self.signature = json.loads(json.dumps(signature))
+        self.descriptions = descriptions
+        self.commit_seconds = commit_seconds
+        self.completed = {}
+        self.resumed = 0
+        self._uncommitted = {}
+        self._dst = None
+        self._last_commit = 0.0
+
+    def __enter__(self):
+        self.completed = self._load_checkpoint()
+        if self.completed:
+            try:
+                self._dst = rasterio.open(self.path, 'r+')
+            except RasterioIOError:
+                self.completed = {}
+        if self._dst is None:
+            self._create()
+        self._last_commit = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Commit on errors too: tiles written so far are complete and valid
+        self._commit()
+        self._dst.close()
+        self._dst = None
+
+    def _load_checkpoint(self) -> dict:
+        if not (self.path.exists() and self.checkpoint_path.exists()):
+            return {}
+        try:
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if state.get('signature') != self.signature:
+            return {}
+        return state.get('tiles', {})
+
+    def _create(self):
+        self.checkpoint_path.unlink(missing_ok=True)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._dst = rasterio.open(self.path, 'w', **self.profile)
+        for band, description in enumerate(self.descriptions or [], start=1):
+            self._dst.set_band_description(band, description)
+
+    def _save_checkpoint(self):
+        tmp_path = self.checkpoint_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'signature': self.signature, 'tiles': self.completed}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _commit(self):
+        """Flush the raster to disk (close + reopen) and persist finished tiles"""
+        if not self._uncommitted:
+            return
+        self._dst.close()
+        self.completed.update(self._uncommitted)
+        self._uncommitted = {}
+        self._save_checkpoint()
+        self._dst = rasterio.open(self.path, 'r+')
+        self._last_commit = time.time()
+
+    def pending(self, tiles):
+        """
+        Tiles still to compute, verifying checksums of recorded ones
+
+        Yields:
+            Tiles that are missing or whose stored pixels no longer match
+        """
+        for tile in tiles:
+            key = tile_key(tile)
+            expected = self.completed.get(key)
+            if expected is not None:
+                if tile_checksum(self._dst.read(window=tile.window)) == expected:
+                    self.resumed += 1
+                    continue
+                del self.completed[key]
+            yield tile
+
+    def write(self, tile: Tile, data: np.ndarray):
+        """Write a (bands, rows, cols) tile and record it for the next commit"""
+        data = data.astype(self.profile['dtype'], copy=False)
+        self._dst.write(data, window=tile.window)
+        self._uncommitted[tile_key(tile)] = tile_checksum(data)
+        if time.time() - self._last_commit >= self.commit_seconds:
+            self._commit()
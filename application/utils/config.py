@@ -1,49 +1,113 @@
 """
 Configuration management for the project
+
+A Config describes one fire / area of interest. It can be built from
+keyword arguments, a YAML/JSON file or FUELMAP_* environment variables,
+is cheap to construct, and touches the filesystem only when a stage asks
+for an output directory via ensure_dir().
 """
 
+import json
+import math
+import os
+from dataclasses import dataclass, fields
 from pathlib import Path
-from dataclasses import dataclass
+from typing import Optional
 
+DEFAULT_ROOT_DIR = Path(__file__).parent.parent.parent
 
-@dataclass
-class Config:
-    """Project configuration"""
+# Environment variable for each field (shared with the analysis scripts
+# and the batch runner, which pass per-fire settings this way)
+ENV_VARS = {
+    'ROOT_DIR': 'FUELMAP_ROOT_DIR',
+    'DATA_DIR': 'FUELMAP_DATA_DIR',
+    'OUTPUTS_DIR': 'FUELMAP_OUTPUT_DIR',
+    'FIRE_ID': 'FUELMAP_FIRE_ID',
+    'FIRE_NAME': 'FUELMAP_FIRE_NAME',
+    'FIRE_YEAR': 'FUELMAP_FIRE_YEAR',
+    'FIRE_START_DATE': 'FUELMAP_FIRE_START',
+    'FIRE_END_DATE': 'FUELMAP_FIRE_END',
+    'FIRE_AOI_PATH': 'FUELMAP_AOI',
+    'TARGET_CRS': 'FUELMAP_TARGET_CRS',
+    'BBOX_MINX': 'FUELMAP_BBOX_MINX',
+    'BBOX_MINY': 'FUELMAP_BBOX_MINY',
+    'BBOX_MAXX': 'FUELMAP_BBOX_MAXX',
+    'BBOX_MAXY': 'FUELMAP_BBOX_MAXY',
+    'SENTINEL_PREFIRE_PATH': 'FUELMAP_SENTINEL_PREFIRE',
+    'SENTINEL_POSTFIRE_PATH': 'FUELMAP_SENTINEL_POSTFIRE',
+    'MODIS_PREFIRE_PATH': 'FUELMAP_MODIS_PREFIRE',
+    'MODIS_POSTFIRE_PATH': 'FUELMAP_MODIS_POSTFIRE',
+    'LANDFIRE_PATH': 'FUELMAP_LANDFIRE',
+    'VEGETATION_BREAKS_PATH': 'FUELMAP_VEGETATION_BREAKS',
+    'CLIMATOLOGY_DIR': 'FUELMAP_CLIMATOLOGY',
+    'OUTPUT_GRID': 'FUELMAP_OUTPUT_GRID',
+    'STORAGE': 'FUELMAP_STORAGE',
+}
 
-    # Root directory
-    ROOT_DIR: Path = Path(__file__).parent.parent.parent
+# Grids the enhanced products can be written on ('sentinel2' also keeps the LANDFIRE ones)
+OUTPUT_GRIDS = ('landfire', 'sentinel2')
 
-    # Data directories
-    DATA_DIR: Path = ROOT_DIR / 'data'
-    LANDFIRE_DIR: Path = DATA_DIR / 'landfire'
-    SENTINEL_DIR: Path = DATA_DIR / 'satellite' / 'sentinel2'
-    MODIS_DIR: Path = DATA_DIR / 'satellite' / 'modis'
-    FIRE_PERIMETER_DIR: Path = DATA_DIR / 'fire_perimeters'
-    PROCESSED_DIR: Path = DATA_DIR / 'processed'
-    RESULTS_DIR: Path = DATA_DIR / 'results'
+# Raster storage of index / score layers (see utils/scaled.py)
+STORAGE_MODES = ('float32', 'scaled')
 
-    # Output directories
-    OUTPUTS_DIR: Path = ROOT_DIR / 'outputs'
-    FIGURES_DIR: Path = OUTPUTS_DIR / 'figures'
-    MAPS_DIR: Path = OUTPUTS_DIR / 'maps'
-    REPORTS_DIR: Path = OUTPUTS_DIR / 'reports'
 
-    # Config directory
-    CONFIG_DIR: Path = ROOT_DIR / 'config'
+def utm_epsg_for(lon: float, lat: float) -> str:
+    """EPSG code of the WGS84 UTM zone containing a lon/lat point"""
+    zone = int(math.floor((lon + 180) / 6)) % 60 + 1
+    return f"EPSG:{32600 + zone if lat >= 0 else 32700 + zone}"
+
 
-    # File paths
-    FIRE_AOI_PATH: Path = FIRE_PERIMETER_DIR / 'hermits_peak_area_of_interest.geojson'
+def aoi_bounds(aoi_path: Path):
+    """(minx, miny, maxx, maxy) of all coordinates in a lon/lat GeoJSON file"""
+    with open(aoi_path) as f:
+        geojson = json.load(f)
 
-    # Coordinate Reference System
-    TARGET_CRS: str = 'EPSG:32613'  # UTM Zone 13N
+    xs, ys = [], []
+
+    def _collect(coords):
+        if coords and isinstance(coords[0], (int, float)):
+            xs.append(coords[0])
+            ys.append(coords[1])
+        else:
+            for item in coords:
+                _collect(item)
+
+    features = geojson.get('features', [geojson])
+    for feature in features:
+        geometry = feature.get('geometry', feature)
+        _collect(geometry['coordinates'])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _field_kind(field_type):
+    """Base type (Path/int/float/str) of a possibly Optional annotation"""
+    args = getattr(field_type, '__args__', (field_type,))
+    for kind in (Path, int, float):
+        if kind in args:
+            return kind
+    return str
+
+
+@dataclass
+class Config:
+    """Project configuration for one fire / area of interest"""
+
+    # Root directories (derived sub-directories are properties below)
+    ROOT_DIR: Path = DEFAULT_ROOT_DIR
+    DATA_DIR: Optional[Path] = None
+    OUTPUTS_DIR: Optional[Path] = None
 
     # Fire metadata
+    FIRE_ID: str = 'hermits_peak'
     FIRE_NAME: str = 'Hermits Peak-Calf Canyon Fire'
     FIRE_YEAR: int = 2022
     FIRE_START_DATE: str = '2022-04-06'
     FIRE_END_DATE: str = '2022-08-21'
-    FIRE_SIZE_ACRES: int = 341735
-    FIRE_DAMAGE_USD: int = 4_000_000_000
+    FIRE_SIZE_ACRES: Optional[int] = 341735
+    FIRE_DAMAGE_USD: Optional[int] = 4_000_000_000
+
+    # Area of interest (defaults to the Hermits Peak perimeter)
+    FIRE_AOI_PATH: Optional[Path] = None
 
     # Bounding box (lat/lon)
     BBOX_MINX: float = -105.9
@@ -51,19 +115,180 @@ class Config:
     BBOX_MAXX: float = -105.3
     BBOX_MAXY: float = 36.0
 
+    # Coordinate Reference System (None = UTM zone of the AOI centroid)
+    TARGET_CRS: Optional[str] = None
+
+    # Input rasters (None = Hermits Peak files under DATA_DIR)
+    SENTINEL_PREFIRE_PATH: Optional[Path] = None
+    SENTINEL_POSTFIRE_PATH: Optional[Path] = None
+    MODIS_PREFIRE_PATH: Optional[Path] = None
+    MODIS_POSTFIRE_PATH: Optional[Path] = None
+    LANDFIRE_PATH: Optional[Path] = None
+
+    # Optional vegetation break raster (analysis/changepoints.py); adds a
+    # disturbance component to the fuel risk score when the file exists
+    VEGETATION_BREAKS_PATH: Optional[Path] = None
+
+    # Optional per-pixel climatology (analysis/climatology.py); stress becomes
+    # a standardized anomaly for FIRE_START_DATE when the directory exists
+    CLIMATOLOGY_DIR: Optional[Path] = None
+
+    # 'sentinel2' = stage 03 also writes the enhanced products at 10 m on the
+    # Sentinel-2 grid (outputs/enhanced_fuel/native_10m/)
+    OUTPUT_GRID: str = 'landfire'
+
+    # 'scaled' = index / stress layers stored as int16 x 10000 and the fuel
+    # risk score as uint8 half points (utils/scaled.py) instead of float32
+    STORAGE: str = 'float32'
+
     # Thresholds
     NDVI_LOSS_THRESHOLD: float = -0.1
     NBR_LOSS_THRESHOLD: float = -0.1
     CLOUD_COVER_MAX: int = 20
 
     def __post_init__(self):
-        """Create directories if they don't exist"""
-        self.PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
-        self.RESULTS_DIR.mkdir(parents=True, exist_ok=True)
-        self.FIGURES_DIR.mkdir(parents=True, exist_ok=True)
-        self.MAPS_DIR.mkdir(parents=True, exist_ok=True)
-        self.REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+        """Fill in derived defaults (pure computation, no filesystem access)"""
+        self.ROOT_DIR = Path(self.ROOT_DIR)
+        self.DATA_DIR = Path(self.DATA_DIR) if self.DATA_DIR else self.ROOT_DIR / 'data'
+        self.OUTPUTS_DIR = Path(self.OUTPUTS_DIR) if self.OUTPUTS_DIR else self.ROOT_DIR / 'outputs'
+
+        satellite_dir = self.DATA_DIR / 'satellite'
+        defaults = {
+            'FIRE_AOI_PATH': self.FIRE_PERIMETER_DIR / 'hermits_peak_area_of_interest.geojson',
+            'SENTINEL_PREFIRE_PATH': satellite_dir / 'hermits_peak_prefire_2020_2022.tif',
+            'SENTINEL_POSTFIRE_PATH': satellite_dir / 'hermits_peak_postfire_2022.tif',
+            'MODIS_PREFIRE_PATH': satellite_dir / 'hermits_peak_modis_prefire.tif',
+            'MODIS_POSTFIRE_PATH': satellite_dir / 'hermits_peak_modis_postfire.tif',
+            'LANDFIRE_PATH': self.LANDFIRE_DIR / 'LF2020_HermitsPeak_multiband.tif',
+            'VEGETATION_BREAKS_PATH': self.OUTPUTS_DIR / 'trends' / 'vegetation_breaks.tif',
+            'CLIMATOLOGY_DIR': self.OUTPUTS_DIR / 'climatology',
+        }
+        for name, default in defaults.items():
+            value = getattr(self, name)
+            setattr(self, name, Path(value) if value else default)
+
+        if self.OUTPUT_GRID not in OUTPUT_GRIDS:
+            raise ValueError(f"OUTPUT_GRID must be one of {OUTPUT_GRIDS}, got {self.OUTPUT_GRID!r}")
+
+        if self.STORAGE not in STORAGE_MODES:
+            raise ValueError(f"STORAGE must be one of {STORAGE_MODES}, got {self.STORAGE!r}")
+
+        if not self.TARGET_CRS:
+            self.TARGET_CRS = utm_epsg_for((self.BBOX_MINX + self.BBOX_MAXX) / 2,
+                                           (self.BBOX_MINY + self.BBOX_MAXY) / 2)
+
+    # Data directories
+    @property
+    def LANDFIRE_DIR(self) -> Path:
+        return self.DATA_DIR / 'landfire'
+
+    @property
+    def SENTINEL_DIR(self) -> Path:
+        return self.DATA_DIR / 'satellite' / 'sentinel2'
+
+    @property
+    def MODIS_DIR(self) -> Path:
+        return self.DATA_DIR / 'satellite' / 'modis'
+
+    @property
+    def FIRE_PERIMETER_DIR(self) -> Path:
+        return self.DATA_DIR / 'fire_perimeters'
+
+    @property
+    def PROCESSED_DIR(self) -> Path:
+        return self.DATA_DIR / 'processed'
+
+    @property
+    def RESULTS_DIR(self) -> Path:
+        return self.DATA_DIR / 'results'
+
+    # Output directories
+    @property
+    def FIGURES_DIR(self) -> Path:
+        return self.OUTPUTS_DIR / 'figures'
+
+    @property
+    def MAPS_DIR(self) -> Path:
+        return self.OUTPUTS_DIR / 'maps'
+
+    @property
+    def REPORTS_DIR(self) -> Path:
+        return self.OUTPUTS_DIR / 'reports'
+
+    # Config directory
+    @property
+    def CONFIG_DIR(self) -> Path:
+        return self.ROOT_DIR / 'config'
+
+    @property
+    def BBOX(self):
+        """(minx, miny, maxx, maxy) in lon/lat"""
+        return (self.BBOX_MINX, self.BBOX_MINY, self.BBOX_MAXX, self.BBOX_MAXY)
+
+    def ensure_dir(self, path: Path) -> Path:
+        """Create a directory on first write and return it"""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    @classmethod
+    def from_dict(cls, values: dict, base_dir: Path = None) -> 'Config':
+        """
+        Build a Config from a mapping of field names (case-insensitive)
+
+        Relative paths are resolved against base_dir. When an AOI is given
+        without a bounding box, the box is read from the AOI GeoJSON.
+
+        Args:
+            values: Field values; unknown keys raise ValueError
+            base_dir: Directory that relative paths are relative to
+        """
+        by_name = {f.name: f for f in fields(cls)}
+        kwargs = {}
+        for key, value in values.items():
+            name = key.upper()
+            if name not in by_name:
+                raise ValueError(f"Unknown config key: {key}")
+            if value is None or value == '':
+                continue
+            kind = _field_kind(by_name[name].type)
+            if kind is Path:
+                value = Path(value).expanduser()
+                if base_dir is not None and not value.is_absolute():
+                    value = (Path(base_dir) / value).resolve()
+            else:
+                value = kind(value)
+            kwargs[name] = value
+
+        bbox_keys = ['BBOX_MINX', 'BBOX_MINY', 'BBOX_MAXX', 'BBOX_MAXY']
+        if 'FIRE_AOI_PATH' in kwargs and not any(key in kwargs for key in bbox_keys):
+            kwargs.update(zip(bbox_keys, aoi_bounds(kwargs['FIRE_AOI_PATH'])))
+        return cls(**kwargs)
+
+    @classmethod
+    def from_file(cls, path: Path) -> 'Config':
+        """Build a Config from a YAML or JSON file of field values"""
+        path = Path(path)
+        with open(path) as f:
+            if path.suffix.lower() in ('.yaml', '.yml'):
+                import yaml
+                values = yaml.safe_load(f) or {}
+            else:
+                values = json.load(f)
+        return cls.from_dict(values, base_dir=path.parent)
+
+    @classmethod
+    def from_env(cls, environ=None) -> 'Config':
+        """Build a Config from FUELMAP_* environment variables (unset = default)"""
+        environ = os.environ if environ is None else environ
+        values = {name: environ[var] for name, var in ENV_VARS.items() if environ.get(var)}
+        return cls.from_dict(values)
+
+    def to_env(self) -> dict:
+        """FUELMAP_* environment variables that reproduce this Config in a subprocess"""
+        return {var: str(getattr(self, name)) for name, var in ENV_VARS.items()
+                if getattr(self, name) is not None}
 
 
-# Singleton instance
-config = Config()
+# Default instance (side-effect free; honours FUELMAP_* overrides)
+config = Config.from_env()
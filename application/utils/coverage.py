@@ -0,0 +1,89 @@
+"""
+AOI coverage of a raster grid
+
+Rasterizes the area-of-interest polygon once at block resolution into a
+coverage bitmap, so block-wise processing can skip blocks that lie wholly
+outside the AOI and mask the pixels outside it in partially covered blocks.
+"""
+
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+from affine import Affine
+from rasterio.features import rasterize
+from rasterio.warp import transform_geom
+
+from utils.tiling import Tile
+
+AOI_CRS = 'EPSG:4326'
+
+
+def load_aoi_geometries(aoi_path: Path, dst_crs) -> list:
+    """Polygon geometries of a lon/lat GeoJSON file, reprojected to dst_crs"""
+    with open(aoi_path) as f:
+        geojson = json.load(f)
+
+    features = geojson.get('features', [geojson])
+    geometries = [feature.get('geometry', feature) for feature in features]
+    return [transform_geom(AOI_CRS, dst_crs, geometry) for geometry in geometries if geometry]
+
+
+class CoverageMap:
+    """Which blocks (and pixels) of a grid fall inside the AOI"""
+
+    def __init__(self, geometries, transform: Affine, height: int, width: int, block_size: int):
+        """
+        Args:
+            geometries: AOI geometries in the grid CRS
+            transform: Grid affine transform
+            height: Grid height in pixels
+            width: Grid width in pixels
+            block_size: Bitmap cell size in pixels
+        """
+        self.geometries = list(geometries)
+        self.transform = transform
+        self.height = height
+        self.width = width
+        self.block_size = block_size
+
+        # all_touched: a block is kept if the polygon reaches any part of it
+        shape = (math.ceil(height / block_size), math.ceil(width / block_size))
+        self.bitmap = rasterize(
+            [(geometry, 1) for geometry in self.geometries], out_shape=shape,
+            transform=transform * Affine.scale(block_size), all_touched=True,
+            fill=0, dtype='uint8'
+        ).astype(bool)
+
+    @property
+    def covered_fraction(self) -> float:
+        """Fraction of bitmap blocks that touch the AOI"""
+        return float(self.bitmap.mean())
+
+    def intersects(self, tile: Tile) -> bool:
+        """Whether any bitmap block under the tile touches the AOI"""
+        rows = slice(tile.row_off // self.block_size,
+                     math.ceil((tile.row_off + tile.height) / self.block_size))
+        cols = slice(tile.col_off // self.block_size,
+                     math.ceil((tile.col_off + tile.width) / self.block_size))
+        return bool(self.bitmap[rows, cols].any())
+
+    def mask(self, tile: Tile):
+        """
+        Per-pixel AOI mask of a tile
+
+        Returns:
+            None if the tile lies fully inside the AOI, otherwise a boolean
+            (tile.height, tile.width) array that is True inside the AOI
+        """
+        if not self.intersects(tile):
+            return np.zeros((tile.height, tile.width), dtype=bool)
+
+        inside = rasterize(
+            [(geometry, 1) for geometry in self.geometries],
+            out_shape=(tile.height, tile.width),
+            transform=self.transform * Affine.translation(tile.col_off, tile.row_off),
+            fill=0, dtype='uint8'
+        ).astype(bool)
+        return None if inside.all() else inside
@@ -0,0 +1,314 @@
+"""
+Appendable time-series data cube (time x band x y x x)
+
+A directory-backed cube aligned to one raster grid:
+
+    cube.json           Index: grid, bands, dtype, tile size, acquisition dates
+    tiles/r{R}_c{C}.dat One file per spatial tile, raw time-major records of
+                        shape (band, tile_height, tile_width)
+
+Each spatial tile holds its whole history in one file, so appending an
+acquisition only writes to the end of the files it touches, reading one
+date of one tile is one contiguous read, and a pixel's full time series
+comes from a single file (memory-mapped, one strided read). Tiles never
+written (e.g. outside the AOI) have no file and read as the fill value.
+
+NumPy memmaps cannot be compressed in place; storage stays compact through
+the dtype (e.g. float16) and by not materialising empty tiles.
+"""
+
+import json
+import os
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+
+from utils.tiling import Tile, iter_tiles
+
+INDEX_FILE = 'cube.json'
+TILE_DIR = 'tiles'
+DEFAULT_CUBE_TILE_SIZE = 256
+
+
+class DataCube:
+    """Chunked on-disk time series cube on a fixed grid"""
+
+    def __init__(self, path: Path):
+        """Open an existing cube directory (see DataCube.create)"""
+        self.path = Path(path)
+        with open(self.path / INDEX_FILE) as f:
+            self.index = json.load(f)
+        self.bands = self.index['bands']
+        self.dtype = np.dtype(self.index['dtype'])
+        self.fill = np.array(self.index['fill'], dtype=self.dtype)
+        self.height = self.index['height']
+        self.width = self.index['width']
+        self.tile_size = self.index['tile_size']
+
+    @classmethod
+    def create(cls, path: Path, bands, height: int, width: int, crs: str = None,
+               transform=None, dtype='float32', tile_size: int = DEFAULT_CUBE_TILE_SIZE,
+               fill=float('nan'), times=None) -> 'DataCube':
+        """
+        Create an empty cube
+
+        Args:
+            path: Cube directory (must not contain a cube yet)
+            bands: Band names
+            height: Grid height in pixels
+            width: Grid width in pixels
+            crs: Grid CRS (WKT or EPSG string)
+            transform: Grid affine transform as a GDAL 6-tuple
+            dtype: Storage dtype
+            tile_size: Spatial chunk edge in pixels
+            fill: Value of pixels / tiles / dates never written
+            times: Dates declared up front, for cubes filled tile by tile
+                with write_series() (default: none, filled with append())
+        """
+        path = Path(path)
+        if (path / INDEX_FILE).exists():
+            raise FileExistsError(f"A cube already exists at {path}")
+        (path / TILE_DIR).mkdir(parents=True, exist_ok=True)
+        index = {
+            'bands': list(bands),
+            'dtype': np.dtype(dtype).str,
+            'fill': float(fill),
+            'height': height,
+            'width': width,
+            'crs': str(crs) if crs is not None else None,
+            'transform': list(transform) if transform is not None else None,
+            'tile_size': tile_size,
+            'times': [when.isoformat() if isinstance(when, date) else str(when)
+                      for when in (times or [])]
+        }
+        cls._write_index(path, index)
+        return cls(path)
+
+    @classmethod
+    def create_like(cls, path: Path, raster_path: Path, bands=None, **kwargs) -> 'DataCube':
+        """Create a cube on the grid of an existing raster"""
+        import rasterio
+        with rasterio.open(raster_path) as src:
+            bands = bands or [d or f'band_{i}' for i, d in enumerate(src.descriptions, start=1)]
+            return cls.create(path, bands, src.height, src.width, crs=src.crs.to_wkt(),
+                              transform=src.transform.to_gdal(), **kwargs)
+
+    @staticmethod
+    def _write_index(path: Path, index: dict):
+        tmp_path = Path(path) / (INDEX_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, Path(path) / INDEX_FILE)
+
+    # --- layout --------------------------------------------------------
+
+    @property
+    def times(self) -> list:
+        """Acquisition dates (ISO strings), oldest first"""
+        return self.index['times']
+
+    def tiles(self):
+        """Spatial tiles of the cube grid, row-major"""
+        return iter_tiles(self.height, self.width, self.tile_size)
+
+    def tile_at(self, row: int, col: int) -> Tile:
+        """Spatial tile containing a pixel"""
+        row_off = row // self.tile_size * self.tile_size
+        col_off = col // self.tile_size * self.tile_size
+        return Tile(row_off, col_off, min(self.tile_size, self.height - row_off),
+                    min(self.tile_size, self.width - col_off))
+
+    def _tile_file(self, tile: Tile) -> Path:
+        return self.path / TILE_DIR / f"r{tile.row_off // self.tile_size}_c{tile.col_off // self.tile_size}.dat"
+
+    def _record_shape(self, tile: Tile):
+        return (len(self.bands), tile.height, tile.width)
+
+    def _record_bytes(self, tile: Tile) -> int:
+        return int(np.prod(self._record_shape(tile))) * self.dtype.itemsize
+
+    def _check_tile(self, tile: Tile):
+        if (tile.row_off % self.tile_size or tile.col_off % self.tile_size
+                or tile != self.tile_at(tile.row_off, tile.col_off)):
+            raise ValueError(f"{tile} is not a tile of this cube (tile size {self.tile_size})")
+
+    def _memmap(self, tile: Tile, n_times: int):
+        """Read-only (time, band, y, x) view of a tile file's first n_times records"""
+        path = self._tile_file(tile)
+        if not path.exists() or n_times == 0:
+            return None
+        stored = min(path.stat().st_size // self._record_bytes(tile), n_times)
+        if stored == 0:
+            return None
+        return np.memmap(path, dtype=self.dtype, mode='r',
+                         shape=(stored,) + self._record_shape(tile))
+
+    # --- writing -------------------------------------------------------
+
+    def append(self, when, tiles) -> int:
+        """
+        Append one acquisition
+
+        Only tiles passed in are written; a tile whose file is behind
+        (skipped on earlier dates) is first padded with fill records, and
+        records left over from an interrupted append are truncated. The
+        date becomes visible when the index is rewritten at the end.
+
+        Args:
+            when: Acquisition date (date or ISO string), later than the last one
+            tiles: Iterable of (Tile, (band, y, x) array) on the cube's tile grid
+
+        Returns:
+            Index of the new time step
+        """
+        when = when.isoformat() if isinstance(when, date) else str(when)
+        if self.times and when <= self.times[-1]:
+            raise ValueError(f"Cube dates must increase: {when} after {self.times[-1]}")
+        t = len(self.times)
+
+        for tile, data in tiles:
+            self._check_tile(tile)
+            data = np.asarray(data, dtype=self.dtype)
+            if data.shape != self._record_shape(tile):
+                raise ValueError(f"Expected {self._record_shape(tile)} for {tile}, got {data.shape}")
+
+            path = self._tile_file(tile)
+            record_bytes = self._record_bytes(tile)
+            with open(path, 'ab+') as f:
+                stored = f.seek(0, os.SEEK_END) // record_bytes
+                if stored > t:
+                    f.truncate(t * record_bytes)
+                    f.seek(0, os.SEEK_END)
+                elif stored < t:
+                    fill = np.full(self._record_shape(tile), self.fill, dtype=self.dtype).tobytes()
+                    f.truncate(stored * record_bytes)
+                    f.seek(0, os.SEEK_END)
+                    for _ in range(t - stored):
+                        f.write(fill)
+                f.write(np.ascontiguousarray(data).tobytes())
+
+        self.index['times'] = self.times + [when]
+        self._write_index(self.path, self.index)
+        return t
+
+    def append_array(self, when, data: np.ndarray, skip_empty: bool = True) -> int:
+        """Append a full-grid (band, y, x) array, skipping all-fill tiles"""
+        def _tiles():
+            for tile in self.tiles():
+                block = data[(slice(None),) + tile.slices]
+                if skip_empty and self._is_fill(block):
+                    continue
+                yield tile, block
+        return self.append(when, _tiles())
+
+    def append_raster(self, when, raster_path: Path, bands=None, skip_empty: bool = True) -> int:
+        """
+        Append a GeoTIFF on the cube grid, reading it tile by tile
+
+        Args:
+            when: Acquisition date
+            raster_path: Raster with the same CRS, transform and size as the cube
+            bands: 1-based band numbers to store (default: first len(cube.bands))
+            skip_empty: Do not write tiles that are entirely fill
+        """
+        import rasterio
+        with rasterio.open(raster_path) as src:
+            self._check_grid(src)
+            bands = bands or list(range(1, len(self.bands) + 1))
+
+            def _tiles():
+                for tile in self.tiles():
+                    block = src.read(bands, window=tile.window)
+                    if skip_empty and self._is_fill(block):
+                        continue
+                    yield tile, block
+            return self.append(when, _tiles())
+
+    def write_series(self, tile: Tile, series: np.ndarray, skip_empty: bool = True):
+        """
+        Write the whole (time, band, y, x) history of one spatial tile
+
+        Replaces the tile file in one write, so separate processes can fill
+        different tiles of a cube whose dates were declared at creation.
+        """
+        self._check_tile(tile)
+        series = np.asarray(series, dtype=self.dtype)
+        expected = (len(self.times),) + self._record_shape(tile)
+        if series.shape != expected:
+            raise ValueError(f"Expected {expected} for {tile}, got {series.shape}")
+        path = self._tile_file(tile)
+        if skip_empty and self._is_fill(series):
+            path.unlink(missing_ok=True)
+            return
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(np.ascontiguousarray(series).tobytes())
+        os.replace(tmp_path, path)
+
+    def _is_fill(self, block: np.ndarray) -> bool:
+        if np.isnan(self.fill):
+            return bool(np.isnan(block).all())
+        return bool((block == self.fill).all())
+
+    def _check_grid(self, src):
+        grid = (src.height, src.width)
+        if grid != (self.height, self.width):
+            raise ValueError(f"{src.name} is {grid}, cube grid is {(self.height, self.width)}")
+        if self.index['transform'] is not None and \
+                not np.allclose(src.transform.to_gdal(), self.index['transform']):
+            raise ValueError(f"{src.name} is not aligned to the cube grid")
+
+    # --- reading -------------------------------------------------------
+
+    def time_index(self, when) -> int:
+        when = when.isoformat() if isinstance(when, date) else str(when)
+        return self.times.index(when)
+
+    def read_tile(self, tile: Tile, t=-1) -> np.ndarray:
+        """(band, y, x) values of one spatial tile at one time step (index or date)"""
+        self._check_tile(tile)
+        t = t if isinstance(t, (int, np.integer)) else self.time_index(t)
+        t = t % len(self.times) if self.times else 0
+        mm = self._memmap(tile, len(self.times))
+        if mm is None or t >= mm.shape[0]:
+            return np.full(self._record_shape(tile), self.fill, dtype=self.dtype)
+        return np.array(mm[t])
+
+    def tile_series(self, tile: Tile) -> np.ndarray:
+        """(time, band, y, x) history of one spatial tile"""
+        self._check_tile(tile)
+        n_times = len(self.times)
+        out = np.full((n_times,) + self._record_shape(tile), self.fill, dtype=self.dtype)
+        mm = self._memmap(tile, n_times)
+        if mm is not None:
+            out[:mm.shape[0]] = mm
+        return out
+
+    def pixel_series(self, row: int, col: int) -> np.ndarray:
+        """(time, band) history of one pixel"""
+        tile = self.tile_at(row, col)
+        n_times = len(self.times)
+        out = np.full((n_times, len(self.bands)), self.fill, dtype=self.dtype)
+        mm = self._memmap(tile, n_times)
+        if mm is not None:
+            out[:mm.shape[0]] = mm[:, :, row - tile.row_off, col - tile.col_off]
+        return out
+
+    def read(self, t=-1, window: Tile = None) -> np.ndarray:
+        """(band, y, x) values of any window (default: full grid) at one time step"""
+        window = window or Tile(0, 0, self.height, self.width)
+        out = np.full((len(self.bands), window.height, window.width), self.fill, dtype=self.dtype)
+        for tile in self.tiles():
+            rows = (max(tile.row_off, window.row_off),
+                    min(tile.row_off + tile.height, window.row_off + window.height))
+            cols = (max(tile.col_off, window.col_off),
+                    min(tile.col_off + tile.width, window.col_off + window.width))
+            if rows[0] >= rows[1] or cols[0] >= cols[1]:
+                continue
+            data = self.read_tile(tile, t)
+            out[:, rows[0] - window.row_off:rows[1] - window.row_off,
+                cols[0] - window.col_off:cols[1] - window.col_off] = \
+                data[:, rows[0] - tile.row_off:rows[1] - tile.row_off,
+                     cols[0] - tile.col_off:cols[1] - tile.col_off]
+        return out
@@ -0,0 +1,249 @@
+"""
+Scaled-integer storage for index and score rasters
+
+NDVI / NBR / NDMI (and their changes) and the 0-1 stress score carry about
+four decimals of meaningful precision and fit int16 as value x 10000; the
+0-100 fuel risk score fits uint8 in half points. In 'scaled' storage mode
+these layers are written as integers with the scale and offset in the
+GeoTIFF band metadata (value = stored * scale + offset) and nodata marking
+missing pixels, which halves (int16) or quarters (uint8) disk and read I/O
+compared with float32.
+
+read_layer() decodes to float32 for whatever window is asked for, so tiled
+consumers only ever hold one decoded tile; for float32 files it is a plain
+read. StoredLayer keeps a whole band in its stored dtype and decodes only
+what is indexed, and reproject_layer() warps the stored band and decodes the
+destination, so full-grid consumers keep the int16 / uint8 footprint too.
+compare() checks a scaled output tree against a float32 run of the
+same inputs within one storage step per layer.
+
+Usage:
+    python application/utils/scaled.py compare outputs_float32 outputs_scaled
+"""
+
+import argparse
+import json
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.warp import reproject
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.config import STORAGE_MODES
+
+
+@dataclass(frozen=True)
+class Encoding:
+    """Integer dtype, scale, offset and nodata of a stored layer"""
+
+    dtype: str
+    scale: float
+    offset: float
+    nodata: int
+
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        """Round float values to stored integers (NaN -> nodata, out of range clipped)"""
+        info = np.iinfo(self.dtype)
+        # The nodata code is kept out of the valid range
+        low = info.min + 1 if self.nodata == info.min else info.min
+        high = info.max - 1 if self.nodata == info.max else info.max
+        with np.errstate(invalid='ignore'):
+            stored = np.clip(np.round((values - self.offset) / self.scale), low, high)
+        return np.where(np.isnan(values), self.nodata, stored).astype(self.dtype)
+
+    def decode(self, stored: np.ndarray) -> np.ndarray:
+        """Stored integers back to float32 (nodata -> NaN)"""
+        values = stored.astype(np.float32) * np.float32(self.scale) + np.float32(self.offset)
+        return np.where(stored == self.nodata, np.nan, values).astype(np.float32)
+
+    @property
+    def tolerance(self) -> float:
+        """Largest error of a round trip (half a storage step)"""
+        return self.scale / 2
+
+
+INDEX = Encoding('int16', 1e-4, 0.0, np.iinfo(np.int16).min)
+ZSCORE = Encoding('int16', 1e-3, 0.0, np.iinfo(np.int16).min)
+RISK = Encoding('uint8', 0.5, 0.0, np.iinfo(np.uint8).max)
+
+# Output layers (file stem) that scaled storage applies to
+LAYER_ENCODINGS = {
+    'ndvi_change': INDEX,
+    'nbr_change': INDEX,
+    'ndmi_change': INDEX,
+    'stress_score': INDEX,
+    'ndvi_z': ZSCORE,
+    'nbr_z': ZSCORE,
+    'ndmi_z': ZSCORE,
+    'fuel_risk_score': RISK
+}
+
+
+def write_layer(path: Path, values: np.ndarray, profile: dict, storage: str = 'float32'):
+    """
+    Write a single-band layer as float32 or, in 'scaled' mode, as its encoding
+
+    The encoding is looked up by file stem in LAYER_ENCODINGS; layers
+    without one are always written as float32.
+    """
+    if storage not in STORAGE_MODES:
+        raise ValueError(f"storage must be one of {STORAGE_MODES}, got {storage!r}")
+    encoding = LAYER_ENCODINGS.get(Path(path).stem) if storage == 'scaled' else None
+    profile = dict(profile, count=1)
+    if encoding is None:
+        profile.update(dtype='float32')
+        with rasterio.open(path, 'w', **profile) as dst:
+            dst.write(np.asarray(values, dtype=np.float32), 1)
+        return
+    profile.update(dtype=encoding.dtype, nodata=encoding.nodata)
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(encoding.encode(np.asarray(values, dtype=np.float64)), 1)
+        dst.scales = (encoding.scale,)
+        dst.offsets = (encoding.offset,)
+
+
+def read_layer(src, band: int = 1, window=None) -> np.ndarray:
+    """
+    One band of an open dataset as float32, applying its scale / offset
+
+    Nodata pixels of integer bands become NaN; float bands are returned
+    as stored (scale 1, offset 0).
+    """
+    data = src.read(band, window=window)
+    scale, offset = src.scales[band - 1], src.offsets[band - 1]
+    if np.issubdtype(data.dtype, np.floating) and scale == 1 and offset == 0:
+        return data.astype(np.float32, copy=False)
+    values = data.astype(np.float32) * np.float32(scale) + np.float32(offset)
+    nodata = src.nodatavals[band - 1]
+    if nodata is not None:
+        values[data == nodata] = np.nan
+    return values
+
+
+class StoredLayer:
+    """
+    One band of a dataset held as stored, decoded to float32 when indexed
+
+    Tiled consumers index it like a float32 grid (grid[tile.slices],
+    grid[::step, ::step], grid[mask]) and get decoded values for just that
+    part, so an int16 / uint8 band stays at its stored size in memory.
+    Float bands are held and returned as float32.
+    """
+
+    def __init__(self, src, band: int = 1):
+        self.stored = src.read(band)
+        self.scale, self.offset = src.scales[band - 1], src.offsets[band - 1]
+        self.nodata = src.nodatavals[band - 1]
+        self.floating = np.issubdtype(self.stored.dtype, np.floating)
+        if self.floating:
+            self.stored = self.stored.astype(np.float32, copy=False)
+
+    @property
+    def shape(self):
+        return self.stored.shape
+
+    def __getitem__(self, key) -> np.ndarray:
+        data = self.stored[key]
+        if self.floating and self.scale == 1 and self.offset == 0:
+            return data
+        values = data.astype(np.float32) * np.float32(self.scale) + np.float32(self.offset)
+        if self.nodata is not None and not self.floating:
+            values[data == self.nodata] = np.nan
+        return values
+
+    def finite(self) -> np.ndarray:
+        """Boolean grid of pixels with a value (not nodata / NaN)"""
+        if self.floating:
+            return np.isfinite(self.stored)
+        if self.nodata is None:
+            return np.ones(self.shape, dtype=bool)
+        return self.stored != self.nodata
+
+    def value_range(self) -> tuple:
+        """(min, max) of the decoded values, NaN when no pixel has one"""
+        finite = self.finite()
+        if not finite.any():
+            return np.nan, np.nan
+        low, high = self.stored[finite].min(), self.stored[finite].max()
+        if self.scale < 0:
+            low, high = high, low
+        return (float(low * self.scale + self.offset), float(high * self.scale + self.offset))
+
+
+def reproject_layer(src, destination: np.ndarray, band: int = 1, **kwargs) -> np.ndarray:
+    """
+    Warp one band of an open dataset into a float32 destination, decoded
+
+    GDAL reads the stored band block by block, and scale / offset are
+    linear, so they are applied to the destination after resampling;
+    nodata pixels become NaN. kwargs go to rasterio.warp.reproject
+    (dst_transform, dst_crs, resampling, ...).
+    """
+    reproject(source=rasterio.band(src, band), destination=destination,
+              src_nodata=src.nodatavals[band - 1], dst_nodata=np.nan, **kwargs)
+    scale, offset = src.scales[band - 1], src.offsets[band - 1]
+    if scale != 1 or offset != 0:
+        destination *= np.float32(scale)
+        destination += np.float32(offset)
+    return destination
+
+
+def compare(reference: Path, candidate: Path, steps: float = 1.0) -> dict:
+    """
+    Compare a scaled output tree with a float32 run of the same inputs
+
+    Every LAYER_ENCODINGS layer found in both trees is decoded and
+    compared. A layer passes when the largest difference is within `steps`
+    storage steps (quantisation of the layer itself plus what its
+    quantised inputs propagate) and both agree on which pixels are NaN.
+
+    Returns:
+        {relative path: {max_abs_error, mean_abs_error, tolerance, nan_mismatch, passed}}
+    """
+    results = {}
+    for path in sorted(Path(reference).rglob('*.tif')):
+        encoding = LAYER_ENCODINGS.get(path.stem)
+        other = Path(candidate) / path.relative_to(reference)
+        if encoding is None or not other.exists():
+            continue
+        with rasterio.open(path) as src_a, rasterio.open(other) as src_b:
+            a, b = read_layer(src_a), read_layer(src_b)
+        both = np.isfinite(a) & np.isfinite(b)
+        error = np.abs(a[both].astype(np.float64) - b[both])
+        tolerance = steps * encoding.scale
+        nan_mismatch = int((np.isfinite(a) != np.isfinite(b)).sum())
+        max_error = float(error.max()) if error.size else 0.0
+        results[str(path.relative_to(reference))] = {
+            'max_abs_error': max_error,
+            'mean_abs_error': float(error.mean()) if error.size else 0.0,
+            'tolerance': tolerance,
+            'nan_mismatch': nan_mismatch,
+            'passed': bool(max_error <= tolerance and nan_mismatch == 0)
+        }
+    return results
+
+
+def main(argv=None):
+    """Tolerance check of a scaled-storage run against a float32 run"""
+    parser = argparse.ArgumentParser(description='Scaled-integer raster storage tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    check = subparsers.add_parser('compare', help='Compare scaled outputs with float32 outputs')
+    check.add_argument('reference', type=Path, help='Output directory of the float32 run')
+    check.add_argument('candidate', type=Path, help='Output directory of the scaled run')
+    check.add_argument('--steps', type=float, default=1.0,
+                       help='Allowed error in storage steps (default: 1)')
+    args = parser.parse_args(argv)
+
+    results = compare(args.reference, args.candidate, args.steps)
+    print(json.dumps(results, indent=2))
+    if not results:
+        print("No scaled layers found in both directories", file=sys.stderr)
+        return 1
+    return 0 if all(result['passed'] for result in results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+Array statistics shared by the compositing and time-series modules
+"""
+
+import numpy as np
+
+
+def nan_median(values: np.ndarray) -> np.ndarray:
+    """
+    Median over axis 0 ignoring NaN, via one fixed-rank partition
+
+    np.nanmedian falls back to a per-pixel loop once NaNs are present, and
+    partitioning every rank a pixel's median could sit at costs nearly a
+    full sort along long axes (e.g. the T(T-1)/2 pairwise slopes of
+    Theil-Sen). Here the NaNs of each pixel are split evenly into -inf below
+    and +inf above its valid values, which puts every pixel's median on
+    ranks n // 2 - 1 and n // 2.
+
+    The input is overwritten (NaNs replaced, rows reordered); pass a copy
+    to keep it.
+
+    Args:
+        values: (n, ...) float array, NaN = missing
+
+    Returns:
+        (...) medians in the input's dtype, NaN where a pixel has no valid value
+    """
+    n = values.shape[0]
+    missing = np.isnan(values)
+    m = n - missing.sum(axis=0)
+
+    below = (n - m) // 2
+    missing_rank = np.cumsum(missing, axis=0, dtype=np.int16 if n < 2 ** 15 else np.int32)
+    values[missing] = np.inf
+    values[missing & (missing_rank <= below)] = -np.inf
+    del missing, missing_rank
+
+    centre = n // 2
+    values.partition(sorted({max(centre - 1, 0), centre}), axis=0)
+
+    lower = np.take_along_axis(values, (below + np.maximum(m - 1, 0) // 2)[None], axis=0)[0]
+    upper = np.take_along_axis(values, (below + m // 2)[None], axis=0)[0]
+    median = (lower + upper) / 2
+    median[m == 0] = np.nan
+    return median
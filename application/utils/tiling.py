@@ -0,0 +1,66 @@
+"""
+Tile iteration helpers for block-wise raster processing
+"""
+
+from dataclasses import dataclass
+from typing import Iterator
+
+DEFAULT_TILE_SIZE = 1024
+
+
+@dataclass(frozen=True)
+class Tile:
+    """A rectangular block of a raster grid (row/col offsets in pixels)"""
+
+    row_off: int
+    col_off: int
+    height: int
+    width: int
+
+    @property
+    def slices(self):
+        """Numpy slices selecting this tile from a full-grid array"""
+        return (slice(self.row_off, self.row_off + self.height),
+                slice(self.col_off, self.col_off + self.width))
+
+    @property
+    def window(self):
+        """rasterio Window covering this tile"""
+        from rasterio.windows import Window
+        return Window(self.col_off, self.row_off, self.width, self.height)
+
+    def expand(self, halo: int, grid_height: int, grid_width: int):
+        """
+        Grow the tile by a halo, clipped to the grid
+
+        Returns:
+            (outer, inner) where outer is the haloed Tile and inner are the
+            slices selecting this tile's pixels out of an outer-sized array
+        """
+        row_start = max(self.row_off - halo, 0)
+        col_start = max(self.col_off - halo, 0)
+        row_stop = min(self.row_off + self.height + halo, grid_height)
+        col_stop = min(self.col_off + self.width + halo, grid_width)
+        outer = Tile(row_start, col_start, row_stop - row_start, col_stop - col_start)
+        inner = (slice(self.row_off - row_start, self.row_off - row_start + self.height),
+                 slice(self.col_off - col_start, self.col_off - col_start + self.width))
+        return outer, inner
+
+
+def iter_tiles(height: int, width: int, tile_size: int = DEFAULT_TILE_SIZE) -> Iterator[Tile]:
+    """
+    Iterate over a height x width grid in row-major square tiles
+
+    Args:
+        height: Grid height in pixels
+        width: Grid width in pixels
+        tile_size: Tile edge length in pixels (edge tiles may be smaller)
+
+    Yields:
+        Tile objects covering the grid without overlap
+    """
+    for row_off in range(0, height, tile_size):
+        tile_h = min(tile_size, height - row_off)
+        for col_off in range(0, width, tile_size):
+            tile_w = min(tile_size, width - col_off)
+            yield Tile(row_off, col_off, tile_h, tile_w)
@@ -0,0 +1,331 @@
+"""
+Grid-aware bilinear resampling through a cached warp plan
+
+A WarpPlan maps the pixel centres of a destination grid to fractional
+pixel positions in a source grid once, then serves any destination tile by
+reading only the source window under it (for 250 m MODIS under a 10 m
+Sentinel-2 tile, a few dozen pixels) and blending the four neighbours.
+When both grids share a CRS and are north-up the mapping is separable and
+the plan is two 1-D index/weight arrays for the whole grid; otherwise the
+pixel centres of each tile are reprojected and the last few tile plans are
+kept, so several sources on the same grid reuse them. The same plan also
+serves nearest-neighbour reads of categorical grids through integer index
+mapping (read_tile_nearest).
+
+When a coarse grid nests an integer number of fine pixels per cell (10 m
+Sentinel-2 under 30 m LANDFIRE: 3 x 3), block_aggregate() instead reduces
+each cell's fine pixels directly with a reshape, giving the cell mean plus
+sub-pixel heterogeneity (std, min, max, fraction above a threshold).
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.warp import transform as transform_points
+from rasterio.windows import Window
+
+from utils.tiling import Tile, iter_tiles, DEFAULT_TILE_SIZE
+
+# Reprojected tile plans kept for reuse (non-separable grids only)
+TILE_PLAN_CACHE = 8
+
+# Per-cell statistics of block_aggregate(), in band order
+AGGREGATE_STATS = ['mean', 'std', 'min', 'max', 'frac_above']
+
+
+@dataclass
+class TilePlan:
+    """Source window and bilinear taps for one destination tile"""
+
+    window: Window
+    rows: np.ndarray      # top-left tap row, relative to the window
+    cols: np.ndarray      # top-left tap column, relative to the window
+    row_weight: np.ndarray
+    col_weight: np.ndarray
+    inside: np.ndarray    # destination pixels that fall within the source grid
+
+
+class WarpPlan:
+    """Bilinear sampling of a source grid at the pixel centres of a destination grid"""
+
+    def __init__(self, src_crs, src_transform: Affine, src_shape, dst_crs, dst_transform: Affine,
+                 dst_shape):
+        """
+        Args:
+            src_crs, src_transform, src_shape: Source grid (shape = (height, width))
+            dst_crs, dst_transform, dst_shape: Destination grid
+        """
+        self.src_crs = CRS.from_user_input(src_crs)
+        self.src_transform = src_transform
+        self.src_height, self.src_width = src_shape
+        self.dst_crs = CRS.from_user_input(dst_crs)
+        self.dst_transform = dst_transform
+        self.dst_height, self.dst_width = dst_shape
+        self.separable = (self.src_crs == self.dst_crs and src_transform.b == src_transform.d == 0
+                          and dst_transform.b == dst_transform.d == 0)
+        self._tile_plans = OrderedDict()
+
+        if self.separable:
+            # Source (fractional) column of each destination column, same for rows
+            x = dst_transform.c + dst_transform.a * (np.arange(self.dst_width) + 0.5)
+            y = dst_transform.f + dst_transform.e * (np.arange(self.dst_height) + 0.5)
+            self._src_cols = (x - src_transform.c) / src_transform.a - 0.5
+            self._src_rows = (y - src_transform.f) / src_transform.e - 0.5
+
+    @classmethod
+    def between(cls, src, dst_profile: dict) -> 'WarpPlan':
+        """Plan from an open source dataset onto a raster profile's grid"""
+        return cls(src.crs, src.transform, (src.height, src.width), dst_profile['crs'],
+                   dst_profile['transform'], (dst_profile['height'], dst_profile['width']))
+
+    def _source_positions(self, tile: Tile):
+        """Fractional source (rows, cols) of the tile's pixel centres, each (h, w)"""
+        if self.separable:
+            rows = self._src_rows[tile.row_off:tile.row_off + tile.height]
+            cols = self._src_cols[tile.col_off:tile.col_off + tile.width]
+            return np.broadcast_to(rows[:, None], (tile.height, tile.width)), \
+                np.broadcast_to(cols[None, :], (tile.height, tile.width))
+        cols, rows = np.meshgrid(np.arange(tile.width) + tile.col_off + 0.5,
+                                 np.arange(tile.height) + tile.row_off + 0.5)
+        x, y = self.dst_transform * (cols.ravel(), rows.ravel())
+        x, y = transform_points(self.dst_crs, self.src_crs, x, y)
+        src_cols, src_rows = ~self.src_transform * (np.asarray(x), np.asarray(y))
+        return (np.reshape(src_rows, (tile.height, tile.width)) - 0.5,
+                np.reshape(src_cols, (tile.height, tile.width)) - 0.5)
+
+    def tile_plan(self, tile: Tile):
+        """
+        Window and bilinear taps for a destination tile
+
+        Returns:
+            TilePlan, or None if the tile does not overlap the source grid
+        """
+        key = (tile.row_off, tile.col_off, tile.height, tile.width)
+        if key in self._tile_plans:
+            self._tile_plans.move_to_end(key)
+            return self._tile_plans[key]
+
+        src_rows, src_cols = self._source_positions(tile)
+        inside = ((src_rows >= -0.5) & (src_rows <= self.src_height - 0.5)
+                  & (src_cols >= -0.5) & (src_cols <= self.src_width - 0.5))
+        plan = None
+        if inside.any():
+            # Taps are clamped to the grid, so edge pixels blend with themselves
+            src_rows = np.clip(src_rows, 0, self.src_height - 1)
+            src_cols = np.clip(src_cols, 0, self.src_width - 1)
+            row0 = np.minimum(np.floor(src_rows).astype(np.int64), max(self.src_height - 2, 0))
+            col0 = np.minimum(np.floor(src_cols).astype(np.int64), max(self.src_width - 2, 0))
+            row_start, col_start = int(row0[inside].min()), int(col0[inside].min())
+            row_stop = min(int(row0[inside].max()) + 2, self.src_height)
+            col_stop = min(int(col0[inside].max()) + 2, self.src_width)
+            plan = TilePlan(
+                window=Window(col_start, row_start, col_stop - col_start, row_stop - row_start),
+                rows=np.clip(row0 - row_start, 0, row_stop - row_start - 1),
+                cols=np.clip(col0 - col_start, 0, col_stop - col_start - 1),
+                row_weight=(src_rows - row0).astype(np.float32),
+                col_weight=(src_cols - col0).astype(np.float32),
+                inside=inside
+            )
+
+        if not self.separable:
+            self._tile_plans[key] = plan
+            if len(self._tile_plans) > TILE_PLAN_CACHE:
+                self._tile_plans.popitem(last=False)
+        return plan
+
+    def sample(self, data: np.ndarray, plan: TilePlan) -> np.ndarray:
+        """
+        Bilinear blend of a source-window array (NaN = nodata) for a tile plan
+
+        Nodata taps are left out and the remaining weights renormalised.
+        """
+        height, width = data.shape
+        rows1 = np.minimum(plan.rows + 1, height - 1)
+        cols1 = np.minimum(plan.cols + 1, width - 1)
+        fy, fx = plan.row_weight, plan.col_weight
+        total = np.zeros(plan.rows.shape, dtype=np.float32)
+        weight = np.zeros(plan.rows.shape, dtype=np.float32)
+        for rows, cols, w in ((plan.rows, plan.cols, (1 - fy) * (1 - fx)),
+                              (plan.rows, cols1, (1 - fy) * fx),
+                              (rows1, plan.cols, fy * (1 - fx)),
+                              (rows1, cols1, fy * fx)):
+            values = data[rows, cols]
+            valid = ~np.isnan(values)
+            total += np.where(valid, values * w, 0)
+            weight += np.where(valid, w, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = total / weight
+        return np.where(plan.inside & (weight > 0), out, np.nan).astype(np.float32)
+
+    def read_tile(self, src, band: int, tile: Tile, scale: float = 1.0) -> np.ndarray:
+        """One band of an open dataset resampled onto a destination tile (float32, NaN = nodata)"""
+        plan = self.tile_plan(tile)
+        if plan is None:
+            return np.full((tile.height, tile.width), np.nan, dtype=np.float32)
+        data = src.read(band, window=plan.window, masked=True)
+        data = (data.astype(np.float32) * np.float32(scale)).filled(np.nan)
+        return self.sample(data, plan)
+
+    def read_tile_nearest(self, src, band: int, tile: Tile) -> np.ndarray:
+        """
+        One band of an open dataset sampled by nearest neighbour onto a destination tile
+
+        Each destination pixel takes the source pixel containing its centre
+        through integer index mapping (1-D row and column indices on
+        separable grids), so a coarse categorical grid such as LANDFIRE is
+        upsampled one tile at a time without materialising it at the fine
+        resolution. Returns float32 (exact for integer codes below 2**24);
+        NaN outside the source grid and for nodata.
+        """
+        src_rows, src_cols = self._source_positions(tile)
+        if self.separable:
+            src_rows, src_cols = src_rows[:, 0], src_cols[0]
+        rows = np.floor(src_rows + 0.5).astype(np.int64)
+        cols = np.floor(src_cols + 0.5).astype(np.int64)
+        row_in = (rows >= 0) & (rows < self.src_height)
+        col_in = (cols >= 0) & (cols < self.src_width)
+        inside = (row_in[:, None] & col_in[None, :]) if self.separable else (row_in & col_in)
+        if not inside.any():
+            return np.full((tile.height, tile.width), np.nan, dtype=np.float32)
+        row_start, row_stop = int(rows[row_in].min()), int(rows[row_in].max()) + 1
+        col_start, col_stop = int(cols[col_in].min()), int(cols[col_in].max()) + 1
+        window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+        data = src.read(band, window=window, masked=True)
+        rows = np.clip(rows - row_start, 0, row_stop - row_start - 1)
+        cols = np.clip(cols - col_start, 0, col_stop - col_start - 1)
+        if self.separable:
+            rows, cols = rows[:, None], cols[None, :]
+        values = data.astype(np.float32).filled(np.nan)[rows, cols]
+        return np.where(inside, values, np.nan).astype(np.float32)
+
+    def read(self, src, band: int, scale: float = 1.0,
+             tile_size: int = DEFAULT_TILE_SIZE) -> np.ndarray:
+        """One band of an open dataset resampled onto the whole destination grid"""
+        out = np.empty((self.dst_height, self.dst_width), dtype=np.float32)
+        for tile in iter_tiles(self.dst_height, self.dst_width, tile_size):
+            out[tile.slices] = self.read_tile(src, band, tile, scale)
+        return out
+
+
+def nesting_factor(src_crs, src_transform: Affine, dst_crs, dst_transform: Affine,
+                   tolerance: float = 1e-6):
+    """
+    How many source pixels per destination cell edge, if the grids nest
+
+    Returns:
+        (factor, row_off, col_off): each destination cell covers factor x
+        factor source pixels, and destination pixel (0, 0) starts at source
+        pixel (row_off, col_off); None if the grids do not nest
+    """
+    if CRS.from_user_input(src_crs) != CRS.from_user_input(dst_crs):
+        return None
+    if src_transform.b or src_transform.d or dst_transform.b or dst_transform.d:
+        return None
+    factor = dst_transform.a / src_transform.a
+    if round(factor) < 1 or abs(factor - round(factor)) > tolerance \
+            or abs(dst_transform.e / src_transform.e - round(factor)) > tolerance:
+        return None
+    col_off = (dst_transform.c - src_transform.c) / src_transform.a
+    row_off = (dst_transform.f - src_transform.f) / src_transform.e
+    if abs(col_off - round(col_off)) > tolerance or abs(row_off - round(row_off)) > tolerance:
+        return None
+    return int(round(factor)), int(round(row_off)), int(round(col_off))
+
+
+def block_aggregate(values: np.ndarray, factor: int, threshold: float = None) -> dict:
+    """
+    Statistics of each factor x factor block of a fine-grid array
+
+    Args:
+        values: (factor * h, factor * w) array, NaN = nodata
+        factor: Block edge in pixels
+        threshold: frac_above is the valid fraction of each block above this
+            (omitted when None)
+
+    Returns:
+        dict of AGGREGATE_STATS -> float32 (h, w); NaN where a block has no
+        valid pixel
+    """
+    height, width = values.shape[0] // factor, values.shape[1] // factor
+    blocks = values[:height * factor, :width * factor].reshape(height, factor, width, factor)
+    valid = ~np.isnan(blocks)
+    count = valid.sum(axis=(1, 3))
+    filled = np.where(valid, blocks, 0).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = filled.sum(axis=(1, 3)) / count
+        variance = (filled ** 2).sum(axis=(1, 3)) / count - mean ** 2
+    empty = count == 0
+    result = {
+        'mean': mean,
+        'std': np.sqrt(np.maximum(variance, 0)),
+        'min': np.where(valid, blocks, np.inf).min(axis=(1, 3)),
+        'max': np.where(valid, blocks, -np.inf).max(axis=(1, 3))
+    }
+    if threshold is not None:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result['frac_above'] = (valid & (blocks > threshold)).sum(axis=(1, 3)) / count
+    return {name: np.where(empty, np.nan, stat).astype(np.float32) for name, stat in result.items()}
+
+
+def aggregate_onto(values: np.ndarray, nesting: tuple, dst_shape, threshold: float = None) -> dict:
+    """
+    block_aggregate() of a full source-grid array onto a nesting destination grid
+
+    Source pixels outside the destination grid are dropped; destination
+    cells beyond the source extent are NaN.
+
+    Args:
+        values: Source-grid array (NaN = nodata)
+        nesting: (factor, row_off, col_off) from nesting_factor()
+        dst_shape: Destination (height, width)
+        threshold: See block_aggregate()
+    """
+    factor, row_off, col_off = nesting
+    height, width = dst_shape
+    padded = np.full((height * factor, width * factor), np.nan, dtype=np.float32)
+    rows = (max(row_off, 0), min(row_off + height * factor, values.shape[0]))
+    cols = (max(col_off, 0), min(col_off + width * factor, values.shape[1]))
+    if rows[0] < rows[1] and cols[0] < cols[1]:
+        padded[rows[0] - row_off:rows[1] - row_off, cols[0] - col_off:cols[1] - col_off] = \
+            values[rows[0]:rows[1], cols[0]:cols[1]]
+    return block_aggregate(padded, factor, threshold)
+
+
+def aggregate_windows(read, src_shape, nesting: tuple, dst_shape, threshold: float = None,
+                      rows_per_block: int = 256) -> dict:
+    """
+    aggregate_onto() of a source grid read one strip of destination rows at a time
+
+    Only rows_per_block * factor source rows are decoded at once, so the
+    source never has to be held as a full float32 grid.
+
+    Args:
+        read: Callable Window -> float32 source array (NaN = nodata)
+        src_shape: Source (height, width)
+        nesting: (factor, row_off, col_off) from nesting_factor()
+        dst_shape: Destination (height, width)
+        threshold: See block_aggregate()
+        rows_per_block: Destination rows per strip
+    """
+    factor, row_off, col_off = nesting
+    height, width = dst_shape
+    col_start, col_stop = max(col_off, 0), min(col_off + width * factor, src_shape[1])
+    result = {}
+    for start in range(0, height, rows_per_block):
+        stop = min(start + rows_per_block, height)
+        first = row_off + start * factor
+        row_start, row_stop = max(first, 0), min(row_off + stop * factor, src_shape[0])
+        if row_start < row_stop and col_start < col_stop:
+            values = read(Window(col_start, row_start, col_stop - col_start, row_stop - row_start))
+        else:
+            values = np.empty((0, 0), dtype=np.float32)
+        strip = aggregate_onto(values, (factor, first - row_start, col_off - col_start),
+                               (stop - start, width), threshold)
+        for name, stat in strip.items():
+            if name not in result:
+                result[name] = np.empty((height, width), dtype=np.float32)
+            result[name][start:stop] = stat
+    return result
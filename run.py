@@ -8,6 +8,10 @@ Usage:
     python run.py --step analysis         # Just analysis
     python run.py --step visualize        # Just visualization
     python run.py --step dashboard        # Launch dashboard
+    python run.py --step batch --catalog config/fire_catalog_example.yaml
+                                          # Run 01-04 for every fire in a catalog
+    python run.py --step shard --config config/config_example.yaml --workers 8
+                                          # Sharded 01-03 over a large AOI
 """
 
 import argparse
@@ -23,24 +27,24 @@ from utils.config import Config
 logger = setup_logger(__name__)
 
 
-def run_preprocessing():
+def run_preprocessing(config=None):
     """Run data preprocessing pipeline"""
     logger.info("=" * 60)
     logger.info("STEP 1: Data Preprocessing")
     logger.info("=" * 60)
 
     from preprocessing.preprocess_data import main as preprocess_main
-    preprocess_main()
+    preprocess_main(config)
 
 
-def run_analysis():
+def run_analysis(config=None):
     """Run fuel mapping analysis"""
     logger.info("=" * 60)
     logger.info("STEP 2: Fuel Mapping Analysis")
     logger.info("=" * 60)
 
     from analysis.fuel_mapping import main as analysis_main
-    analysis_main()
+    analysis_main(config)
 
 
 def run_visualization():
@@ -90,27 +94,61 @@ def run_dashboard():
         logger.error(f"Dashboard script not found: {dashboard_script}")
 
 
+def run_batch(catalog, workers=None, memory_gb=None):
+    """Run the analysis pipeline over a fire catalog"""
+    logger.info("=" * 60)
+    logger.info("Batch Mode: Multi-Fire Pipeline")
+    logger.info("=" * 60)
+
+    from pipeline.batch_runner import main as batch_main
+    argv = ['--catalog', str(catalog)]
+    if workers:
+        argv += ['--workers', str(workers)]
+    if memory_gb:
+        argv += ['--memory-gb', str(memory_gb)]
+    batch_main(argv)
+
+
+def run_sharded(config, run_dir=None, workers=None):
+    """Run stages 01-03 over a large AOI in shards with local worker processes"""
+    logger.info("=" * 60)
+    logger.info("Sharded Mode: Large-AOI Fuel Map")
+    logger.info("=" * 60)
+
+    from pipeline.sharding import run_local
+    run_local(config, run_dir or config.OUTPUTS_DIR / 'sharded', workers=workers)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Hermits Peak Wildfire Fuel Mapping Pipeline'
     )
     parser.add_argument(
         '--step',
-        choices=['all', 'preprocess', 'analysis', 'visualize', 'map', 'dashboard'],
+        choices=['all', 'preprocess', 'analysis', 'visualize', 'map', 'dashboard', 'batch', 'shard'],
         default='all',
         help='Which step to run'
     )
+    parser.add_argument('--config', type=Path,
+                        help='YAML/JSON config for a non-default AOI (default: FUELMAP_* env vars)')
+    parser.add_argument('--catalog', type=Path, help='Fire catalog for --step batch')
+    parser.add_argument('--workers', type=int,
+                        help='Maximum parallel fires (batch) or local worker processes (shard)')
+    parser.add_argument('--memory-gb', type=float, help='Memory budget for --step batch')
+    parser.add_argument('--run-dir', type=Path,
+                        help='Shared run directory for --step shard (default: outputs/sharded)')
 
     args = parser.parse_args()
+    config = Config.from_file(args.config) if args.config else Config.from_env()
 
     logger.info("🔥 Hermits Peak Wildfire Fuel Mapping Pipeline")
     logger.info("")
 
     if args.step in ['all', 'preprocess']:
-        run_preprocessing()
+        run_preprocessing(config)
 
     if args.step in ['all', 'analysis']:
-        run_analysis()
+        run_analysis(config)
 
     if args.step in ['all', 'visualize']:
         run_visualization()
@@ -121,6 +159,14 @@ def main():
     if args.step == 'dashboard':
         run_dashboard()
 
+    if args.step == 'batch':
+        if args.catalog is None:
+            parser.error("--step batch requires --catalog")
+        run_batch(args.catalog, args.workers, args.memory_gb)
+
+    if args.step == 'shard':
+        run_sharded(config, args.run_dir, args.workers)
+
     if args.step == 'all':
         logger.info("")
         logger.info("=" * 60)
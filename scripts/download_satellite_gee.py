@@ -89,7 +89,7 @@ def get_sentinel2_composite(start_date, end_date, aoi, name):
 
     return result
 
-def export_to_drive(image, description, aoi):
+def export_to_drive(image, description, aoi, scale=10):
     """
     Export image to Google Drive
     Note: This creates an export task that runs in the background
@@ -99,7 +99,7 @@ def export_to_drive(image, description, aoi):
         description=description,
         folder='EarthEngineExports',
         region=aoi,
-        scale=10,  # 10m resolution (Sentinel-2 native)
+        scale=scale,  # default 10m resolution (Sentinel-2 native)
         crs='EPSG:4326',
         maxPixels=1e13
     )
@@ -161,6 +161,11 @@ def get_modis_vegetation():
         post_modis = modis.filterDate(POST_FIRE_START, POST_FIRE_END).mean()
         export_to_drive(post_modis, 'hermits_peak_modis_postfire', aoi)
 
+        # Full 16-day NDVI series, one band per date (e.g. 2020_01_01_NDVI),
+        # at native 250m for application/analysis/trends.py
+        stack = modis.select('NDVI').toBands()
+        export_to_drive(stack, 'hermits_peak_modis_ndvi_stack', aoi, scale=250)
+
         print("  ✓ MODIS exports created")
 
 def get_landsat_thermal():
@@ -218,6 +223,7 @@ def main():
         print("  - hermits_peak_postfire_2022.tif (Sentinel-2)")
         print("  - hermits_peak_modis_prefire.tif (MODIS)")
         print("  - hermits_peak_modis_postfire.tif (MODIS)")
+        print("  - hermits_peak_modis_ndvi_stack.tif (MODIS 16-day NDVI series)")
         print("  - hermits_peak_landsat8_prefire.tif (Landsat 8)")
 
     except Exception as e:
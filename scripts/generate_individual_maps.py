@@ -9,6 +9,10 @@ import matplotlib.pyplot as plt
 import rasterio
 from pathlib import Path
 import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'application'))
+from utils.scaled import read_layer
 
 # Paths
 OUTPUT_DIR = Path(__file__).parent.parent / 'outputs'
@@ -19,9 +23,9 @@ MAPS_ONLY_DIR.mkdir(exist_ok=True)
 FIRE_BOUNDARY = OUTPUT_DIR.parent / 'data' / 'fire_boundary.geojson'
 
 def load_geotiff(path):
-    """Load a GeoTIFF file"""
+    """Load a GeoTIFF file (scaled-integer layers are decoded to float)"""
     with rasterio.open(path) as src:
-        data = src.read(1)
+        data = read_layer(src)
         bounds = src.bounds
         return data, bounds
 
@@ -0,0 +1,144 @@
+"""
+Incremental updates reach the outputs through the composites
+
+A synthetic 10 m scene grid nests in a 30 m LANDFIRE grid; the composites
+are built from local scenes. A new scene covering one corner is ingested
+(or passed to incremental.py) and only the tiles under it may change.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'application'))
+from pipeline import incremental
+from pipeline.fuel_engine import FuelMapEngine
+from pipeline.incremental import TiledFuelMap
+from pipeline.ingest import IngestService
+from preprocessing.compositing import SCENE_BANDS, Scene, build_composite
+from utils.config import Config
+
+CRS = 'EPSG:32613'
+ORIGIN = (500000.0, 4000000.0)
+LANDFIRE_SIZE = 60
+SCENE_SIZE = 180
+TILE_SIZE = 32
+# Scene pixels of the new acquisitions (LANDFIRE rows / cols 0-29, i.e. tile 0,0)
+CORNER = 90
+
+HEALTHY = {'B2': 0.03, 'B3': 0.05, 'B4': 0.04, 'B8': 0.45, 'B11': 0.12, 'B12': 0.06}
+STRESSED = {'B2': 0.06, 'B3': 0.08, 'B4': 0.14, 'B8': 0.22, 'B11': 0.25, 'B12': 0.2}
+BURNED = {'B2': 0.05, 'B3': 0.06, 'B4': 0.08, 'B8': 0.12, 'B11': 0.22, 'B12': 0.3}
+
+
+def write_scene(path: Path, reflectance: dict, corner: int = None):
+    """6-band scene on the 10 m grid; with corner, valid only in the top-left corner x corner pixels"""
+    data = np.stack([np.full((SCENE_SIZE, SCENE_SIZE), reflectance[band], dtype=np.float32)
+                     for band in SCENE_BANDS])
+    if corner is not None:
+        data[:, corner:, :] = 0
+        data[:, :, corner:] = 0
+    profile = dict(driver='GTiff', height=SCENE_SIZE, width=SCENE_SIZE, count=len(SCENE_BANDS),
+                   dtype='float32', crs=CRS, transform=from_origin(*ORIGIN, 10, 10), nodata=0)
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(data)
+        dst.descriptions = tuple(SCENE_BANDS)
+    return path
+
+
+@pytest.fixture
+def fuel_map(tmp_path):
+    """Incremental fuel map computed from one pre- and one post-fire scene"""
+    config = Config(ROOT_DIR=tmp_path)
+    scene_dir = config.DATA_DIR / 'satellite' / 'scenes'
+    scene_dir.mkdir(parents=True)
+    config.LANDFIRE_DIR.mkdir(parents=True)
+
+    rng = np.random.default_rng(0)
+    profile = dict(driver='GTiff', height=LANDFIRE_SIZE, width=LANDFIRE_SIZE, count=2,
+                   dtype='int16', crs=CRS, transform=from_origin(*ORIGIN, 30, 30))
+    with rasterio.open(config.LANDFIRE_PATH, 'w', **profile) as dst:
+        dst.write(np.full((LANDFIRE_SIZE, LANDFIRE_SIZE), 165, dtype=np.int16), 1)
+        dst.write(rng.integers(5, 30, (LANDFIRE_SIZE, LANDFIRE_SIZE)).astype(np.int16), 2)
+
+    build_composite([Scene.from_path(write_scene(scene_dir / 'S2_20210615.tif', HEALTHY))],
+                    config.SENTINEL_PREFIRE_PATH)
+    build_composite([Scene.from_path(write_scene(scene_dir / 'S2_20220915.tif', BURNED))],
+                    config.SENTINEL_POSTFIRE_PATH)
+
+    engine = FuelMapEngine(config, block_size=TILE_SIZE)
+    fuel_map = TiledFuelMap(engine, config.OUTPUTS_DIR / 'incremental', TILE_SIZE)
+    fuel_map.rebuild()
+    return fuel_map
+
+
+def read_layers(fuel_map: TiledFuelMap) -> dict:
+    layers = {}
+    for name in incremental.LAYERS:
+        with rasterio.open(fuel_map.layer_path(name)) as src:
+            layers[name] = src.read(1)
+    return layers
+
+
+def changed(before: np.ndarray, after: np.ndarray) -> np.ndarray:
+    return ~np.isclose(before, after, equal_nan=True)
+
+
+def test_ingested_prefire_scene_changes_stress_under_its_footprint(fuel_map, tmp_path):
+    before = read_layers(fuel_map)
+    drop_dir = tmp_path / 'incoming'
+    drop_dir.mkdir()
+    write_scene(drop_dir / 'S2_20220301.tif', STRESSED, corner=CORNER)
+
+    service = IngestService(fuel_map, drop_dir, fuel_map.engine.config.DATA_DIR / 'satellite' / 'scenes',
+                            tmp_path / 'state', workers=1, settle_seconds=0)
+    service.poll()
+    service.poll()
+    service.close()
+    assert service.metrics.counters['jobs_completed'] == 1
+
+    after = read_layers(fuel_map)
+    for name in ('stress_score', 'fuel_risk_score', 'enhanced_cbd'):
+        diff = changed(before[name], after[name])
+        assert diff[:CORNER // 3, :CORNER // 3].all(), name
+        assert not diff[TILE_SIZE:, :].any() and not diff[:, TILE_SIZE:].any(), name
+    assert (after['stress_score'][:CORNER // 3, :CORNER // 3] >
+            before['stress_score'][:CORNER // 3, :CORNER // 3]).all()
+
+    with open(fuel_map.output_dir / incremental.SUMMARY_FILE) as f:
+        summary = json.load(f)
+    n = LANDFIRE_SIZE ** 2
+    assert summary['stress_score']['mean'] == pytest.approx(float(after['stress_score'].mean()), rel=1e-6)
+    assert summary['valid_pixels'] == n
+
+
+def test_postfire_footprint_changes_dnbr(fuel_map, tmp_path):
+    before = read_layers(fuel_map)
+    config = fuel_map.engine.config
+    scene = write_scene(config.DATA_DIR / 'satellite' / 'scenes' / 'S2_20221001.tif', HEALTHY,
+                        corner=CORNER)
+    config_path = tmp_path / 'config.json'
+    config_path.write_text(json.dumps({'ROOT_DIR': str(tmp_path)}))
+
+    incremental.main(['--config', str(config_path), '--footprint', str(scene),
+                      '--tile-size', str(TILE_SIZE)])
+
+    after = read_layers(fuel_map)
+    diff = changed(before['dnbr'], after['dnbr'])
+    assert diff[:CORNER // 3, :CORNER // 3].all()
+    assert not diff[TILE_SIZE:, :].any() and not diff[:, TILE_SIZE:].any()
+    # Stress comes from the pre-fire composite only
+    assert not changed(before['stress_score'], after['stress_score']).any()
+
+
+def test_scene_during_fire_is_rejected(fuel_map, tmp_path):
+    config = fuel_map.engine.config
+    scene = write_scene(tmp_path / 'S2_20220601.tif', STRESSED, corner=CORNER)
+    tiles = incremental.footprint_tiles(scene, fuel_map.engine, TILE_SIZE)
+    with pytest.raises(ValueError, match='during the fire'):
+        incremental.fold_scenes(fuel_map.engine, tiles, [scene], config.DATA_DIR)
@@ -0,0 +1,145 @@
+"""
+Streaming validation statistics against full-array float64 references
+
+The stage 04 path holds rasters as float32 and merges per-tile float64
+accumulators; these checks build synthetic tiles and require the merged
+metrics to match the whole-array float64 computations within 1e-6.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from scipy import stats
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'application'))
+from analysis.validation_stats import (ConfusionMatrix, DensityHistogram, PearsonAccumulator,
+                                       ResponseCurve, RISK_SEVERITY_GROUPS, risk_class)
+from utils.tiling import iter_tiles
+
+TOLERANCE = 1e-6
+
+
+@pytest.fixture
+def scene():
+    """Spatially structured predictor / dNBR grids, float32 as stage 04 holds them"""
+    rng = np.random.default_rng(42)
+    rows, cols = np.mgrid[0:700, 0:900]
+    field = np.sin(rows / 60) + np.cos(cols / 45)
+    risk = np.clip(50 + 15 * field + rng.normal(0, 10, field.shape), 0, 100)
+    dnbr = 0.3 + 0.2 * field + 0.004 * (risk - 50) + rng.normal(0, 0.15, field.shape)
+    risk[:20] = np.nan
+    valid = np.isfinite(risk) & (dnbr > -0.5) & (dnbr < 2.0)
+    return risk.astype(np.float32), dnbr.astype(np.float32), valid
+
+
+def _tiles(shape):
+    # An odd tile size so edge tiles are ragged
+    return iter_tiles(*shape, 173)
+
+
+def test_pearson_matches_scipy(scene):
+    risk, dnbr, valid = scene
+    accumulator = PearsonAccumulator()
+    for tile in _tiles(risk.shape):
+        tile_valid = valid[tile.slices]
+        accumulator.update(risk[tile.slices][tile_valid], dnbr[tile.slices][tile_valid])
+    r, p = accumulator.pearson()
+
+    x = risk[valid].astype(np.float64)
+    y = dnbr[valid].astype(np.float64)
+    expected = stats.pearsonr(x, y)
+    assert accumulator.n == valid.sum()
+    assert r == pytest.approx(expected.statistic, abs=TOLERANCE)
+    assert r == pytest.approx(np.corrcoef(x, y)[0, 1], abs=TOLERANCE)
+    assert p == pytest.approx(expected.pvalue, rel=TOLERANCE, abs=1e-300)
+
+
+def test_pearson_merge_and_offset():
+    # Large offset: raw sums of squares would cancel, centred moments must not
+    rng = np.random.default_rng(0)
+    x = 1e4 + rng.normal(0, 1, 100_000)
+    y = 0.5 * x + rng.normal(0, 1, x.size)
+    parts = [PearsonAccumulator() for _ in range(4)]
+    for part, (xs, ys) in zip(parts, zip(np.array_split(x, 4), np.array_split(y, 4))):
+        part.update(xs.astype(np.float32), ys.astype(np.float32))
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+    reference = stats.pearsonr(x.astype(np.float32).astype(np.float64),
+                               y.astype(np.float32).astype(np.float64)).statistic
+    assert merged.pearson()[0] == pytest.approx(reference, abs=TOLERANCE)
+
+
+def test_density_fit_matches_polyfit_with_offset():
+    # Predictor far from zero: raw-sum normal equations lose the slope to cancellation
+    rng = np.random.default_rng(1)
+    x = (1e6 + rng.normal(0, 1, 100_000)).astype(np.float32)
+    y = (0.3 + 0.05 * (x - 1e6) + rng.normal(0, 0.1, x.size)).astype(np.float32)
+    parts = [DensityHistogram((x.min(), x.max()), (-0.5, 2.0)) for _ in range(4)]
+    for part, (xs, ys) in zip(parts, zip(np.array_split(x, 4), np.array_split(y, 4))):
+        part.update(xs, ys)
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+
+    slope, intercept = np.polyfit(x.astype(np.float64), y.astype(np.float64), 1)
+    fit_slope, fit_intercept = merged.linear_fit()
+    assert merged.n == x.size and merged.counts.sum() == x.size
+    assert fit_slope == pytest.approx(slope, rel=TOLERANCE)
+    assert fit_slope * 1e6 + fit_intercept == pytest.approx(slope * 1e6 + intercept, abs=TOLERANCE)
+
+
+def test_pearson_degenerate():
+    accumulator = PearsonAccumulator()
+    accumulator.update(np.ones(10, dtype=np.float32), np.arange(10, dtype=np.float32))
+    assert all(np.isnan(accumulator.pearson()))
+    assert all(np.isnan(PearsonAccumulator().pearson()))
+
+
+def _kappa(pred, obs, n_classes):
+    table = np.zeros((n_classes, n_classes))
+    np.add.at(table, (pred, obs), 1)
+    total = table.sum()
+    p_observed = np.trace(table) / total
+    p_expected = (table.sum(axis=1) @ table.sum(axis=0)) / total ** 2
+    return (p_observed - p_expected) / (1 - p_expected), p_observed
+
+
+def test_confusion_matrix_kappa_matches_full_array(scene):
+    risk, dnbr, valid = scene
+    severity = np.digitize(dnbr, [0.1, 0.27, 0.44, 0.66])
+    table = ConfusionMatrix(3, 5)
+    for tile in _tiles(risk.shape):
+        tile_valid = valid[tile.slices]
+        table.update(risk_class(risk[tile.slices][tile_valid]), severity[tile.slices][tile_valid])
+    agreement = table.to_dict(['Low', 'Moderate', 'High'], list('ABCDE'),
+                              RISK_SEVERITY_GROUPS)['agreement']
+
+    pred = risk_class(risk[valid].astype(np.float64))
+    obs = np.asarray(RISK_SEVERITY_GROUPS)[severity[valid]]
+    kappa, accuracy = _kappa(pred, obs, 3)
+    assert agreement['n'] == valid.sum()
+    assert agreement['cohens_kappa'] == pytest.approx(kappa, abs=TOLERANCE)
+    assert agreement['overall_accuracy'] == pytest.approx(accuracy, abs=TOLERANCE)
+
+
+def test_response_curve_matches_full_array(scene):
+    risk, dnbr, valid = scene
+    curve = ResponseCurve.fixed(0, 100, 10)
+    for tile in _tiles(risk.shape):
+        tile_valid = valid[tile.slices]
+        curve.update(risk[tile.slices][tile_valid], dnbr[tile.slices][tile_valid])
+    bins = curve.to_dict()['bins']
+
+    x = risk[valid].astype(np.float64)
+    y = dnbr[valid].astype(np.float64)
+    index = np.clip(np.searchsorted(curve.edges[1:-1], x, side='right'), 0, 9)
+    for i, entry in enumerate(bins):
+        in_bin = index == i
+        assert entry['count'] == in_bin.sum()
+        if entry['count']:
+            assert entry['dnbr_mean'] == pytest.approx(y[in_bin].mean(), abs=TOLERANCE)
+            assert entry['dnbr_std'] == pytest.approx(y[in_bin].std(), abs=TOLERANCE)
+            assert entry['predictor_mean'] == pytest.approx(x[in_bin].mean(), abs=TOLERANCE)